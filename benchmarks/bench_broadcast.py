@@ -0,0 +1,148 @@
+"""Broadcast to a large seeded users table, crash part way, resume, and check who got the message.
+
+Seeds --users users, then broadcasts through utils.broadcast.Broadcaster to an
+in-process fake bot. The fake's sends go through the real OutboundScheduler at
+--rate messages per second (unlimited by default, to get through a million users
+quickly) and fail for some users: one in 20 has blocked the bot, one in 97 is
+another error. At --crash-at of the users the broadcast is cancelled like a
+killed process, and a new Broadcaster resumes it from the checkpoint. Prints the
+throughput, the resident memory as the broadcast progresses (it should stay flat),
+the counts, and how many users got the message twice (at most one chunk).
+
+    python benchmarks/bench_broadcast.py --users 1000000
+    python benchmarks/bench_broadcast.py --users 600 --rate 30
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Users get sparse ids, like Telegram's
+ID_STRIDE = 7
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+class FakeBot:
+    """Just enough of ExtBot for a broadcast; counts deliveries per user."""
+
+    def __init__(self, rate_limiter, max_user_id):
+        self.rate_limiter = rate_limiter
+        self.deliveries = bytearray(max_user_id + 1)
+        self.sends = 0
+        self.admin_messages = []
+        self.on_send = None
+
+    async def send_message(self, chat_id, text, rate_limit_args=None):
+        return await self.rate_limiter.process_request(self._deliver, (chat_id, text), {}, "sendMessage",
+                                                       {"chat_id": chat_id}, rate_limit_args)
+
+    async def _deliver(self, chat_id, text):
+        from telegram.error import BadRequest, Forbidden
+
+        await asyncio.sleep(0)
+        if chat_id >= len(self.deliveries):
+            self.admin_messages.append(text)
+            return True
+        self.sends += 1
+        if self.on_send:
+            self.on_send()
+        if (chat_id // ID_STRIDE) % 20 == 0:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if (chat_id // ID_STRIDE) % 97 == 0:
+            raise BadRequest("Bad Request: chat not found")
+        self.deliveries[chat_id] = min(255, self.deliveries[chat_id] + 1)
+        return True
+
+def seed(database, users):
+    # Generated in SQL so the seeding leaves nothing in this process's memory
+    with database.transaction() as conn:
+        conn.execute(''' WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?)
+                         INSERT INTO users(id, free_uses_left, purchased_uses) SELECT x * ?, 3, 0 FROM n ''',
+                     (users, ID_STRIDE))
+
+async def run(args):
+    import database
+    from utils.broadcast import Broadcaster
+    from utils.outbound_scheduler import OutboundScheduler
+
+    seed(database, args.users)
+    max_user_id = args.users * ID_STRIDE
+    bot = FakeBot(OutboundScheduler(), max_user_id)
+    bot.admin_chat_id = max_user_id + 1
+    samples = []
+    crash = asyncio.Event()
+
+    def on_send():
+        if bot.sends % max(1, args.users // 10) == 0:
+            samples.append((bot.sends, rss_mib()))
+        if bot.sends == int(args.users * args.crash_at):
+            crash.set()
+
+    bot.on_send = on_send
+    baseline = rss_mib()
+    started = time.perf_counter()
+
+    first = Broadcaster(args.chunk_size, args.concurrency)
+    first.admin_chat_id = bot.admin_chat_id
+    await first.start(bot)
+    broadcast_id = await first.begin(bot, "Exam season promo")
+    crash_wait = asyncio.create_task(crash.wait())
+    await asyncio.wait([first._task, crash_wait], return_when=asyncio.FIRST_COMPLETED)
+    crash_wait.cancel()
+    await first.stop()
+    checkpoint = database.get_running_broadcast()
+
+    second = Broadcaster(args.chunk_size, args.concurrency)
+    second.admin_chat_id = bot.admin_chat_id
+    await second.start(bot)
+    if second._task is not None:
+        await second._task
+    elapsed = time.perf_counter() - started
+
+    reached = sum(1 for count in bot.deliveries if count)
+    twice = sum(1 for count in bot.deliveries if count > 1)
+    _, status, _, _, sent, failed, blocked = database.get_latest_broadcast()
+    return {
+        "broadcast_id": broadcast_id, "elapsed": elapsed, "sends": bot.sends, "baseline": baseline,
+        "samples": samples, "checkpoint": checkpoint, "status": status, "sent": sent, "failed": failed,
+        "blocked": blocked, "reached": reached, "twice": twice, "admin": bot.admin_messages,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--rate", type=float, default=1e6, help="messages per second")
+    parser.add_argument("--crash-at", type=float, default=0.4013, help="fraction of users sent before the crash")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    os.environ.update(
+        DB_NAME=os.path.join(tempfile.mkdtemp(), "broadcast.db"),
+        OUTBOUND_GLOBAL_RATE=str(args.rate),
+        OUTBOUND_CHAT_RATE=str(args.rate),
+    )
+
+    result = asyncio.run(run(args))
+    expected_blocked = sum(1 for i in range(1, args.users + 1) if i % 20 == 0)
+    expected_failed = sum(1 for i in range(1, args.users + 1) if i % 20 and i % 97 == 0)
+    print(f"broadcast #{result['broadcast_id']} to {args.users} users, crashed at {args.crash_at:.0%}, "
+          f"checkpoint after user {result['checkpoint'][2] if result['checkpoint'] else '-'}")
+    print(f"{result['sends']} sends in {result['elapsed']:.1f}s ({result['sends'] / result['elapsed']:.0f}/s)")
+    print(f"\nresident memory: {result['baseline']:.1f} MiB before sending")
+    for sends, rss in result["samples"]:
+        print(f"  after {sends:9d} sends  {rss:7.1f} MiB")
+    print(f"\nstatus {result['status']}: sent {result['sent']}, failed {result['failed']} "
+          f"(expected {expected_failed}), blocked {result['blocked']} (expected {expected_blocked})")
+    print(f"users reached: {result['reached']} of {args.users - expected_blocked - expected_failed} reachable, "
+          f"{result['twice']} twice (chunk size {args.chunk_size})")
+    print(f"admin was told: {result['admin'][-1]!r}" if result["admin"] else "admin was not told")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Measure cold-start cost of the serverless entry point (netlify/functions/bot.py).
+
+Each run starts a fresh Python process, like a cold container, against local stubs of
+the Bot API and the Anthropic API, and reports:
+
+  import       importing the entry module
+  app          building the Application, registering handlers, migrating the schema
+  first        the first update (a purchase-menu callback)
+  second       the next update on the same, now warm, process (/start)
+  process      wall time of the whole process as seen from outside
+
+--eager imports the SDK and every handler module up front, as the entry point used to.
+
+    python benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubLLM, StubTelegram
+
+ROOT = Path(__file__).resolve().parent.parent
+ENTRY_POINT = ROOT / "netlify" / "functions" / "bot.py"
+
+USER = {"id": 42, "is_bot": False, "first_name": "Student"}
+CHAT = {"id": 42, "type": "private"}
+CALLBACK_UPDATE = {
+    "update_id": 1,
+    "callback_query": {
+        "id": "1", "from": USER, "chat_instance": "1", "data": "purchase_custom",
+        "message": {"message_id": 1, "date": 0, "chat": CHAT, "text": "Select a purchase option"},
+    },
+}
+START_UPDATE = {
+    "update_id": 2,
+    "message": {
+        "message_id": 2, "date": 0, "chat": CHAT, "from": USER, "text": "/start",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+CHILD = """
+import importlib.util, json, sys, time
+timings = {}
+started = time.perf_counter()
+if %(eager)r:
+    import anthropic, handlers.start, handlers.evaluate, handlers.feedback, utils.user_management
+spec = importlib.util.spec_from_file_location("bot", %(entry)r)
+bot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bot)
+timings["import"] = time.perf_counter() - started
+mark = time.perf_counter()
+bot.get_application()
+timings["app"] = time.perf_counter() - mark
+for name, update in (("first", %(first)r), ("second", %(second)r)):
+    mark = time.perf_counter()
+    bot.handle_update(update)
+    timings[name] = time.perf_counter() - mark
+sys.__stderr__.write("TIMINGS " + json.dumps(timings) + "\\n")
+"""
+
+def run_once(env, eager):
+    code = CHILD % {
+        "eager": eager,
+        "entry": str(ENTRY_POINT),
+        "first": json.dumps(CALLBACK_UPDATE),
+        "second": json.dumps(START_UPDATE),
+    }
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    lines = [line for line in result.stderr.splitlines() if line.startswith("TIMINGS ")]
+    if not lines:
+        raise RuntimeError(result.stderr)
+    timings = json.loads(lines[-1][len("TIMINGS "):])
+    timings["process"] = elapsed
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--eager", action="store_true")
+    args = parser.parse_args()
+
+    with StubTelegram() as telegram, StubLLM(latency=0.0) as llm:
+        env = dict(
+            os.environ,
+            TELEGRAM_BOT_TOKEN="123:stub",
+            TELEGRAM_API_BASE_URL=telegram.url,
+            ANTHROPIC_BASE_URL=llm.url,
+            ANTHROPIC_API_KEY="stub-key",
+            DB_NAME=os.path.join(tempfile.mkdtemp(), "cold.db"),
+        )
+        runs = [run_once(env, args.eager) for _ in range(args.runs)]
+
+    print(f"mode: {'eager imports' if args.eager else 'fast start'}, runs: {args.runs} (first run also creates the schema)")
+    for name in ("import", "app", "first", "second", "process"):
+        values = [run[name] * 1000 for run in runs]
+        print(f"{name:8s} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+
+if __name__ == "__main__":
+    main()
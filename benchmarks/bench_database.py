@@ -0,0 +1,110 @@
+"""Compare database throughput before and after the persistent WAL connection layer.
+
+Runs the database work of an essay submission (add_user, get_user, quota reads and
+a decrement) from many concurrent handlers, once with the old connect-per-call
+helpers run inline on the event loop and once through database.run().
+
+    python benchmarks/bench_database.py --handlers 50 --iterations 40
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+OPS_PER_SUBMISSION = 5
+
+class LegacyDatabase:
+    """The connect, execute, close helpers database.py used to have."""
+
+    def __init__(self, path):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, phone_number TEXT, "
+            "usage_count INTEGER DEFAULT 0, free_uses_left INTEGER DEFAULT 3, purchased_uses INTEGER DEFAULT 0)"
+        )
+        conn.commit()
+        conn.close()
+
+    def _query(self, sql, args):
+        conn = sqlite3.connect(self.path)
+        cur = conn.cursor()
+        cur.execute(sql, args)
+        result = cur.fetchone()
+        conn.close()
+        return result
+
+    def _write(self, sql, args):
+        conn = sqlite3.connect(self.path)
+        conn.cursor().execute(sql, args)
+        conn.commit()
+        conn.close()
+
+    def add_user(self, user_id):
+        self._write("INSERT OR IGNORE INTO users(id, free_uses_left, purchased_uses) VALUES(?, 3, 0)", (user_id,))
+
+    def get_user(self, user_id):
+        return self._query("SELECT * FROM users WHERE id = ?", (user_id,))
+
+    def get_free_uses_left(self, user_id):
+        return self._query("SELECT free_uses_left FROM users WHERE id = ?", (user_id,))
+
+    def get_purchased_uses(self, user_id):
+        return self._query("SELECT purchased_uses FROM users WHERE id = ?", (user_id,))
+
+    def decrement_free_uses(self, user_id):
+        self._write("UPDATE users SET free_uses_left = free_uses_left - 1 WHERE id = ? AND free_uses_left > 0", (user_id,))
+
+async def legacy_submission(db, user_id):
+    db.add_user(user_id)
+    db.get_user(user_id)
+    db.get_free_uses_left(user_id)
+    db.get_purchased_uses(user_id)
+    db.decrement_free_uses(user_id)
+
+async def pooled_submission(database, user_id):
+    await database.run(database.add_user, user_id)
+    await database.run(database.get_user, user_id)
+    await database.run(database.get_free_uses_left, user_id)
+    await database.run(database.get_purchased_uses, user_id)
+    await database.run(database.decrement_free_uses, user_id)
+
+async def drive(submission, db, handlers, iterations):
+    async def handler(worker):
+        for i in range(iterations):
+            await submission(db, worker * iterations + i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(worker) for worker in range(handlers)))
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=40)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(tmp, "pooled.db")
+    import database
+
+    legacy = LegacyDatabase(os.path.join(tmp, "legacy.db"))
+    ops = args.handlers * args.iterations * OPS_PER_SUBMISSION
+
+    legacy_elapsed = asyncio.run(drive(legacy_submission, legacy, args.handlers, args.iterations))
+    pooled_elapsed = asyncio.run(drive(pooled_submission, database, args.handlers, args.iterations))
+    database.close_connections()
+
+    print(f"concurrent handlers: {args.handlers}, submissions each: {args.iterations}, ops: {ops}")
+    print(f"connect-per-call: {ops / legacy_elapsed:10.0f} ops/s ({legacy_elapsed:.2f}s)")
+    print(f"persistent WAL:   {ops / pooled_elapsed:10.0f} ops/s ({pooled_elapsed:.2f}s)")
+    print(f"speedup:          {legacy_elapsed / pooled_elapsed:10.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Measure how responsive the event loop stays while essays are being evaluated.
+
+Starts a local stub of the Anthropic API, puts N evaluations in flight and meanwhile
+runs a stand-in for a cheap update handler (/start, a menu tap) every few milliseconds,
+recording how long each one waited to run.
+
+    python benchmarks/bench_event_loop.py --essays 20 --llm-latency 2
+    python benchmarks/bench_event_loop.py --legacy   # the old blocking client, for comparison
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubLLM, percentile
+
+async def probe_updates(stop, interval, lags):
+    """Schedule a trivial handler every ``interval`` seconds and record its delay."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        scheduled = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - scheduled - interval))
+
+async def run(args):
+    from utils import essay_analysis
+
+    if args.legacy:
+        import anthropic
+        sync_client = anthropic.Anthropic(base_url=os.environ["ANTHROPIC_BASE_URL"])
+
+        async def evaluate(i):
+            # What analyze_essay used to do: a synchronous call inside a coroutine
+            sync_client.messages.create(
+                model=essay_analysis.MODEL,
+                max_tokens=essay_analysis.MAX_TOKENS,
+                messages=[{"role": "user", "content": f"essay {i}"}],
+            )
+    else:
+        async def evaluate(i):
+            await essay_analysis.analyze_essay(f"topic {i}", f"essay {i}")
+
+    lags = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_updates(stop, args.probe_interval, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(evaluate(i) for i in range(args.essays)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    if args.legacy:
+        sync_client.close()
+    else:
+        await essay_analysis.close_client()
+
+    lags_ms = [lag * 1000 for lag in lags] or [0.0]
+    print(f"mode:              {'legacy sync client' if args.legacy else 'async pooled client'}")
+    print(f"essays in flight:  {args.essays} (concurrency cap {essay_analysis.MAX_CONCURRENT_EVALUATIONS})")
+    print(f"stub LLM latency:  {args.llm_latency:.2f}s")
+    print(f"total wall time:   {elapsed:.2f}s")
+    print(f"updates served:    {len(lags)}")
+    print(
+        "update latency ms: "
+        f"p50={statistics.median(lags_ms):.2f} p95={percentile(lags_ms, 95):.2f} "
+        f"p99={percentile(lags_ms, 99):.2f} max={max(lags_ms):.2f}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--essays", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    with StubLLM(latency=args.llm_latency) as stub:
+        os.environ["ANTHROPIC_BASE_URL"] = stub.url
+        os.environ.setdefault("ANTHROPIC_API_KEY", "stub-key")
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
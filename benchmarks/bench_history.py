@@ -0,0 +1,118 @@
+"""Time the /history queries on a large seeded evaluations table.
+
+Seeds --rows evaluations spread over --users users, plus one heavy user owning
+--heavy-rows of them, then times the queries /history and "view again" make
+through database.py: the first page, a page deep into the heavy user's history
+by keyset (id < cursor) and, for comparison, by OFFSET, a stored report, and the
+latest evaluation on a topic. Prints each query's plan, so a missing index shows up
+as a SCAN.
+
+    python benchmarks/bench_history.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+HEAVY_USER = 1
+
+def seed(database, args):
+    from utils.evaluation_history import topic_hash
+
+    conn = database.get_connection()
+    rng = random.Random(0)
+    report = "x" * args.report_bytes
+    topics = [(f"Topic {i}", topic_hash(f"Topic {i}")) for i in range(200)]
+    light = args.rows - args.heavy_rows
+    # The heavy user's rows are interleaved with everyone else's, as they would be in production
+    owners = [HEAVY_USER] * args.heavy_rows + [rng.randrange(2, args.users + 2) for _ in range(light)]
+    rng.shuffle(owners)
+    started = time.perf_counter()
+    batch = 50000
+    for offset in range(0, len(owners), batch):
+        rows = []
+        for i, user_id in enumerate(owners[offset:offset + batch], offset):
+            topic, digest = topics[rng.randrange(len(topics))]
+            rows.append((user_id, 1.7e9 + i, digest, topic, rng.randrange(8, 18) / 2, None, report))
+        with database.transaction() as conn:
+            conn.executemany(''' INSERT INTO evaluations(user_id, created_at, topic_hash, topic, overall_band,
+                                                          criteria_bands, report) VALUES(?, ?, ?, ?, ?, ?, ?) ''', rows)
+    return time.perf_counter() - started
+
+def offset_page(database, user_id, offset, limit):
+    """The OFFSET query keyset pagination replaces, for comparison."""
+    cur = database.get_connection().execute(''' SELECT id, created_at, topic, overall_band FROM evaluations
+                                               WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ? ''',
+                                            (user_id, limit, offset))
+    return cur.fetchall()
+
+def timed(func, args, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2], times[min(len(times) - 1, int(len(times) * 0.99))]
+
+def plan(database, sql, params):
+    rows = database.get_connection().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return "; ".join(row[-1] for row in rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--heavy-rows", type=int, default=50000, help="evaluations of the one heavy user")
+    parser.add_argument("--report-bytes", type=int, default=200, help="size of each stored report")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(), "history.db")
+    import database
+    from config import HISTORY_PAGE_SIZE
+    from utils.evaluation_history import topic_hash
+
+    elapsed = seed(database, args)
+    print(f"seeded {args.rows} evaluations for {args.users + 1} users in {elapsed:.1f}s "
+          f"({os.path.getsize(os.environ['DB_NAME']) / 2 ** 20:.0f} MiB)")
+
+    conn = database.get_connection()
+    ids = [row[0] for row in conn.execute("SELECT id FROM evaluations WHERE user_id = ? ORDER BY id DESC",
+                                          (HEAVY_USER,))]
+    depth = len(ids) * 9 // 10
+    deep_cursor = ids[depth - 1]
+    light_user = conn.execute("SELECT user_id FROM evaluations WHERE user_id != ? LIMIT 1", (HEAVY_USER,)).fetchone()[0]
+    limit = HISTORY_PAGE_SIZE + 1
+
+    cases = [
+        ("first page, typical user", database.get_evaluation_history, (light_user, None, limit)),
+        ("first page, heavy user", database.get_evaluation_history, (HEAVY_USER, None, limit)),
+        (f"keyset page at row {depth}", database.get_evaluation_history, (HEAVY_USER, deep_cursor, limit)),
+        (f"OFFSET page at row {depth}", lambda *a: offset_page(database, *a), (HEAVY_USER, depth, limit)),
+        ("view again", database.get_evaluation, (HEAVY_USER, ids[depth])),
+        ("latest on a topic", database.get_latest_evaluation_for_topic, (HEAVY_USER, topic_hash("Topic 7"))),
+    ]
+    print(f"\n{'query':28s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for name, func, params in cases:
+        p50, p99 = timed(func, params, args.repeat)
+        print(f"{name:28s} {p50 * 1000:8.3f} {p99 * 1000:8.3f}")
+
+    print("\nquery plans:")
+    for name, sql, params in [
+        ("keyset page", "SELECT id, created_at, topic, overall_band FROM evaluations WHERE user_id = ? AND id < ? "
+                        "ORDER BY id DESC LIMIT ?", (HEAVY_USER, deep_cursor, limit)),
+        ("view again", "SELECT created_at, topic, report FROM evaluations WHERE id = ? AND user_id = ?",
+         (ids[depth], HEAVY_USER)),
+        ("latest on a topic", "SELECT id FROM evaluations WHERE user_id = ? AND topic_hash = ? ORDER BY id DESC LIMIT 1",
+         (HEAVY_USER, topic_hash("Topic 7"))),
+    ]:
+        print(f"  {name}: {plan(database, sql, params)}")
+
+if __name__ == "__main__":
+    main()
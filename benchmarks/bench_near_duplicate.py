@@ -0,0 +1,139 @@
+"""Build the near-duplicate index over many essays and time lookups against it.
+
+Generates --essays synthetic essays of about --words words each from a shared
+vocabulary and indexes them through utils.near_duplicate into a fresh database.
+Then looks up --queries essays of three kinds:
+
+    copy N% an indexed essay with N% of its words replaced, inserted or dropped (--edits)
+    reword  an indexed essay with half its sentences rewritten
+    fresh   a new essay, which should match nothing
+
+and reports the lookup time (signature, LSH candidates in SQLite and comparison),
+how often each kind was found at NEAR_DUPLICATE_THRESHOLD, and the candidates
+compared per lookup.
+
+    python benchmarks/bench_near_duplicate.py --essays 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import percentile
+
+def make_vocabulary(rng, size):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(2, 9))) for _ in range(size)]
+
+def make_essay(rng, vocabulary, words):
+    sentences, count = [], 0
+    while count < words:
+        length = rng.randint(8, 20)
+        sentences.append(" ".join(rng.choice(vocabulary) for _ in range(length)).capitalize() + ".")
+        count += length
+    return " ".join(sentences)
+
+def edit_essay(rng, vocabulary, essay, fraction):
+    words = essay.split()
+    for _ in range(max(1, int(len(words) * fraction))):
+        i = rng.randrange(len(words))
+        action = rng.random()
+        if action < 0.6:
+            words[i] = rng.choice(vocabulary)
+        elif action < 0.8:
+            words.insert(i, rng.choice(vocabulary))
+        elif len(words) > 1:
+            del words[i]
+    return " ".join(words)
+
+def reword_essay(rng, vocabulary, essay):
+    sentences = essay.split(". ")
+    for i in range(0, len(sentences), 2):
+        sentences[i] = " ".join(rng.choice(vocabulary) for _ in sentences[i].split())
+    return ". ".join(sentences)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--essays", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=280)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=1000, help="lookups of each kind")
+    parser.add_argument("--edits", default="0.01,0.03,0.05,0.1", help="fractions of words the copies change")
+    args = parser.parse_args()
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(), "near_duplicate.db")
+
+    import database
+    from utils import near_duplicate
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(rng, args.vocabulary)
+    kept = []
+    signing = 0.0
+    started = time.perf_counter()
+    batch = 2000
+    for first in range(0, args.essays, batch):
+        rows = []
+        for evaluation_id in range(first + 1, min(args.essays, first + batch) + 1):
+            essay = make_essay(rng, vocabulary, args.words)
+            if evaluation_id % max(1, args.essays // args.queries) == 0:
+                kept.append(essay)
+            signed = time.perf_counter()
+            sig = near_duplicate.signature(essay)
+            rows.append((evaluation_id, sig, near_duplicate.band_keys(sig), essay))
+            signing += time.perf_counter() - signed
+        # Batched like a bulk import; the bot indexes one essay per evaluation with index_essay()
+        with database.transaction() as conn:
+            conn.executemany("INSERT INTO essay_signatures(evaluation_id, topic_hash, signature, essay) VALUES(?, '', ?, ?)",
+                             [(evaluation_id, sig.tobytes(), essay) for evaluation_id, sig, _, essay in rows])
+            conn.executemany("INSERT OR IGNORE INTO essay_lsh_bands(band_key, evaluation_id) VALUES(?, ?)",
+                             [(key, evaluation_id) for evaluation_id, _, keys, _ in rows for key in keys])
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for evaluation_id in range(args.essays + 1, args.essays + 101):
+        near_duplicate.index_essay(evaluation_id, 0, "", make_essay(rng, vocabulary, args.words))
+    add_one = (time.perf_counter() - started) / 100
+
+    size = os.path.getsize(os.environ["DB_NAME"]) / 2 ** 20
+    print(f"indexed {args.essays} essays of ~{args.words} words in {build:.1f}s "
+          f"(signatures {signing / args.essays * 1e6:.0f} us each, database {size:.0f} MiB); "
+          f"adding one essay takes {add_one * 1000:.2f} ms")
+    print(f"threshold {near_duplicate.NEAR_DUPLICATE_THRESHOLD}, {near_duplicate.BANDS} bands of {near_duplicate.ROWS}")
+
+    sample = kept[:args.queries]
+    kinds = {f"copy {float(edit):.0%}": [edit_essay(rng, vocabulary, essay, float(edit)) for essay in sample]
+             for edit in args.edits.split(",")}
+    kinds.update({
+        "reword": [reword_essay(rng, vocabulary, essay) for essay in sample],
+        "fresh": [make_essay(rng, vocabulary, args.words) for _ in sample],
+    })
+    real_candidates = database.get_essay_signature_candidates
+    print(f"\n{'kind':9s} {'found':>7s} {'similarity':>11s} {'candidates':>11s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for kind, essays in kinds.items():
+        times, found, scores, candidates = [], 0, [], []
+
+        def counting(keys):
+            rows = real_candidates(keys)
+            candidates.append(len(rows))
+            return rows
+
+        database.get_essay_signature_candidates = counting
+        for essay in essays:
+            started = time.perf_counter()
+            match = near_duplicate.find_near_duplicate(essay)
+            times.append(time.perf_counter() - started)
+            if match is not None:
+                found += 1
+                scores.append(match.similarity)
+        database.get_essay_signature_candidates = real_candidates
+        mean_score = f"{sum(scores) / len(scores):.2f}" if scores else "-"
+        print(f"{kind:9s} {found / len(essays):7.1%} {mean_score:>11s} {sum(candidates) / len(candidates):11.1f} "
+              f"{percentile(times, 50) * 1000:8.3f} {percentile(times, 99) * 1000:8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Send a realistic burst of Bot API messages to a stub that enforces Telegram's flood limits.
+
+For --seconds, a new user is answered every 1/--users-per-second seconds with
+--replies messages to their chat. Feedback notices go to the admin chat at
+--notices-per-second, and a --broadcast of messages, one per chat, starts at once.
+The stub answers 429 to more than --global-limit messages in any second, or more
+than --chat-limit to one chat. Each mode sends the same traffic:
+
+    none       no rate limiter: whatever Telegram rejects is lost
+    scheduler  utils.outbound_scheduler.OutboundScheduler, notices sent one by one
+    digest     the scheduler, with the notices collected into one message every
+               --digest-interval seconds, as FEEDBACK_DIGEST_INTERVAL does
+
+Reports per priority class the messages delivered and lost, and the latency from
+the moment a message was due to its delivery.
+
+    python benchmarks/bench_outbound.py --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubTelegram, percentile
+
+ADMIN_CHAT = 999
+
+async def run_mode(mode, args, stub):
+    from telegram.error import RetryAfter
+    from telegram.ext import ExtBot
+    from utils.instrumented_request import InstrumentedRequest
+    from utils.outbound_scheduler import BULK, INTERACTIVE, NOTICE, OutboundScheduler, rate_limit_args
+
+    limiter = None if mode == "none" else OutboundScheduler()
+    bot = ExtBot("1:stub", base_url=f"{stub.url}/bot", request=InstrumentedRequest(), rate_limiter=limiter)
+    await bot.initialize()
+    latencies = {"interactive": [], "notice": [], "bulk": []}
+    lost = {"interactive": 0, "notice": 0, "bulk": 0}
+    delivered = {"interactive": 0, "notice": 0, "bulk": 0}
+
+    async def send(kind, priority, chat_id, text, due, count=1):
+        try:
+            await bot.send_message(chat_id, text, **rate_limit_args(bot, priority))
+        except RetryAfter:
+            lost[kind] += count
+            return
+        delivered[kind] += count
+        latencies[kind].append(time.monotonic() - due)
+
+    async def answer_user(chat_id, due):
+        # A reply and the menu after it, in order, as the handlers send them
+        for reply in range(args.replies):
+            await send("interactive", INTERACTIVE, chat_id, f"reply {reply}", due)
+
+    tasks = []
+    pending_notices = []
+    started = time.monotonic()
+
+    async def flush_digest():
+        while pending_notices:
+            count = len(pending_notices)
+            due = pending_notices[0]
+            del pending_notices[:count]
+            # Latency is counted from the oldest notice in the digest
+            await send("notice", NOTICE, ADMIN_CHAT, f"digest of {count}", due, count)
+
+    tasks += [asyncio.create_task(send("bulk", BULK, 100000 + i, "broadcast", started)) for i in range(args.broadcast)]
+    users = int(args.seconds * args.users_per_second)
+    notices = int(args.seconds * args.notices_per_second)
+    events = sorted([(i / args.users_per_second, "user", i) for i in range(users)] +
+                    [(i / args.notices_per_second, "notice", i) for i in range(notices)])
+    next_digest = args.digest_interval
+    for at, kind, i in events:
+        while mode == "digest" and at >= next_digest:
+            tasks.append(asyncio.create_task(flush_digest()))
+            next_digest += args.digest_interval
+        await asyncio.sleep(max(0.0, started + at - time.monotonic()))
+        due = time.monotonic()
+        if kind == "user":
+            tasks.append(asyncio.create_task(answer_user(1 + i, due)))
+        elif mode == "digest":
+            pending_notices.append(due)
+        else:
+            tasks.append(asyncio.create_task(send("notice", NOTICE, ADMIN_CHAT, f"feedback {i}", due)))
+    if mode == "digest":
+        await asyncio.sleep(max(0.0, started + next_digest - time.monotonic()))
+        tasks.append(asyncio.create_task(flush_digest()))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    await bot.shutdown()
+    return {"mode": mode, "elapsed": elapsed, "latencies": latencies, "lost": lost, "delivered": delivered}
+
+async def run(args):
+    results = []
+    for mode in ("none", "scheduler", "digest"):
+        with StubTelegram(global_limit=args.global_limit, chat_limit=args.chat_limit) as stub:
+            result = await run_mode(mode, args, stub)
+            result["rejected"] = sum(stub.rejected.values())
+            result["messages"] = len(stub.accepted)
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--users-per-second", type=float, default=8)
+    parser.add_argument("--replies", type=int, default=2, help="messages sent to each user")
+    parser.add_argument("--notices-per-second", type=float, default=3)
+    parser.add_argument("--broadcast", type=int, default=100, help="bulk messages queued at the start")
+    parser.add_argument("--digest-interval", type=float, default=5)
+    parser.add_argument("--global-limit", type=int, default=30)
+    parser.add_argument("--chat-limit", type=int, default=3)
+    args = parser.parse_args()
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:stub")
+
+    results = asyncio.run(run(args))
+    print(f"{args.seconds:.0f}s of traffic: {args.users_per_second:g} users/s x {args.replies} replies, "
+          f"{args.notices_per_second:g} notices/s to one admin chat, {args.broadcast} broadcast messages; "
+          f"limits {args.global_limit}/s overall, {args.chat_limit}/s per chat")
+    print(f"\n{'mode':10s} {'class':12s} {'delivered':>9s} {'lost':>5s} {'p50 s':>7s} {'p95 s':>7s} {'max s':>7s}")
+    for result in results:
+        for kind in ("interactive", "notice", "bulk"):
+            latencies = result["latencies"][kind]
+            print(f"{result['mode']:10s} {kind:12s} {result['delivered'][kind]:9d} {result['lost'][kind]:5d} "
+                  f"{percentile(latencies, 50):7.2f} {percentile(latencies, 95):7.2f} "
+                  f"{max(latencies) if latencies else float('nan'):7.2f}")
+        print(f"{result['mode']:10s} {'':12s} {result['messages']} messages sent, {result['rejected']} answered 429, "
+              f"done in {result['elapsed']:.1f}s\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compare one-call evaluations with the parallel per-criterion mode on a stub model.
+
+The stub answers every request with a text filling --fill of its max_tokens, one
+word per token, and takes --token-latency seconds per token after --latency
+seconds to the first. The single call writes up to 1024 tokens, and each of the
+four criterion requests up to 400, so generation time is what the modes trade.
+Reports latency per evaluation (to the first streamed text and to the whole
+report), model requests and tokens.
+
+    python benchmarks/bench_parallel_scoring.py --essays 16 --concurrency 4
+    python benchmarks/bench_parallel_scoring.py --stream
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubLLM, percentile
+
+ESSAY = ("Many people believe that public transport deserves more investment than new roads. "
+         "In my opinion, this view is largely correct, although roads still matter in rural areas. ") * 8
+
+def tokens():
+    from utils import metrics
+    return {key[0]: value for key, value in metrics.llm_tokens.samples()}
+
+async def run_mode(mode, args, llm):
+    from utils import essay_analysis
+
+    essay_analysis.EVALUATION_MODE = mode
+    slots = asyncio.Semaphore(args.concurrency)
+    first, total, reports = [], [], []
+
+    async def evaluate(i):
+        async with slots:
+            started = time.perf_counter()
+            if args.stream:
+                text = ""
+                async for delta in essay_analysis.stream_evaluation(f"Topic {i}", ESSAY, user_id=i):
+                    if not text:
+                        first.append(time.perf_counter() - started)
+                    text += delta
+            else:
+                text = await essay_analysis.evaluate(f"Topic {i}", ESSAY, user_id=i)
+            total.append(time.perf_counter() - started)
+            reports.append(text)
+
+    requests, used = llm.requests, tokens()
+    started = time.perf_counter()
+    await asyncio.gather(*(evaluate(i) for i in range(args.essays)))
+    elapsed = time.perf_counter() - started
+    after = tokens()
+    bands = [essay_analysis.extract_overall_band(report) for report in reports]
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "first": first,
+        "total": total,
+        "requests": llm.requests - requests,
+        "tokens": {kind: after.get(kind, 0) - used.get(kind, 0) for kind in after},
+        "bands": sorted(set(bands), key=str),
+    }
+
+async def run(args, llm):
+    from utils import essay_analysis
+
+    results = [await run_mode(mode, args, llm) for mode in ("single", "parallel")]
+    await essay_analysis.close_client()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--essays", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4, help="evaluations in flight at once")
+    parser.add_argument("--latency", type=float, default=0.8, help="seconds to the first token")
+    parser.add_argument("--token-latency", type=float, default=0.015, help="seconds per output token")
+    parser.add_argument("--fill", type=float, default=0.7, help="fraction of max_tokens each answer uses")
+    parser.add_argument("--stream", action="store_true", help="stream the reports, as the bot does by default")
+    args = parser.parse_args()
+
+    with StubLLM(latency=args.latency, token_latency=args.token_latency, fill=args.fill) as llm:
+        os.environ.update(
+            ANTHROPIC_BASE_URL=llm.url,
+            ANTHROPIC_API_KEY="stub-key",
+            DB_NAME=os.path.join(tempfile.mkdtemp(), "scoring.db"),
+            LLM_REQUESTS_PER_MINUTE="100000",
+            LLM_TOKENS_PER_MINUTE="100000000",
+        )
+        results = asyncio.run(run(args, llm))
+
+    print(f"essays: {args.essays}, {args.concurrency} at once, first token {args.latency:.2f}s, "
+          f"{args.token_latency * 1000:.0f} ms per token, answers fill {args.fill:.0%} of max_tokens"
+          f"{', streamed' if args.stream else ''}")
+    print(f"\n{'mode':10s} {'p50 s':>7s} {'p95 s':>7s} {'first p50 s':>12s} {'wall s':>7s} {'requests':>9s} "
+          f"{'input tok':>10s} {'output tok':>11s}  overall bands")
+    for result in results:
+        total, first = result["total"], result["first"]
+        input_tokens = sum(result["tokens"].get(kind, 0) for kind in ("input", "cache_creation", "cache_read"))
+        print(f"{result['mode']:10s} {percentile(total, 50):7.2f} {percentile(total, 95):7.2f} "
+              f"{percentile(first, 50) if first else float('nan'):12.2f} {result['elapsed']:7.2f} "
+              f"{result['requests']:9d} {input_tokens:10.0f} {result['tokens'].get('output', 0):11.0f}  {result['bands']}")
+
+if __name__ == "__main__":
+    main()
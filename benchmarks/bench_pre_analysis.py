@@ -0,0 +1,52 @@
+"""Throughput of the local pre-analysis stage that screens essays before the LLM call.
+
+    python benchmarks/bench_pre_analysis.py --essays 5000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import pre_analysis
+
+VOCABULARY = (
+    "people society government education technology children important believe however moreover "
+    "therefore the a of to and in that is for it as with be on not this are by many some students "
+    "economy environment cities public transport health benefits problems solutions individuals"
+).split()
+
+def make_essay(rng, words):
+    sentences, paragraph = [], []
+    while sum(len(s.split()) for s in sentences) < words:
+        sentence = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(12, 25)))
+        paragraph.append(sentence.capitalize() + ".")
+        if len(paragraph) == 4:
+            sentences.append(" ".join(paragraph))
+            paragraph = []
+    return "\n\n".join(sentences + [" ".join(paragraph)])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--essays", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    essays = [make_essay(rng, args.words) for _ in range(args.essays)]
+    essays[::10] = ["https://example.com/my-essay"] * len(essays[::10])
+
+    verdicts = {}
+    started = time.perf_counter()
+    for essay in essays:
+        verdict, _ = pre_analysis.screen(pre_analysis.analyze_text(essay))
+        verdicts[verdict] = verdicts.get(verdict, 0) + 1
+    elapsed = time.perf_counter() - started
+
+    print(f"essays: {args.essays} (~{args.words} words), verdicts: {verdicts}")
+    print(f"throughput: {args.essays / elapsed:.0f} essays/s, {elapsed / args.essays * 1e6:.0f} us per essay")
+
+if __name__ == "__main__":
+    main()
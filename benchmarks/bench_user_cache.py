@@ -0,0 +1,116 @@
+"""Measure the user cache: memory per cached user, hit rate and lookup time.
+
+Seeds --users users, then:
+
+    memory   fills the cache with USER_CACHE_MAX_ENTRIES users and reports the bytes
+             allocated per cached user (tracemalloc), next to the same records as
+             a class without __slots__, as models.User was before
+    lookups  runs --lookups get_user() calls for users drawn from a Zipf-like
+             distribution (a few users are very active) and reports the hit rate
+             and the time per lookup, against database.get_user() on the executor
+
+    python benchmarks/bench_user_cache.py --users 100000 --lookups 200000
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+class DictUser:
+    """models.User without __slots__."""
+
+    def __init__(self, id, phone_number, usage_count, free_uses_left, purchased_uses):
+        self.id = id
+        self.phone_number = phone_number
+        self.usage_count = usage_count
+        self.free_uses_left = free_uses_left
+        self.purchased_uses = purchased_uses
+
+def seed(database, users):
+    with database.transaction() as conn:
+        conn.execute(''' WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?)
+                         INSERT INTO users(id, phone_number, free_uses_left, purchased_uses)
+                         SELECT 100000000 + x, '+4479' || (10000000 + x), 3, x % 7 FROM n ''', (users,))
+
+async def fill(user_cache, user_ids):
+    for user_id in user_ids:
+        await user_cache.get_user(user_id)
+
+def bytes_per_entry(build, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del kept
+    return size / count
+
+async def run(args):
+    import database
+    from config import USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL
+    from utils import user_cache
+
+    seed(database, args.users)
+    first = 100000001
+    count = min(USER_CACHE_MAX_ENTRIES, args.users)
+    rows = [database.get_user(user_id) for user_id in range(first, first + count)]
+
+    # Rows are read before measuring, so only what the cache keeps is counted
+    def slots_cache():
+        entries = collections.OrderedDict()
+        for row in rows:
+            entries[row[0]] = (time.monotonic() + USER_CACHE_TTL, user_cache.User(*row))
+        return entries
+
+    def dict_cache():
+        entries = collections.OrderedDict()
+        for row in rows:
+            entries[row[0]] = (time.monotonic() + USER_CACHE_TTL, DictUser(*row))
+        return entries
+
+    print(f"memory per cached user ({count} users): {bytes_per_entry(slots_cache, count):.0f} bytes with __slots__, "
+          f"{bytes_per_entry(dict_cache, count):.0f} bytes without")
+    await fill(user_cache, range(first, first + count))
+    print(f"cache filled through get_user(): {user_cache.stats()['entries']} entries")
+
+    user_cache.clear()
+    rng = random.Random(0)
+    weights = [1 / rank ** args.zipf for rank in range(1, args.users + 1)]
+    picks = [first + index for index in rng.choices(range(args.users), weights=weights, k=args.lookups)]
+    hits_before = dict(user_cache._stats)
+    started = time.perf_counter()
+    for user_id in picks:
+        await user_cache.get_user(user_id)
+    cached = time.perf_counter() - started
+    stats = {key: user_cache._stats[key] - hits_before[key] for key in hits_before}
+
+    started = time.perf_counter()
+    for user_id in picks[:args.lookups // 10]:
+        await database.run(database.get_user, user_id)
+    uncached = (time.perf_counter() - started) / (args.lookups // 10)
+
+    print(f"\n{args.lookups} lookups over {args.users} users (zipf {args.zipf}), cache of {USER_CACHE_MAX_ENTRIES}:")
+    print(f"hit rate {stats['hits'] / args.lookups:.1%} ({stats['misses']} misses, {stats['expired']} expired)")
+    print(f"per lookup: {cached / args.lookups * 1e6:.1f} us through the cache, "
+          f"{uncached * 1e6:.1f} us for database.get_user on the executor")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--zipf", type=float, default=1.0, help="skew of user activity")
+    args = parser.parse_args()
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(), "user_cache.db")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
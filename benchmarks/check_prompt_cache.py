@@ -0,0 +1,55 @@
+"""Send a few evaluations to the stub API and show the request shape and recorded token usage.
+
+Checks that the examiner instructions go out as a cacheable system block, separate
+from the per-essay user message, and that every request lands in evaluation_usage.
+
+    python benchmarks/check_prompt_cache.py --essays 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubLLM
+
+async def run(essays):
+    import database
+    from utils import essay_analysis
+
+    for i in range(essays):
+        await essay_analysis.analyze_essay(f"Topic {i}", f"Essay number {i}.")
+    async for _ in essay_analysis.stream_essay_analysis("Topic", "A streamed essay."):
+        pass
+    await essay_analysis.close_client()
+    return database.get_connection().execute(
+        "SELECT mode, input_tokens, cache_creation_input_tokens, cache_read_input_tokens, output_tokens, "
+        "ROUND(latency_ms, 1) FROM evaluation_usage ORDER BY id").fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--essays", type=int, default=3)
+    args = parser.parse_args()
+
+    with StubLLM(latency=0.05) as stub:
+        os.environ["ANTHROPIC_BASE_URL"] = stub.url
+        os.environ.setdefault("ANTHROPIC_API_KEY", "stub-key")
+        os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(), "usage.db")
+        rows = asyncio.run(run(args.essays))
+        request = stub.received[0]
+
+    print("request shape:")
+    print(json.dumps({
+        "system": [{**block, "text": block["text"][:60] + "..."} for block in request["system"]],
+        "messages": [{**message, "content": message["content"][:60] + "..."} for message in request["messages"]],
+    }, indent=2))
+    print("\nmode    input  cache_write  cache_read  output  latency_ms")
+    for row in rows:
+        print("%-6s %6d %12d %11d %7d %11.1f" % row)
+
+if __name__ == "__main__":
+    main()
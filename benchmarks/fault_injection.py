@@ -0,0 +1,182 @@
+"""Inject provider failures with the stub model and check how evaluations cope.
+
+Each scenario scripts errors on a local StubLLM (429 with Retry-After, 529
+overloaded, 500, 400, timeouts) and checks the retries, the adaptive rate limit, the
+circuit breaker and what the evaluation queue does with the user's use: keep the job
+queued while the circuit is open, refund it once retries are exhausted.
+
+    python benchmarks/fault_injection.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubLLM, StubTelegram
+
+ESSAY = ("Some people believe that university education should be free for every student. " * 4).strip()
+
+# Short timeouts and backoffs so the scenarios run in seconds
+os.environ.update(
+    DB_NAME=os.path.join(tempfile.mkdtemp(), "faults.db"),
+    ANTHROPIC_API_KEY="stub-key",
+    ANTHROPIC_TIMEOUT="0.5",
+    LLM_MAX_ATTEMPTS="4",
+    LLM_BACKOFF_BASE="0.05",
+    LLM_BACKOFF_MAX="0.2",
+    CIRCUIT_FAILURE_THRESHOLD="3",
+    CIRCUIT_RESET_TIMEOUT="1",
+)
+
+def reset(llm_resilience, **breaker_options):
+    llm_resilience.breaker = llm_resilience.CircuitBreaker(**breaker_options)
+    llm_resilience.limiter = llm_resilience.AdaptiveRateLimiter()
+
+async def expect_error(coro, error_type):
+    try:
+        await coro
+    except error_type as e:
+        return e
+    raise AssertionError(f"expected {error_type.__name__}")
+
+async def run_scenarios(llm, telegram):
+    import anthropic
+    from telegram import Bot
+    import database
+    from utils import essay_analysis, llm_resilience
+    from utils.evaluation_queue import EvaluationQueue
+
+    bot = Bot("123:stub", base_url=f"{telegram.url}/bot")
+    await bot.initialize()
+
+    async def retry_after_is_honoured():
+        llm.fail(429, retry_after=0.3)
+        started = time.monotonic()
+        report = await essay_analysis.analyze_essay("Rate limit", ESSAY)
+        assert "Overall" in report
+        assert time.monotonic() - started >= 0.3, "retried before Retry-After"
+        assert llm_resilience.limiter.rate < 50, "request rate was not lowered"
+
+    async def overload_is_retried():
+        llm.fail(529, 529)
+        report = await essay_analysis.analyze_essay("Overloaded", ESSAY)
+        assert "Overall" in report
+        assert llm_resilience.stats()["retries"] == 2
+
+    async def timeout_is_retried():
+        llm.fail("timeout")
+        report = await essay_analysis.analyze_essay("Timeout", ESSAY)
+        assert "Overall" in report
+
+    async def bad_request_is_not_retried():
+        llm.fail(400)
+        before = llm.requests
+        await expect_error(essay_analysis.analyze_essay("Bad request", ESSAY), anthropic.BadRequestError)
+        assert llm.requests - before == 1
+        assert llm_resilience.breaker.state == "closed"
+
+    async def circuit_opens_and_recovers():
+        llm.fail(*[500] * 3)
+        await expect_error(essay_analysis.analyze_essay("Outage", ESSAY), llm_resilience.CircuitOpenError)
+        assert llm_resilience.breaker.state == "open"
+        before, started = llm.requests, time.monotonic()
+        await expect_error(essay_analysis.analyze_essay("Outage", ESSAY), llm_resilience.CircuitOpenError)
+        assert llm.requests == before, "called the provider while the circuit was open"
+        assert time.monotonic() - started < 0.05, "did not fail fast"
+        await asyncio.sleep(llm_resilience.breaker.retry_after)
+        assert "Overall" in await essay_analysis.analyze_essay("Outage", ESSAY)
+        assert llm_resilience.breaker.state == "closed"
+
+    async def failed_trial_reopens():
+        llm.fail(*[500] * 3)
+        await expect_error(essay_analysis.analyze_essay("Flapping", ESSAY), llm_resilience.CircuitOpenError)
+        await asyncio.sleep(llm_resilience.breaker.retry_after)
+        llm.fail(500)
+        await expect_error(essay_analysis.analyze_essay("Flapping", ESSAY), llm_resilience.CircuitOpenError)
+        assert llm_resilience.breaker.times_opened == 2
+
+    async def stream_retries_before_output():
+        llm.fail(529)
+        text = "".join([delta async for delta in essay_analysis.stream_essay_analysis("Stream", ESSAY)])
+        assert "Overall" in text
+
+    async def abandoned_stream_is_recorded():
+        stream = essay_analysis.stream_essay_analysis("Abandoned", ESSAY, user_id=1003, job_id=77)
+        await stream.__anext__()
+        await stream.aclose()
+        row = database.get_connection().execute(
+            "SELECT mode, user_id, job_id, output_tokens FROM evaluation_usage ORDER BY id DESC LIMIT 1").fetchone()
+        assert row[:3] == ("stream_partial", 1003, 77), f"abandoned stream recorded as {row}"
+        assert row[3] > 0
+
+    async def queue_keeps_jobs_while_circuit_open():
+        user_id = 1001
+        database.add_user(user_id)
+        bucket = database.consume_use(user_id)[0]
+        queue = EvaluationQueue()
+        await queue.submit(user_id, user_id, "Queued outage", ESSAY, bucket)
+        llm.fail(*[500] * 3)
+        await queue.drain(bot)
+        pending, running, _ = database.get_evaluation_queue_stats()
+        assert (pending, running) == (1, 0), "job was not kept in the queue"
+        assert database.get_free_uses_left(user_id) == 2, "use was refunded or charged twice"
+        assert (await queue.stats())["deferred"] == 1
+        await asyncio.sleep(llm_resilience.breaker.retry_after)
+        await queue.drain(bot)
+        assert database.get_evaluation_queue_stats()[0] == 0
+        assert database.get_free_uses_left(user_id) == 2
+
+    async def queue_refunds_after_retries():
+        user_id = 1002
+        database.add_user(user_id)
+        bucket = database.consume_use(user_id)[0]
+        queue = EvaluationQueue()
+        await queue.submit(user_id, user_id, "Exhausted", ESSAY, bucket)
+        llm.fail(*[500] * 4)
+        await queue.drain(bot)
+        assert database.get_free_uses_left(user_id) == 3, "use was not refunded"
+        assert (await queue.stats())["failed"] == 1
+
+    scenarios = [
+        (retry_after_is_honoured, {}),
+        (overload_is_retried, {}),
+        (timeout_is_retried, {}),
+        (bad_request_is_not_retried, {}),
+        (circuit_opens_and_recovers, {}),
+        (failed_trial_reopens, {}),
+        (stream_retries_before_output, {}),
+        (abandoned_stream_is_recorded, {}),
+        (queue_keeps_jobs_while_circuit_open, {}),
+        (queue_refunds_after_retries, {"failure_threshold": 100}),
+    ]
+    failures = 0
+    for scenario, breaker_options in scenarios:
+        reset(llm_resilience, **breaker_options)
+        llm_resilience._stats.update(dict.fromkeys(llm_resilience._stats, 0))
+        llm.faults.clear()
+        started = time.monotonic()
+        try:
+            await scenario()
+        except Exception as e:
+            failures += 1
+            print(f"FAIL {scenario.__name__}: {e!r}")
+        else:
+            print(f"PASS {scenario.__name__} ({time.monotonic() - started:.2f}s)")
+
+    await essay_analysis.close_client()
+    await bot.shutdown()
+    return failures
+
+def main():
+    with StubLLM(latency=0.0) as llm, StubTelegram() as telegram:
+        os.environ["ANTHROPIC_BASE_URL"] = llm.url
+        failures = asyncio.run(run_scenarios(llm, telegram))
+    print(f"{failures} scenario(s) failed" if failures else "all scenarios passed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""Drive the bot with synthetic users and report throughput and latency per flow.
+
+Every simulated user onboards (/start, then shares their contact) and then runs a
+random mix of flows: an evaluation (Evaluate, topic, essay, until the result is in
+the chat), a purchase (/purchase, then an inline-button callback) and a check of
+the remaining uses. Updates go through the real handler table from
+handlers/registry.py, either on a long-running Application with the evaluation
+queue's workers (--entry bot) or through the serverless entry point, which
+finishes queued evaluations before answering (--entry netlify). The Bot API and
+the Anthropic API are local stubs with configurable latency. They run on threads of
+this process and compete with the bot for the CPU, so compare runs made on the
+same machine. The Bot API stub enforces no flood limits, so outbound messages are
+not paced unless --outbound-rate says so; benchmarks/bench_outbound.py covers those.
+
+    python benchmarks/load_test.py --users 1000 --concurrency 200 --llm-latency 2
+    python benchmarks/load_test.py --json current.json --baseline previous.json
+
+With --baseline, a flow whose p95 got worse by more than --tolerance fails the run.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubLLM, StubTelegram, percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+TOKEN = "123:stub"
+
+FLOWS = {"evaluate": 0.5, "purchase": 0.25, "check_uses": 0.25}
+
+TOPICS = [
+    "Some people think that governments should invest in public transport rather than roads.",
+    "Many believe that children should learn a foreign language at primary school.",
+    "Working from home has become common. Do the advantages outweigh the disadvantages?",
+    "Some say that international tourism does more harm than good to local communities.",
+]
+
+SENTENCES = [
+    "In my opinion, this issue affects almost every part of modern society.",
+    "However, there are several arguments on the other side that deserve attention.",
+    "For example, many families in large cities cannot afford the rising costs of living.",
+    "Moreover, young people are often the first to notice these changes in their daily lives.",
+    "As a result, local authorities have started to look for new solutions to the problem.",
+    "On the other hand, critics argue that such policies are expensive and slow to work.",
+    "Furthermore, the experience of other countries shows that careful planning is essential.",
+    "Therefore, it is important to consider both the short term and the long term effects.",
+    "In addition, education plays a key role in helping people adapt to new situations.",
+    "Nevertheless, individuals also have a responsibility to make sensible choices.",
+    "Although the benefits are clear, the costs should not be ignored by decision makers.",
+    "Similarly, businesses can contribute by offering training and flexible arrangements.",
+]
+
+def make_essay(rng):
+    """A screening-proof essay of about 280 words, different for every call."""
+    paragraphs = []
+    for _ in range(4):
+        paragraphs.append(" ".join(rng.sample(SENTENCES, 6)))
+    paragraphs.append(f"In conclusion, this is a complex question, and essay {rng.random():.12f} has argued both sides.")
+    return "\n\n".join(paragraphs)
+
+class RecordingTelegram(StubTelegram):
+    """StubTelegram that hands every text sent or edited in a chat to the load test's event loop."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.loop = None
+        self.listener = None
+
+    def result(self, api_method, params):
+        if self.listener is not None and api_method in ("sendMessage", "editMessageText"):
+            self.loop.call_soon_threadsafe(self.listener, int(params.get("chat_id", 0)), params.get("text", ""))
+        return super().result(api_method, params)
+
+class HandlerFailed(Exception):
+    """A handler raised while processing one of the flow's updates."""
+
+class Harness:
+    def __init__(self, args, telegram):
+        self.args = args
+        self.telegram = telegram
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.flow_latency = collections.defaultdict(list)
+        self.step_latency = collections.defaultdict(list)
+        self.outcomes = collections.defaultdict(collections.Counter)
+        # chat_id -> Future resolved by the next evaluation result in that chat
+        self.results = {}
+        # chat_id -> texts the bot sent there since the last take_replies()
+        self.replies = collections.defaultdict(list)
+        self.process = None
+        self.redelivered = 0
+        # user_id -> errors raised by handlers for that user's updates
+        self.errors = collections.Counter()
+
+    def on_text(self, chat_id, text):
+        self.replies[chat_id].append(text)
+        future = self.results.get(chat_id)
+        if future is not None and not future.done() and ("Analysis Result" in text or "not been charged" in text):
+            future.set_result(text)
+
+    async def on_error(self, update, context):
+        """Error handler of the Application under test."""
+        if update is not None and update.effective_user is not None:
+            self.errors[update.effective_user.id] += 1
+
+    def take_replies(self, chat_id):
+        replies, self.replies[chat_id] = self.replies[chat_id], []
+        return replies
+
+    def message(self, user_id, text=None, **fields):
+        message = {"message_id": next(self.message_ids), "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}}
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        message.update(fields)
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def callback(self, user_id, data):
+        return {"update_id": next(self.update_ids), "callback_query": {
+            "id": str(next(self.update_ids)), "chat_instance": str(user_id), "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "message": {"message_id": next(self.message_ids), "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"}, "text": "Select a purchase option"},
+        }}
+
+    async def send(self, step, update):
+        user_id = (update.get("message") or update.get("callback_query"))["from"]["id"]
+        errors = self.errors[user_id]
+        started = time.perf_counter()
+        await self.process(update)
+        self.step_latency[step].append(time.perf_counter() - started)
+        if self.errors[user_id] != errors:
+            raise HandlerFailed(step)
+        if random.random() < self.args.redeliver:
+            # As Telegram does when a webhook answer is slow; the bot should drop it
+            self.redelivered += 1
+            await self.process(update)
+
+    async def onboard(self, user_id):
+        await self.send("start", self.message(user_id, "/start"))
+        contact = {"phone_number": f"+1555{user_id:07d}", "first_name": f"User{user_id}", "user_id": user_id}
+        await self.send("contact", self.message(user_id, contact=contact))
+        return "ok"
+
+    async def evaluate(self, user_id, rng):
+        await self.send("evaluate_menu", self.message(user_id, "Evaluate"))
+        await self.send("topic", self.message(user_id, rng.choice(TOPICS)))
+        self.take_replies(user_id)
+        result = self.results[user_id] = asyncio.get_running_loop().create_future()
+        await self.send("essay", self.message(user_id, make_essay(rng)))
+        replies = self.take_replies(user_id)
+        if not any("queued for evaluation" in text for text in replies) and not result.done():
+            return "no_uses_left" if any("used all" in text for text in replies) else "not_queued"
+        text = await asyncio.wait_for(result, self.args.result_timeout)
+        return "ok" if "Analysis Result" in text else "failed"
+
+    async def purchase(self, user_id, rng):
+        await self.send("purchase_menu", self.message(user_id, "/purchase"))
+        await self.send("purchase_callback", self.callback(user_id, rng.choice(["purchase_5", "purchase_10", "purchase_20"])))
+        return "ok"
+
+    async def check_uses(self, user_id, rng):
+        await self.send("check_uses", self.message(user_id, "Check Remaining Uses"))
+        return "ok"
+
+    async def run_flow(self, name, flow, *args):
+        started = time.perf_counter()
+        try:
+            outcome = await flow(*args)
+        except HandlerFailed as e:
+            outcome = f"error in {e}"
+        except Exception as e:
+            outcome = type(e).__name__
+        self.outcomes[name][outcome] += 1
+        if outcome == "ok":
+            self.flow_latency[name].append(time.perf_counter() - started)
+
+    async def user(self, user_id, slots):
+        rng = random.Random(user_id)
+        async with slots:
+            await self.run_flow("onboarding", self.onboard, user_id)
+            for _ in range(self.args.flows_per_user):
+                name = rng.choices(list(FLOWS), weights=list(FLOWS.values()))[0]
+                await self.run_flow(name, getattr(self, name), user_id, rng)
+
+async def build_bot_application(harness):
+    """The Application bot_claude.py builds, without starting the webhook."""
+    import bot_claude
+    from utils.evaluation_queue import evaluation_queue
+
+    application = bot_claude.build_application()
+    application.add_error_handler(harness.on_error)
+    await application.initialize()
+    # Runs the periodic persistence writes, as under run_webhook()
+    await application.start()
+    await evaluation_queue.start(application.bot)
+
+    async def process(update_json):
+        from telegram import Update
+        await application.process_update(Update.de_json(update_json, application.bot))
+
+    async def shutdown():
+        await evaluation_queue.stop()
+        await application.stop()
+        await application.shutdown()
+
+    return process, shutdown
+
+async def build_netlify_entry_point(harness):
+    """The serverless entry point, handling each update like one webhook invocation."""
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("netlify_bot", ROOT / "netlify" / "functions" / "bot.py")
+    entry = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(entry)
+    from telegram.ext import Application
+    from handlers.registry import register_handlers
+    from utils.outbound_scheduler import OutboundScheduler
+    from utils.sqlite_persistence import SQLitePersistence
+
+    application = Application.builder().token(TOKEN).base_url(f"{os.environ['TELEGRAM_API_BASE_URL']}/bot") \
+        .persistence(SQLitePersistence()).rate_limiter(OutboundScheduler()).build()
+    register_handlers(application)
+    application.add_error_handler(harness.on_error)
+    await application.initialize()
+
+    async def process(update_json):
+        await entry.process(application, json.dumps(update_json))
+
+    return process, application.shutdown
+
+async def run(args, telegram, llm):
+    telegram.loop = asyncio.get_running_loop()
+    harness = Harness(args, telegram)
+    telegram.listener = harness.on_text
+    build = build_bot_application if args.entry == "bot" else build_netlify_entry_point
+    harness.process, shutdown = await build(harness)
+
+    slots = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*(harness.user(user_id, slots) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+    await shutdown()
+
+    from utils import essay_analysis
+    await essay_analysis.close_client()
+    return harness, elapsed
+
+def summarize(values):
+    ms = [value * 1000 for value in values] or [0.0]
+    return {"count": len(values), "p50_ms": percentile(ms, 50), "p95_ms": percentile(ms, 95),
+            "p99_ms": percentile(ms, 99), "max_ms": max(ms)}
+
+def report(args, harness, elapsed, telegram, llm):
+    from utils import metrics, update_dedup, user_cache
+
+    updates = sum(len(values) for values in harness.step_latency.values())
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")},
+        "elapsed_s": elapsed,
+        "updates_per_s": updates / elapsed,
+        "flows": {name: dict(summarize(harness.flow_latency[name]), per_s=len(harness.flow_latency[name]) / elapsed,
+                             outcomes=dict(harness.outcomes[name]))
+                  for name in ["onboarding", *FLOWS]},
+        "steps": {name: summarize(values) for name, values in harness.step_latency.items()},
+        "bot_api_calls": dict(telegram.calls),
+        "llm_requests": llm.requests,
+        "redelivered": harness.redelivered,
+        "duplicates_dropped": {key[0]: value for key, value in update_dedup.duplicates.samples()},
+        "db_calls": {key[0]: sum(state[:-1]) for key, state in metrics.db_query_duration.samples()},
+        "user_cache": user_cache.stats(),
+    }
+
+    print(f"entry: {args.entry}, users: {args.users}, concurrency: {args.concurrency}, "
+          f"telegram latency: {args.telegram_latency * 1000:.0f} ms, llm latency: {args.llm_latency:.2f}s")
+    print(f"wall time: {elapsed:.1f}s, updates: {updates} ({results['updates_per_s']:.0f}/s), "
+          f"Bot API calls: {sum(telegram.calls.values())}, model requests: {llm.requests}")
+    print(f"database calls: {sum(results['db_calls'].values())} ({sum(results['db_calls'].values()) / updates:.1f} "
+          f"per update), user cache hit rate: {results['user_cache']['hit_rate']:.0%}")
+    dropped = {key[0]: int(value) for key, value in update_dedup.duplicates.samples()}
+    print(f"redelivered updates: {harness.redelivered}, dropped: {dropped.get('update', 0)}, "
+          f"repeated essays refused: {dropped.get('evaluation', 0)}")
+    print(f"\n{'flow':18s} {'ok':>6s} {'per s':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}  other outcomes")
+    for name, flow in results["flows"].items():
+        other = {key: value for key, value in flow["outcomes"].items() if key != "ok"}
+        print(f"{name:18s} {flow['count']:6d} {flow['per_s']:7.1f} {flow['p50_ms']:9.1f} {flow['p95_ms']:9.1f} "
+              f"{flow['p99_ms']:9.1f}  {other or ''}")
+    print(f"\n{'update':18s} {'count':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, step in results["steps"].items():
+        print(f"{name:18s} {step['count']:6d} {step['p50_ms']:9.1f} {step['p95_ms']:9.1f} {step['p99_ms']:9.1f}")
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print p95 changes against a previous run; returns the flows that regressed."""
+    regressed = []
+    print(f"\n{'flow':18s} {'baseline p95':>13s} {'p95':>9s} {'change':>8s}")
+    for name, flow in results["flows"].items():
+        before = baseline.get("flows", {}).get(name)
+        if not before or not before["count"] or not flow["count"]:
+            continue
+        change = flow["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        flag = "  REGRESSION" if change > tolerance else ""
+        if flag:
+            regressed.append(name)
+        print(f"{name:18s} {before['p95_ms']:13.1f} {flow['p95_ms']:9.1f} {change:+8.0%}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100, help="users active at the same time")
+    parser.add_argument("--flows-per-user", type=int, default=3)
+    parser.add_argument("--entry", choices=["bot", "netlify"], default="bot")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=8, help="evaluation queue workers")
+    parser.add_argument("--rpm", type=float, default=1e6, help="model requests per minute budget")
+    parser.add_argument("--outbound-rate", type=float, default=1e6,
+                        help="messages per second to the Bot API, overall and per chat")
+    parser.add_argument("--redeliver", type=float, default=0.0, help="fraction of updates delivered twice")
+    parser.add_argument("--result-timeout", type=float, default=600)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 increase against the baseline")
+    args = parser.parse_args()
+
+    with RecordingTelegram(latency=args.telegram_latency) as telegram, \
+            StubLLM(latency=args.llm_latency, token_latency=args.token_latency) as llm:
+        os.environ.update(
+            TELEGRAM_BOT_TOKEN=TOKEN,
+            TELEGRAM_API_BASE_URL=telegram.url,
+            ANTHROPIC_BASE_URL=llm.url,
+            ANTHROPIC_API_KEY="stub-key",
+            DB_NAME=os.path.join(tempfile.mkdtemp(), "load.db"),
+            EVALUATION_WORKERS=str(args.workers),
+            MAX_CONCURRENT_EVALUATIONS=str(args.workers),
+            EVALUATION_QUEUE_MAX_DEPTH=str(args.users * args.flows_per_user),
+            LLM_REQUESTS_PER_MINUTE=str(args.rpm),
+            LLM_TOKENS_PER_MINUTE=str(args.rpm * 2000),
+            OUTBOUND_GLOBAL_RATE=str(args.outbound_rate),
+            OUTBOUND_CHAT_RATE=str(args.outbound_rate),
+            OUTBOUND_GROUP_RATE=str(args.outbound_rate),
+        )
+        harness, elapsed = asyncio.run(run(args, telegram, llm))
+        results = report(args, harness, elapsed, telegram, llm)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(results, json.load(f), args.tolerance)
+        sys.exit(1 if regressed else 0)
+
+if __name__ == "__main__":
+    main()
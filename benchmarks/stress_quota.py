@@ -0,0 +1,83 @@
+"""Hammer database.consume_use() from many threads and check that no use is double spent.
+
+Every user starts with a known number of free and purchased uses. Worker threads,
+each with its own connection, race to consume (and sometimes refund) uses until
+nothing is left. Afterwards the number of successful consumptions has to equal
+the uses handed out and no balance may be negative.
+
+    python benchmarks/stress_quota.py --users 20 --threads 16
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--purchased", type=int, default=7)
+    parser.add_argument("--refund-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(), "stress.db")
+    import database
+
+    for user_id in range(args.users):
+        database.add_user(user_id)
+        database.add_purchased_uses(user_id, args.purchased)
+    available = args.users * (3 + args.purchased)
+
+    lock = threading.Lock()
+    consumed = {"ok": 0, "refunded": 0, "denied": 0}
+
+    def worker(seed):
+        rng = random.Random(seed)
+        exhausted = set()
+        while len(exhausted) < args.users:
+            user_id = rng.randrange(args.users)
+            result = database.consume_use(user_id)
+            if result is None:
+                exhausted.add(user_id)
+                with lock:
+                    consumed["denied"] += 1
+                continue
+            bucket, free_left, purchased_left = result
+            assert free_left >= 0 and purchased_left >= 0, result
+            if rng.random() < args.refund_rate:
+                database.refund_use(user_id, bucket)
+                exhausted.discard(user_id)
+                with lock:
+                    consumed["refunded"] += 1
+            else:
+                with lock:
+                    consumed["ok"] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    rows = database.get_connection().execute("SELECT free_uses_left, purchased_uses FROM users").fetchall()
+    negative = [row for row in rows if row[0] < 0 or row[1] < 0]
+    left = sum(free + purchased for free, purchased in rows)
+    attempts = sum(consumed.values())
+
+    print(f"threads: {args.threads}, users: {args.users}, uses handed out: {available}")
+    print(f"consumed: {consumed['ok']}, refunded: {consumed['refunded']}, denied: {consumed['denied']}, left: {left}")
+    print(f"attempts/s: {attempts / elapsed:.0f}")
+    ok = consumed["ok"] == available and left == 0 and not negative
+    print("PASS: no double spend, no negative balances" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Local stand-ins for the external APIs the bot talks to, and helpers shared by the benchmarks."""
+import asyncio
+import collections
+import itertools
+import json
+import math
+import threading
+import time
+import urllib.parse
+
+def percentile(values, pct):
+    """The ``pct`` percentile of ``values`` (nearest rank), or NaN if there are none."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else float("nan")
+
+class Response:
+    """A stub reply; pass ``stream`` (an async iterator of bytes) to send it chunked."""
+
+    def __init__(self, status=200, body=b"", content_type="application/json", headers=None, stream=None):
+        self.status = status
+        self.body = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.stream = stream
+
+class StubServer:
+    """Minimal keep-alive HTTP/1.1 server running on its own event loop thread.
+
+    Subclasses implement ``handle``. Running on a separate thread keeps the stub's
+    own work out of the event loop that is being measured.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def handle(self, method, path, headers, body):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._serve, self.host, self.port, backlog=4096)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._server.close()
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                response = await self.handle(method, path, headers, body)
+                head = [f"HTTP/1.1 {response.status} OK", f"Content-Type: {response.content_type}"]
+                if response.stream is not None:
+                    head.append("Transfer-Encoding: chunked")
+                else:
+                    head.append(f"Content-Length: {len(response.body)}")
+                head += [f"{name}: {value}" for name, value in response.headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+                if response.stream is not None:
+                    async for chunk in response.stream:
+                        writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                else:
+                    writer.write(response.body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+class StubLLM(StubServer):
+    """Answers ``POST /v1/messages`` like the Anthropic Messages API.
+
+    ``latency`` is the delay before the first token and ``token_latency`` the delay
+    per generated word; requests with ``"stream": true`` get server-sent events.
+    System blocks marked with ``cache_control`` are "cached" the way the real API
+    reports it, and the last requests are kept in ``received`` for inspection.
+
+    fail() scripts errors for the next requests: an HTTP status such as 429, 500 or
+    529 (optionally with a Retry-After value), or "timeout" to never answer.
+
+    With ``fill`` the answer is padded to that fraction of the request's max_tokens
+    (one word per token), so generation time scales with the output limit as it
+    does on the real API.
+    """
+
+    def __init__(self, latency=1.0, token_latency=0.0, text=None, fill=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.fill = fill
+        self.received = collections.deque(maxlen=100)
+        self.faults = collections.deque()
+        self.failed = 0
+        self._cached_prefixes = set()
+        self.text = text or (
+            "Task Achievement: 6.5\nCoherence and Cohesion: 6.5\n"
+            "Lexical Resource: 6.0\nGrammatical Range and Accuracy: 6.0\nOverall: 6.5"
+        )
+
+    def fail(self, *faults, retry_after=None):
+        """Answer the next len(faults) requests with these errors, in order."""
+        self.faults.extend((fault, retry_after) for fault in faults)
+
+    def answer(self, payload):
+        """The text of the answer to a request."""
+        if not self.fill:
+            return self.text
+        padding = int(payload.get("max_tokens", 0) * self.fill) - len(self.text.split())
+        return self.text + " lorem" * max(0, padding)
+
+    def usage(self, payload, body):
+        usage = {"input_tokens": len(body) // 4, "output_tokens": len(self.answer(payload).split()),
+                 "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        system = payload.get("system")
+        if isinstance(system, list) and any("cache_control" in block for block in system):
+            prefix = json.dumps(system)
+            field = "cache_read_input_tokens" if prefix in self._cached_prefixes else "cache_creation_input_tokens"
+            self._cached_prefixes.add(prefix)
+            usage[field] = len(prefix) // 4
+            usage["input_tokens"] -= len(prefix) // 4
+        return usage
+
+    async def handle(self, method, path, headers, body):
+        payload = json.loads(body or b"{}")
+        self.received.append(payload)
+        if self.faults:
+            self.failed += 1
+            return await self._fault(*self.faults.popleft())
+        await asyncio.sleep(self.latency)
+        if payload.get("stream"):
+            return Response(content_type="text/event-stream", stream=self._events(payload, body))
+        text = self.answer(payload)
+        await asyncio.sleep(self.token_latency * len(text.split()))
+        return Response(body=self._message(payload, body, text))
+
+    async def _fault(self, fault, retry_after):
+        if fault == "timeout":
+            # The client gives up first; the connection is dropped when the stub stops
+            await asyncio.sleep(3600)
+        error_type = {429: "rate_limit_error", 529: "overloaded_error"}.get(fault, "api_error")
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        return Response(status=fault, headers=headers,
+                        body={"type": "error", "error": {"type": error_type, "message": f"stub {error_type}"}})
+
+    def _message(self, payload, body, text):
+        return {
+            "id": "msg_stub",
+            "type": "message",
+            "role": "assistant",
+            "model": payload.get("model", "stub"),
+            "content": [{"type": "text", "text": text}] if text else [],
+            "stop_reason": "end_turn" if text else None,
+            "stop_sequence": None,
+            "usage": self.usage(payload, body),
+        }
+
+    async def _events(self, payload, body):
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+
+        usage = self.usage(payload, body)
+        yield event("message_start", {"type": "message_start", "message": self._message(payload, body, "")})
+        yield event("content_block_start", {"type": "content_block_start", "index": 0,
+                                            "content_block": {"type": "text", "text": ""}})
+        for word in self.answer(payload).split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                "delta": {"type": "text_delta", "text": word + " "}})
+        yield event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield event("message_delta", {"type": "message_delta",
+                                      "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": usage["output_tokens"]}})
+        yield event("message_stop", {"type": "message_stop"})
+
+class StubTelegram(StubServer):
+    """Answers Bot API calls (``POST /bot<token>/<method>``) after a fixed delay.
+
+    Point the bot at it with ``Application.builder().base_url(f"{stub.url}/bot")``.
+    Calls are counted per method in ``calls``.
+
+    With ``global_limit`` or ``chat_limit`` it enforces Telegram's flood limits the
+    strict way: a call to a chat beyond that many in the last ``window`` seconds,
+    overall or to the same chat, is answered 429 with a retry_after and counted in
+    ``rejected``. Accepted calls to chats are listed in ``accepted`` as
+    (time, chat_id, text).
+    """
+
+    def __init__(self, latency=0.0, global_limit=None, chat_limit=None, window=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.window = window
+        self.calls = collections.Counter()
+        self.rejected = collections.Counter()
+        self.accepted = []
+        self._recent = collections.deque()
+        self._recent_by_chat = collections.defaultdict(collections.deque)
+        self._message_ids = itertools.count(1)
+
+    async def handle(self, method, path, headers, body):
+        api_method = path.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = self.parse(headers, body)
+        if "chat_id" in params and (self.global_limit or self.chat_limit):
+            retry_after = self.admit(str(params["chat_id"]), params.get("text", ""))
+            if retry_after:
+                self.rejected[api_method] += 1
+                return Response(status=429, body={"ok": False, "error_code": 429,
+                                                  "description": f"Too Many Requests: retry after {retry_after}",
+                                                  "parameters": {"retry_after": retry_after}})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.result(api_method, params)
+
+    def admit(self, chat_id, text):
+        """Record a call to a chat; returns 0 if it is within the limits, else the seconds to retry after."""
+        now = time.monotonic()
+        recent, by_chat = self._recent, self._recent_by_chat[chat_id]
+        for calls in (recent, by_chat):
+            while calls and calls[0] <= now - self.window:
+                calls.popleft()
+        for calls, limit in ((recent, self.global_limit), (by_chat, self.chat_limit)):
+            if limit and len(calls) >= limit:
+                return max(1, math.ceil(calls[0] + self.window - now))
+        recent.append(now)
+        by_chat.append(now)
+        self.accepted.append((now, chat_id, text))
+        return 0
+
+    @staticmethod
+    def parse(headers, body):
+        if not body:
+            return {}
+        if "json" in headers.get("content-type", ""):
+            return json.loads(body)
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+    def result(self, api_method, params):
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return Response(body={"ok": True, "result": result})
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Run the stub Anthropic API until interrupted.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with StubLLM(latency=args.latency, token_latency=args.token_latency, port=args.port) as stub:
+        print(f"Stub Anthropic API listening on {stub.url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
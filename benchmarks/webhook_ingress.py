@@ -0,0 +1,164 @@
+"""Measure how fast the webhook acknowledges a burst of updates.
+
+Starts the Application bot_claude.py builds on PTB's webhook server, against a
+stub Bot API whose calls take --telegram-latency seconds so handlers are slow,
+then posts --updates updates at once over --connections connections, as Telegram
+does after an outage. Reports the time to each 200, the time until every update
+was handled, and checks that a wrong secret token is refused.
+
+    python benchmarks/webhook_ingress.py --updates 1000 --connections 100
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stubs import StubTelegram, percentile
+
+TOKEN = "123:stub"
+SECRET = "ingress-benchmark-secret"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def make_updates(count, users):
+    """Alternating /start and "Check Remaining Uses" messages, spread over ``users`` users."""
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = (update_id - 1) % users + 1
+        text = "/start" if update_id <= users else "Check Remaining Uses"
+        message = {"message_id": update_id, "date": int(time.time()), "text": text,
+                   "chat": {"id": user_id, "type": "private"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        updates.append({"update_id": update_id, "message": message})
+    return updates
+
+async def post(connection, path, update, secret=SECRET):
+    """POST one update on a keep-alive connection; returns (seconds to the response, status)."""
+    reader, writer = connection
+    body = json.dumps(update).encode()
+    started = time.perf_counter()
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+                 f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return time.perf_counter() - started, status
+
+async def post_burst(port, path, updates, connections):
+    """Post the updates over ``connections`` connections, each sending its next update
+    once the last one was answered, as Telegram does; returns the forged request's
+    status and (seconds, status) per update."""
+    pending = iter(updates)
+    connections = [await asyncio.open_connection("127.0.0.1", port) for _ in range(connections)]
+    _, forged_status = await post(connections[0], path, updates[0], secret="wrong")
+    results = []
+
+    async def deliver(connection):
+        for update in pending:
+            results.append(await post(connection, path, update))
+        connection[1].close()
+
+    await asyncio.gather(*(deliver(connection) for connection in connections))
+    return forged_status, results
+
+def serve_telegram(latency, port, stop, calls):
+    """Run the stub Bot API in its own process, for the same reason; reports its call count on stop."""
+    with StubTelegram(latency=latency, port=port) as telegram:
+        stop.wait()
+        calls.put(sum(telegram.calls.values()))
+
+def run_client(port, path, updates, connections, done):
+    """Run the burst in its own process, so the client does not compete with the bot for the GIL."""
+    done.put(asyncio.run(post_burst(port, path, updates, connections)))
+
+async def run(args):
+    import bot_claude
+
+    application = bot_claude.build_application()
+    port = free_port()
+    await application.initialize()
+    await application.updater.start_webhook(listen="127.0.0.1", port=port, url_path="webhook",
+                                            webhook_url=f"http://127.0.0.1:{port}/webhook", secret_token=SECRET)
+    await application.start()
+
+    updates = make_updates(args.updates, args.users)
+    done = multiprocessing.Queue()
+    client = multiprocessing.Process(target=run_client, args=(port, "/webhook", updates, args.connections, done))
+    client.start()
+    # Wait for the client's first request, sent once it has started
+    while application.update_queue.empty() and client.is_alive():
+        await asyncio.sleep(0.001)
+    started = time.perf_counter()
+    while done.empty() and client.is_alive():
+        await asyncio.sleep(0.01)
+    acknowledged = time.perf_counter() - started
+    if done.empty():
+        raise RuntimeError(f"the client exited with code {client.exitcode}")
+    forged_status, responses = done.get()
+    client.join()
+    # Handled once the queue is empty and no update is in progress
+    while not application.update_queue.empty() or application.update_processor.current_concurrent_updates:
+        await asyncio.sleep(0.01)
+    handled = time.perf_counter() - started
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    return forged_status, responses, acknowledged, handled
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=250)
+    parser.add_argument("--connections", type=int, default=100, help="Telegram opens at most 100")
+    parser.add_argument("--workers", type=int, default=64, help="updates handled concurrently")
+    parser.add_argument("--telegram-latency", type=float, default=0.2, help="seconds per Bot API call")
+    args = parser.parse_args()
+
+    port, stop, calls = free_port(), multiprocessing.Event(), multiprocessing.Queue()
+    telegram = multiprocessing.Process(target=serve_telegram, args=(args.telegram_latency, port, stop, calls))
+    telegram.start()
+    os.environ.update(
+        TELEGRAM_BOT_TOKEN=TOKEN,
+        TELEGRAM_API_BASE_URL=f"http://127.0.0.1:{port}",
+        ANTHROPIC_API_KEY="stub-key",
+        DB_NAME=os.path.join(tempfile.mkdtemp(), "ingress.db"),
+        UPDATE_WORKERS=str(args.workers),
+    )
+    try:
+        forged_status, responses, acknowledged, handled = asyncio.run(run(args))
+    finally:
+        stop.set()
+    bot_api_calls = calls.get()
+    telegram.join()
+
+    latencies = [seconds * 1000 for seconds, _ in responses]
+    statuses = sorted({status for _, status in responses})
+    print(f"updates: {args.updates} from {args.users} users over {args.connections} connections, "
+          f"{args.workers} update workers, Bot API latency {args.telegram_latency * 1000:.0f} ms")
+    print(f"acknowledged all in {acknowledged:.2f}s, handled all in {handled:.2f}s "
+          f"({args.updates / handled:.0f} updates/s), Bot API calls: {bot_api_calls}")
+    print(f"ack latency ms: p50 {percentile(latencies, 50):.1f}  p95 {percentile(latencies, 95):.1f}  "
+          f"p99 {percentile(latencies, 99):.1f}  max {max(latencies):.1f}")
+    print(f"statuses: {statuses}, wrong secret token: {forged_status}")
+    sys.exit(0 if statuses == [200] and forged_status == 403 else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,96 @@
 import logging
-import os
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from telegram.ext import Updater
-from config import TELEGRAM_BOT_TOKEN, WEBHOOK_URL, PORT
-from handlers import start, evaluate, feedback
-from utils import user_management
+import secrets
+import threading
+from telegram.ext import Application
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_API_BASE_URL,
+    WEBHOOK_URL,
+    PORT,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_MAX_CONNECTIONS,
+    UPDATE_WORKERS,
+    METRICS_PORT,
+)
 from database import migrate_database
-from handlers.start import handle_contact_shared
-from flask import Flask, request
+from handlers.registry import register_handlers
+from utils.broadcast import broadcaster
+from utils.evaluation_queue import evaluation_queue
+from utils.feedback_digest import feedback_digest
+from utils import metrics
+from utils.instrumented_request import InstrumentedRequest
+from utils.outbound_scheduler import OutboundScheduler
+from utils.sqlite_persistence import SQLitePersistence
+from utils.update_processor import PerUserUpdateProcessor
+from flask import Flask, Response
 
-# Enable logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__)
 
-def main() -> None:
-    """Start the bot using webhooks."""
-    # Run database migration
-    migrate_database()
+@app.route("/metrics")
+def metrics_endpoint():
+    """Expose metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def start_metrics_server() -> None:
+    """Serve the Flask app on METRICS_PORT next to the webhook, which owns the main thread."""
+    thread = threading.Thread(target=app.run, kwargs={"host": "0.0.0.0", "port": METRICS_PORT}, daemon=True)
+    thread.start()
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def start_background_tasks(application: Application) -> None:
+    await evaluation_queue.start(application.bot)
+    await feedback_digest.start(application.bot)
+    await broadcaster.start(application.bot)
+
+async def stop_background_tasks(application: Application) -> None:
+    await evaluation_queue.stop()
+    await feedback_digest.stop()
+    await broadcaster.stop()
+
+def build_application() -> Application:
+    """Build the Application with its handlers, without starting it."""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .request(InstrumentedRequest())
+        .rate_limiter(OutboundScheduler())
+        .persistence(SQLitePersistence())
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_WORKERS))
+        .post_init(start_background_tasks)
+        .post_shutdown(stop_background_tasks)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+    application = builder.build()
 
     # Add handlers
-    application.add_handler(CommandHandler("start", start.handle_start))
-    application.add_handler(CommandHandler("evaluate", evaluate.handle_evaluate))
-    application.add_handler(CommandHandler("feedback", feedback.handle_feedback))
-    application.add_handler(CommandHandler("check_uses", user_management.handle_check_remaining_uses))
-    application.add_handler(CommandHandler("purchase", user_management.show_purchase_options))
-    application.add_handler(CommandHandler("verify_payment", user_management.verify_payment))
+    register_handlers(application)
+    return application
 
+def main() -> None:
+    """Start the bot using webhooks."""
+    # Enable logging
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    # Run database migration
+    migrate_database()
 
-    application.add_handler(MessageHandler(filters.Regex('^Evaluate$'), user_management.handle_message))
-    application.add_handler(MessageHandler(filters.Regex('^Feedback$'), user_management.handle_message))
-    application.add_handler(MessageHandler(filters.Regex('^Check Remaining Uses$'), user_management.handle_check_remaining_uses))
-    application.add_handler(MessageHandler(filters.Regex('^Purchase More Uses$'), user_management.handle_message))
-    application.add_handler(MessageHandler(filters.CONTACT, user_management.handle_contact))
-    application.add_handler(MessageHandler(filters.CONTACT, handle_contact_shared))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, user_management.handle_message))
-    application.add_handler(CallbackQueryHandler(user_management.handle_purchase_callback))
+    application = build_application()
+    start_metrics_server()
 
-    # Set up webhook
+    # PTB's webhook server checks the secret token, puts the update on
+    # application.update_queue and answers at once; up to UPDATE_WORKERS updates are
+    # then handled concurrently, so a slow evaluation never holds up the acknowledgement
     application.run_webhook(
         listen="0.0.0.0",
-        port=int(os.environ.get("PORT", 5000)),
+        port=PORT,
         url_path=TELEGRAM_BOT_TOKEN,
-        webhook_url=f"{WEBHOOK_URL}/{TELEGRAM_BOT_TOKEN}"
+        webhook_url=f"{WEBHOOK_URL}/{TELEGRAM_BOT_TOKEN}",
+        secret_token=WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
     )
 
-    return application
-
-# Create the Application and pass it to the handler
-application = main()
-
-@app.route("/", methods=["GET", "POST"])
-def webhook():
-    """Handle incoming Telegram updates."""
-    if request.method == "POST":
-        update = telegram.Update.de_json(request.get_json(force=True), application.bot)
-        application.process_update(update)
-    return "OK"
-
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
+    main()
@@ -0,0 +1,180 @@
+"""Grade a file of essays offline, e.g. a batch sent in by a partner school.
+
+Reads (student, topic, essay) rows from a JSONL or CSV file as a stream, grades
+them with a bounded number of parallel requests paced to a requests-per-minute
+budget (retrying and backing off through utils/llm_resilience.py), and appends one JSON line per essay to the output file as soon as it is
+graded. Rows already in the output file, graded or failed, are skipped, so an
+interrupted run continues where it stopped when started again with the same
+arguments; to grade failed rows again, delete their lines from the output first.
+Lines that are not valid JSON, and essays that are missing or that the bot's
+pre-analysis would reject, are recorded as failed without calling the model.
+
+    python bulk_grade.py essays.csv results.jsonl --concurrency 8 --rpm 50
+    python bulk_grade.py essays.jsonl results.jsonl --base-url http://127.0.0.1:8765
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger("bulk_grade")
+
+def read_rows(path, input_format):
+    """Yield (row number, row dict, error) without loading the whole file; error is set for unreadable lines."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if input_format == 'csv':
+            for number, row in enumerate(csv.DictReader(f), start=1):
+                yield number, row, None
+        else:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield number, {}, f"invalid JSON on line {number}: {e.msg}"
+                    continue
+                if isinstance(row, dict):
+                    yield number, row, None
+                else:
+                    yield number, {}, f"line {number} is not a JSON object"
+
+def read_checkpoint(path):
+    """Row numbers that already have a result in the output file, graded or failed."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short when the previous run was killed
+                continue
+            done.add(result['row'])
+    return done
+
+async def grade_file(args):
+    # Imported here so the command line options are applied before config is read
+    import anthropic
+    from utils import essay_analysis, llm_resilience, pre_analysis
+
+    done = read_checkpoint(args.output)
+    if done:
+        logger.info("Resuming: %s rows already in %s", len(done), args.output)
+
+    rows = asyncio.Queue(maxsize=args.concurrency * 2)
+    counts = {'graded': 0, 'failed': 0, 'skipped': 0}
+    started = time.monotonic()
+
+    with open(args.output, 'a', encoding='utf-8') as out:
+        def write(result):
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+
+        def check(row):
+            # The same screening the bot does before spending a use, so no paid call grades a non-essay
+            essay = row.get('essay')
+            if not isinstance(essay, str) or not essay.strip():
+                return "missing essay"
+            verdict, message = pre_analysis.screen(pre_analysis.analyze_text(essay))
+            return f"rejected by pre-analysis: {message}" if verdict == pre_analysis.REJECT else None
+
+        async def grade(number, row, error):
+            topic, essay = row.get('topic') or '', row.get('essay')
+            error = error or check(row)
+            if error:
+                return {'row': number, 'student': row.get('student'), 'topic': topic, 'error': error}
+            # analyze_essay() paces and retries each call itself; this only waits out an open circuit
+            for _ in range(args.max_attempts):
+                request_started = time.monotonic()
+                try:
+                    report = await essay_analysis.analyze_essay(topic, essay)
+                except llm_resilience.CircuitOpenError as e:
+                    error = str(e)
+                    await asyncio.sleep(e.retry_after)
+                except anthropic.APIError as e:
+                    error = repr(e)
+                    break
+                except Exception as e:
+                    # Recorded against the row, so one bad row does not stop the other workers
+                    logger.exception("Row %s failed", number)
+                    error = repr(e)
+                    break
+                else:
+                    if report != essay_analysis.ANALYSIS_FAILED_MESSAGE:
+                        return {
+                            'row': number,
+                            'student': row.get('student'),
+                            'topic': topic,
+                            'overall_band': essay_analysis.extract_overall_band(report),
+                            'report': report,
+                            'seconds': round(time.monotonic() - request_started, 3),
+                            'error': None,
+                        }
+                    error = "empty response"
+            return {'row': number, 'student': row.get('student'), 'topic': topic, 'error': error}
+
+        async def worker():
+            while True:
+                item = await rows.get()
+                if item is None:
+                    return
+                result = await grade(*item)
+                write(result)
+                counts['failed' if result['error'] else 'graded'] += 1
+                total = counts['graded'] + counts['failed']
+                if total % args.progress_every == 0:
+                    minutes = (time.monotonic() - started) / 60
+                    logger.info("%s essays graded, %.1f essays/minute", total, total / minutes)
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        for number, row, error in read_rows(args.input, args.format):
+            if number in done:
+                counts['skipped'] += 1
+                continue
+            await rows.put((number, row, error))
+        for _ in workers:
+            await rows.put(None)
+        await asyncio.gather(*workers)
+
+    await essay_analysis.close_client()
+    elapsed = time.monotonic() - started
+    total = counts['graded'] + counts['failed']
+    logger.info(
+        "Done: %s graded, %s failed, %s skipped from checkpoint in %.1fs (%.1f essays/minute)",
+        counts['graded'], counts['failed'], counts['skipped'], elapsed, total / (elapsed / 60) if elapsed else 0.0,
+    )
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="JSONL or CSV file with student, topic and essay fields")
+    parser.add_argument('output', help="JSONL file results are appended to; also the resume checkpoint")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="input format (default: from the file extension)")
+    parser.add_argument('--concurrency', type=int, default=4, help="parallel requests")
+    parser.add_argument('--rpm', type=float, default=50, help="requests per minute budget")
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--progress-every', type=int, default=25)
+    parser.add_argument('--base-url', help="Anthropic API base URL, e.g. a local stub model")
+    args = parser.parse_args()
+    args.format = args.format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+
+    if args.base_url:
+        os.environ['ANTHROPIC_BASE_URL'] = args.base_url
+        os.environ.setdefault('ANTHROPIC_API_KEY', 'stub-key')
+    os.environ['MAX_CONCURRENT_EVALUATIONS'] = str(args.concurrency)
+    os.environ['LLM_REQUESTS_PER_MINUTE'] = str(args.rpm)
+    os.environ['LLM_MAX_ATTEMPTS'] = str(args.max_attempts)
+
+    counts = asyncio.run(grade_file(args))
+    sys.exit(1 if counts['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,108 @@ from dotenv import load_dotenv
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')  # Leave unset to use api.telegram.org
+ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID', 872765833))  # receives user feedback
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 
+# Anthropic client configuration
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL')  # Leave unset to use the public API
+ANTHROPIC_TIMEOUT = float(os.getenv('ANTHROPIC_TIMEOUT', 60))
+ANTHROPIC_MAX_CONNECTIONS = int(os.getenv('ANTHROPIC_MAX_CONNECTIONS', 20))
+MAX_CONCURRENT_EVALUATIONS = int(os.getenv('MAX_CONCURRENT_EVALUATIONS', 8))
+# 'single': one request writes the whole report; 'parallel': one smaller request per IELTS criterion
+EVALUATION_MODE = os.getenv('EVALUATION_MODE', 'single').lower()
+# Requests one user's parallel evaluation has in flight at once. The queue already runs one
+# evaluation per user, and below the four criteria most of the latency gain of parallel mode is lost
+MAX_PARALLEL_REQUESTS_PER_USER = int(os.getenv('MAX_PARALLEL_REQUESTS_PER_USER', 4))
+
+# Provider rate limits, retries and circuit breaker, see utils/llm_resilience.py
+LLM_REQUESTS_PER_MINUTE = float(os.getenv('LLM_REQUESTS_PER_MINUTE', 50))
+LLM_TOKENS_PER_MINUTE = float(os.getenv('LLM_TOKENS_PER_MINUTE', 40000))
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', 4))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', 1))  # seconds
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', 30))  # seconds
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))  # seconds
+
+# Local screening before an essay is sent to the model
+MIN_ESSAY_WORDS = int(os.getenv('MIN_ESSAY_WORDS', 50))
+RECOMMENDED_ESSAY_WORDS = int(os.getenv('RECOMMENDED_ESSAY_WORDS', 250))
+
+# Evaluation cache configuration
+EVALUATION_CACHE_TTL = int(os.getenv('EVALUATION_CACHE_TTL', 7 * 24 * 3600))  # seconds
+EVALUATION_CACHE_MAX_ENTRIES = int(os.getenv('EVALUATION_CACHE_MAX_ENTRIES', 10000))
+
+# In-process cache of user records, see utils/user_cache.py. Writes through the bot update it at
+# once; a write by another process (e.g. the webhook function) shows after at most the TTL
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 300))  # seconds
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000))
+
+# Near-duplicate essays, see utils/near_duplicate.py: 'reuse' serves the user's own earlier
+# evaluation of a near copy on the same topic, 'flag' only counts and logs near copies, 'off' skips the check
+NEAR_DUPLICATE_ACTION = os.getenv('NEAR_DUPLICATE_ACTION', 'reuse').lower()
+# Estimated Jaccard similarity of 3-word shingles; 0.8 is about 3% of the words changed
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8))
+
+# Evaluation queue configuration
+EVALUATION_WORKERS = int(os.getenv('EVALUATION_WORKERS', 4))
+EVALUATION_QUEUE_MAX_DEPTH = int(os.getenv('EVALUATION_QUEUE_MAX_DEPTH', 200))
+EVALUATION_QUEUE_POLL_INTERVAL = float(os.getenv('EVALUATION_QUEUE_POLL_INTERVAL', 5))  # seconds
+# Running jobs started longer ago than this are taken over; until then the job may still be
+# running in another process or a concurrent invocation
+EVALUATION_JOB_LEASE = float(os.getenv('EVALUATION_JOB_LEASE', 900))  # seconds
+# Time the webhook function spends on queued evaluations per update. Keep it well under the
+# function timeout (at most 26s on Netlify); a job still running then goes back in the queue
+EVALUATION_DRAIN_BUDGET = float(os.getenv('EVALUATION_DRAIN_BUDGET', 15))  # seconds
+
+# Evaluation history, see /history
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 5))
+
+# Streaming evaluation configuration
+STREAM_EVALUATIONS = os.getenv('STREAM_EVALUATIONS', 'true').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))  # seconds between message edits
+
+# Outbound Bot API calls, see utils/outbound_scheduler.py. Telegram allows about 30
+# messages a second overall, about one a second per chat and 20 a minute per group;
+# a bucket lets through up to rate + burst messages in any one second
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 25))  # messages per second
+OUTBOUND_GLOBAL_BURST = float(os.getenv('OUTBOUND_GLOBAL_BURST', 5))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))  # messages per second to one private chat
+OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', 2))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20 / 60))  # messages per second to one group
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))  # after a 429, per call
+# Seconds between digests of user feedback sent to the admin; 0 forwards each piece at once
+FEEDBACK_DIGEST_INTERVAL = float(os.getenv('FEEDBACK_DIGEST_INTERVAL', 0))
+
+# Broadcasts to every user, see utils/broadcast.py
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 500))  # users read and checkpointed at a time
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 20))  # messages in flight at once
+# The scheduled serverless function (netlify/functions/broadcast.js) sends a running broadcast
+# in chunks of this many users, until the budget is spent; keep it under the 30s scheduled function limit
+BROADCAST_INVOCATION_CHUNK_SIZE = int(os.getenv('BROADCAST_INVOCATION_CHUNK_SIZE', 50))
+BROADCAST_INVOCATION_BUDGET = float(os.getenv('BROADCAST_INVOCATION_BUDGET', 20))  # seconds
+
 # Database configuration
-DB_NAME = 'users.db'
+DB_NAME = os.getenv('DB_NAME', 'users.db')
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', 4))
+
+# Dropping redelivered updates, see utils/update_dedup.py
+DEDUP_MAX_UPDATES = int(os.getenv('DEDUP_MAX_UPDATES', 10000))  # update ids remembered in memory
+DEDUP_SHARED_INDEX = os.getenv('DEDUP_SHARED_INDEX', 'false').lower() == 'true'  # also check SQLite, for several workers
+DEDUP_RETENTION = float(os.getenv('DEDUP_RETENTION', 24 * 3600))  # seconds; Telegram keeps updates for a day
+
+# Conversation state persistence
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', 2))  # seconds between batched writes
+
+# Metrics and profiling
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
+PROFILE_SLOW_UPDATES = float(os.getenv('PROFILE_SLOW_UPDATES', 0))  # seconds; 0 turns the profiler off
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))  # seconds
 
 # Webhook configuration
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')
-PORT = int(os.getenv('PORT', 5000))
\ No newline at end of file
+PORT = int(os.getenv('PORT', 5000))
+# Checked on every webhook request; random per start when unset, so set it when several processes share the webhook
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))  # Telegram's concurrent deliveries, 1-100
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 64))  # updates handled concurrently, one at a time per user
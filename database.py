@@ -1,39 +1,155 @@
+import asyncio
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from sqlite3 import Error
-from config import DB_NAME
+from config import DB_NAME, DB_EXECUTOR_WORKERS
+from utils import metrics
+
+# One long-lived connection per thread; sqlite3 caches prepared statements per connection
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+# Runs blocking database calls off the event loop, see run()
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+# Bump whenever create_table() or the column checks in migrate_database() change
+SCHEMA_VERSION = 10
+
 def migrate_database():
-    conn = create_connection()
+    """Bring the schema up to date. Once PRAGMA user_version says it is, this is a single cheap read."""
+    conn = get_connection()
     if conn is not None:
         try:
-            cursor = conn.cursor()
-            # Check if the columns exist, if not, add them
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'free_uses_left' not in columns:
-                cursor.execute("ALTER TABLE users ADD COLUMN free_uses_left INTEGER DEFAULT 3")
-            
-            if 'purchased_uses' not in columns:
-                cursor.execute("ALTER TABLE users ADD COLUMN purchased_uses INTEGER DEFAULT 0")
-            
-            conn.commit()
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                return
+            with transaction(immediate=True):
+                # Another process may have migrated while we waited for the lock
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                    return
+                create_table(conn)
+                cursor = conn.cursor()
+                # Check if the columns exist, if not, add them
+                cursor.execute("PRAGMA table_info(users)")
+                columns = [column[1] for column in cursor.fetchall()]
+
+                if 'free_uses_left' not in columns:
+                    cursor.execute("ALTER TABLE users ADD COLUMN free_uses_left INTEGER DEFAULT 3")
+
+                if 'purchased_uses' not in columns:
+                    cursor.execute("ALTER TABLE users ADD COLUMN purchased_uses INTEGER DEFAULT 0")
+
+                cursor.execute("PRAGMA table_info(essay_signatures)")
+                columns = [column[1] for column in cursor.fetchall()]
+
+                # Rows indexed before these columns existed never match a reuse
+                if 'user_id' not in columns:
+                    cursor.execute("ALTER TABLE essay_signatures ADD COLUMN user_id INTEGER")
+
+                if 'report_version' not in columns:
+                    cursor.execute("ALTER TABLE essay_signatures ADD COLUMN report_version TEXT")
+
+                cursor.execute("PRAGMA table_info(pending_feedback)")
+                if 'claimed_at' not in [column[1] for column in cursor.fetchall()]:
+                    cursor.execute("ALTER TABLE pending_feedback ADD COLUMN claimed_at REAL")
+
+                cursor.execute("PRAGMA table_info(evaluation_usage)")
+                columns = [column[1] for column in cursor.fetchall()]
+
+                # Requests recorded before these columns existed stay unattributed
+                if 'user_id' not in columns:
+                    cursor.execute("ALTER TABLE evaluation_usage ADD COLUMN user_id INTEGER")
+
+                if 'job_id' not in columns:
+                    cursor.execute("ALTER TABLE evaluation_usage ADD COLUMN job_id INTEGER")
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_evaluation_usage_user_id ON evaluation_usage(user_id, created_at)")
+
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             print("Database migration completed successfully.")
         except Error as e:
             print(f"Error during database migration: {e}")
-        finally:
-            conn.close()
     else:
         print("Error! Cannot create the database connection.")
 
 def create_connection():
     conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
+        # Autocommit mode: single statements commit on their own, multi-statement
+        # work goes through transaction()
+        conn = sqlite3.connect(DB_NAME, isolation_level=None, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA cache_size = -8000")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA busy_timeout = 5000")
         return conn
     except Error as e:
         print(e)
     return conn
 
+def get_connection():
+    """Return this thread's persistent connection, opening it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = create_connection()
+        if conn is None:
+            return None
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_connections():
+    """Close every persistent connection, e.g. on shutdown."""
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+    _local.__dict__.clear()
+
+@contextmanager
+def transaction(immediate=False):
+    """Run several statements atomically on this thread's connection.
+
+    ``immediate`` takes the write lock up front, for read-then-write sequences.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def _timed(func, args, submitted):
+    started = time.perf_counter()
+    metrics.db_wait_duration.observe(started - submitted)
+    try:
+        return func(*args)
+    except Exception:
+        metrics.db_errors.inc(query=func.__name__)
+        raise
+    finally:
+        metrics.db_query_duration.observe(time.perf_counter() - started, query=func.__name__)
+
+async def run(func, *args):
+    """Await a blocking database function on the database executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed, func, args, time.perf_counter())
+
+def run_sync(func, *args):
+    """Run a database function on the database executor from a thread outside the event loop, and wait for it.
+
+    Threads that come and go, like those serving HTTP requests, would otherwise
+    each open a connection that is never closed.
+    """
+    return _executor.submit(_timed, func, args, time.perf_counter()).result()
+
 def create_table(conn):
     try:
         cursor = conn.cursor()
@@ -46,77 +162,443 @@ def create_table(conn):
                 purchased_uses INTEGER DEFAULT 0
             )
         ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS evaluation_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_evaluation_cache_accessed_at ON evaluation_cache(accessed_at)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS evaluation_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                topic TEXT,
+                essay TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                created_at REAL NOT NULL,
+                started_at REAL,
+                error TEXT
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_evaluation_jobs_status ON evaluation_jobs(status, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_evaluation_jobs_user_id ON evaluation_jobs(user_id, status)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS evaluation_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                cache_creation_input_tokens INTEGER NOT NULL DEFAULT 0,
+                cache_read_input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL,
+                latency_ms REAL NOT NULL,
+                user_id INTEGER,
+                job_id INTEGER
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_evaluation_usage_created_at ON evaluation_usage(created_at)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                update_id INTEGER PRIMARY KEY,
+                received_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_updates_received_at ON processed_updates(received_at)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS evaluations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                topic_hash TEXT NOT NULL,
+                topic TEXT,
+                overall_band REAL,
+                criteria_bands TEXT,
+                report TEXT NOT NULL
+            )
+        ''')
+        # Serves /history pages newest first, keyed on id so a page never scans the ones before it
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_evaluations_user_id ON evaluations(user_id, id)")
+        # The rowid is part of every index entry, so this also returns the latest evaluation on a topic directly
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_evaluations_topic_hash ON evaluations(user_id, topic_hash)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pending_feedback (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                message TEXT NOT NULL,
+                claimed_at REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                finished_at REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS essay_signatures (
+                evaluation_id INTEGER PRIMARY KEY,
+                topic_hash TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                essay TEXT NOT NULL,
+                user_id INTEGER,
+                report_version TEXT
+            )
+        ''')
+        # One row per LSH band of every signature; WITHOUT ROWID keeps the lookup key and the id in one B-tree
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS essay_lsh_bands (
+                band_key INTEGER NOT NULL,
+                evaluation_id INTEGER NOT NULL,
+                PRIMARY KEY (band_key, evaluation_id)
+            ) WITHOUT ROWID
+        ''')
     except Error as e:
         print(e)
 
+_USER_COLUMNS = "id, phone_number, usage_count, free_uses_left, purchased_uses"
+
 def get_user(user_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cur.fetchone()
-    conn.close()
-    return user
+    cur = get_connection().execute(f"SELECT {_USER_COLUMNS} FROM users WHERE id = ?", (user_id,))
+    return cur.fetchone()
 
 def add_user(user_id):
-    conn = create_connection()
     sql = ''' INSERT OR IGNORE INTO users(id, free_uses_left, purchased_uses) VALUES(?, 3, 0) '''
-    cur = conn.cursor()
-    cur.execute(sql, (user_id,))
-    conn.commit()
-    conn.close()
+    get_connection().execute(sql, (user_id,))
+
+def get_or_add_user(user_id):
+    """add_user() then get_user() in one executor call."""
+    conn = get_connection()
+    conn.execute("INSERT OR IGNORE INTO users(id, free_uses_left, purchased_uses) VALUES(?, 3, 0)", (user_id,))
+    return conn.execute(f"SELECT {_USER_COLUMNS} FROM users WHERE id = ?", (user_id,)).fetchone()
 
 def update_phone_number(user_id, phone_number):
-    conn = create_connection()
     sql = ''' UPDATE users SET phone_number = ? WHERE id = ? '''
-    cur = conn.cursor()
-    cur.execute(sql, (phone_number, user_id))
-    conn.commit()
-    conn.close()
+    get_connection().execute(sql, (phone_number, user_id))
 
 def decrement_free_uses(user_id):
-    conn = create_connection()
     sql = ''' UPDATE users SET free_uses_left = free_uses_left - 1 WHERE id = ? AND free_uses_left > 0 '''
-    cur = conn.cursor()
-    cur.execute(sql, (user_id,))
-    conn.commit()
-    conn.close()
+    get_connection().execute(sql, (user_id,))
 
 def decrement_purchased_uses(user_id):
-    conn = create_connection()
     sql = ''' UPDATE users SET purchased_uses = purchased_uses - 1 WHERE id = ? AND purchased_uses > 0 '''
-    cur = conn.cursor()
-    cur.execute(sql, (user_id,))
-    conn.commit()
-    conn.close()
+    get_connection().execute(sql, (user_id,))
 
 def get_free_uses_left(user_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT free_uses_left FROM users WHERE id = ?", (user_id,))
+    cur = get_connection().execute("SELECT free_uses_left FROM users WHERE id = ?", (user_id,))
     result = cur.fetchone()
-    conn.close()
     return result[0] if result else 0
 
 def get_purchased_uses(user_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT purchased_uses FROM users WHERE id = ?", (user_id,))
+    cur = get_connection().execute("SELECT purchased_uses FROM users WHERE id = ?", (user_id,))
     result = cur.fetchone()
-    conn.close()
     return result[0] if result else 0
 
+def consume_use(user_id):
+    """Take one use, free uses first, in a single write transaction.
+
+    Returns (bucket, free_uses_left, purchased_uses) after the decrement, where bucket
+    is the column that was charged, or None if the user has no uses left.
+    """
+    with transaction(immediate=True) as conn:
+        cur = conn.execute("SELECT free_uses_left, purchased_uses FROM users WHERE id = ?", (user_id,))
+        row = cur.fetchone()
+        if not row or (row[0] <= 0 and row[1] <= 0):
+            return None
+        if row[0] > 0:
+            conn.execute("UPDATE users SET free_uses_left = free_uses_left - 1 WHERE id = ?", (user_id,))
+            return 'free_uses_left', row[0] - 1, row[1]
+        conn.execute("UPDATE users SET purchased_uses = purchased_uses - 1 WHERE id = ?", (user_id,))
+        return 'purchased_uses', row[0], row[1] - 1
+
+def refund_use(user_id, bucket):
+    """Give back a use taken by consume_use()."""
+    if bucket not in ('free_uses_left', 'purchased_uses'):
+        raise ValueError(f"Unknown usage bucket: {bucket}")
+    get_connection().execute(f"UPDATE users SET {bucket} = {bucket} + 1 WHERE id = ?", (user_id,))
+
 def add_purchased_uses(user_id, amount):
-    conn = create_connection()
     sql = ''' UPDATE users SET purchased_uses = purchased_uses + ? WHERE id = ? '''
-    cur = conn.cursor()
-    cur.execute(sql, (amount, user_id))
-    conn.commit()
-    conn.close()
+    get_connection().execute(sql, (amount, user_id))
+
+def get_cached_evaluation(key, min_created_at):
+    conn = get_connection()
+    cur = conn.execute("SELECT result FROM evaluation_cache WHERE key = ? AND created_at >= ?", (key, min_created_at))
+    result = cur.fetchone()
+    if result:
+        conn.execute("UPDATE evaluation_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+    return result[0] if result else None
+
+def store_cached_evaluation(key, result, min_created_at, max_entries):
+    """Store an evaluation, dropping expired entries and the least recently used ones over the limit."""
+    now = time.time()
+    sql = ''' INSERT OR REPLACE INTO evaluation_cache(key, result, created_at, accessed_at) VALUES(?, ?, ?, ?) '''
+    with transaction() as conn:
+        conn.execute(sql, (key, result, now, now))
+        conn.execute("DELETE FROM evaluation_cache WHERE created_at < ?", (min_created_at,))
+        conn.execute(''' DELETE FROM evaluation_cache WHERE key IN (
+                            SELECT key FROM evaluation_cache ORDER BY accessed_at
+                            LIMIT max(0, (SELECT COUNT(*) FROM evaluation_cache) - ?)) ''', (max_entries,))
+
+def enqueue_evaluation_job(user_id, chat_id, topic, essay, bucket, max_depth):
+    """Persist a pending evaluation and return (status, job_id, position in the queue).
+
+    The status is 'queued', 'full' if ``max_depth`` jobs are pending already, or
+    'in_progress' if the user already has an evaluation pending or running; only a
+    queued job has an id and a position.
+    """
+    sql = ''' INSERT INTO evaluation_jobs(user_id, chat_id, topic, essay, bucket, created_at) VALUES(?, ?, ?, ?, ?, ?) '''
+    with transaction(immediate=True) as conn:
+        if conn.execute("SELECT COUNT(*) FROM evaluation_jobs WHERE status = 'pending'").fetchone()[0] >= max_depth:
+            return 'full', None, None
+        cur = conn.execute(''' SELECT 1 FROM evaluation_jobs WHERE user_id = ? AND status IN ('pending', 'running')
+                               LIMIT 1 ''', (user_id,))
+        if cur.fetchone():
+            return 'in_progress', None, None
+        job_id = conn.execute(sql, (user_id, chat_id, topic, essay, bucket, time.time())).lastrowid
+        cur = conn.execute("SELECT COUNT(*) FROM evaluation_jobs WHERE status = 'pending' AND id <= ?", (job_id,))
+        return 'queued', job_id, cur.fetchone()[0]
+
+def claim_evaluation_job():
+    """Mark the oldest pending job as running and return it, or None if the queue is empty."""
+    with transaction(immediate=True) as conn:
+        cur = conn.execute(''' SELECT id, user_id, chat_id, topic, essay, bucket, created_at FROM evaluation_jobs
+                               WHERE status = 'pending' ORDER BY id LIMIT 1 ''')
+        job = cur.fetchone()
+        if job:
+            conn.execute("UPDATE evaluation_jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job[0]))
+        return job
+
+def complete_evaluation_job(job_id):
+    get_connection().execute("DELETE FROM evaluation_jobs WHERE id = ?", (job_id,))
+
+def release_evaluation_job(job_id):
+    """Put a running job back in the queue, e.g. while the provider is unavailable."""
+    sql = ''' UPDATE evaluation_jobs SET status = 'pending', started_at = NULL WHERE id = ? '''
+    get_connection().execute(sql, (job_id,))
+
+def fail_evaluation_job(job_id, error):
+    sql = ''' UPDATE evaluation_jobs SET status = 'failed', error = ? WHERE id = ? '''
+    get_connection().execute(sql, (error, job_id))
+
+def requeue_running_evaluation_jobs(started_before=None):
+    """Put jobs left running by a process that stopped back in the queue. Returns how many.
+
+    With ``started_before``, only jobs started before then are requeued; later ones
+    may still be running in another process.
+    """
+    sql = ''' UPDATE evaluation_jobs SET status = 'pending', started_at = NULL
+              WHERE status = 'running' AND started_at < ? '''
+    cur = get_connection().execute(sql, (float("inf") if started_before is None else started_before,))
+    return cur.rowcount
+
+def get_evaluation_queue_stats():
+    """Return (pending jobs, running jobs, created_at of the oldest pending job or None)."""
+    cur = get_connection().execute(''' SELECT COUNT(*) FILTER (WHERE status = 'pending'),
+                                             COUNT(*) FILTER (WHERE status = 'running'),
+                                             MIN(created_at) FILTER (WHERE status = 'pending')
+                                      FROM evaluation_jobs WHERE status IN ('pending', 'running') ''')
+    return cur.fetchone()
+
+def record_evaluation_usage(model, prompt_version, mode, input_tokens, cache_creation_input_tokens,
+                            cache_read_input_tokens, output_tokens, latency_ms, user_id=None, job_id=None):
+    sql = ''' INSERT INTO evaluation_usage(created_at, model, prompt_version, mode, input_tokens,
+                                          cache_creation_input_tokens, cache_read_input_tokens, output_tokens, latency_ms,
+                                          user_id, job_id)
+              VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '''
+    get_connection().execute(sql, (time.time(), model, prompt_version, mode, input_tokens,
+                                   cache_creation_input_tokens, cache_read_input_tokens, output_tokens, latency_ms,
+                                   user_id, job_id))
+
+def get_evaluation_usage_summary(since):
+    """Return (requests, input, cache write, cache read, output tokens, average latency ms) since a timestamp."""
+    cur = get_connection().execute(''' SELECT COUNT(*), COALESCE(SUM(input_tokens), 0),
+                                             COALESCE(SUM(cache_creation_input_tokens), 0),
+                                             COALESCE(SUM(cache_read_input_tokens), 0),
+                                             COALESCE(SUM(output_tokens), 0), COALESCE(AVG(latency_ms), 0)
+                                      FROM evaluation_usage WHERE created_at >= ? ''', (since,))
+    return cur.fetchone()
+
+def get_user_state(user_id):
+    """Return the stored conversation state of a user as a JSON string, or None."""
+    cur = get_connection().execute("SELECT data FROM user_state WHERE user_id = ?", (user_id,))
+    result = cur.fetchone()
+    return result[0] if result else None
+
+def save_user_states(states):
+    """Write many (user_id, JSON data) pairs in one transaction."""
+    now = time.time()
+    sql = ''' INSERT OR REPLACE INTO user_state(user_id, data, updated_at) VALUES(?, ?, ?) '''
+    with transaction() as conn:
+        conn.executemany(sql, [(user_id, data, now) for user_id, data in states])
+
+def delete_user_state(user_id):
+    get_connection().execute("DELETE FROM user_state WHERE user_id = ?", (user_id,))
+
+def claim_update(update_id, received_at):
+    """Record an update as processed. Returns False if some process already did."""
+    cur = get_connection().execute("INSERT OR IGNORE INTO processed_updates(update_id, received_at) VALUES(?, ?)",
+                                   (update_id, received_at))
+    return cur.rowcount == 1
+
+def prune_processed_updates(before):
+    get_connection().execute("DELETE FROM processed_updates WHERE received_at < ?", (before,))
+
+def record_evaluation(user_id, topic_hash, topic, overall_band, criteria_bands, report):
+    """Store a delivered evaluation in the user's history. Returns its id."""
+    sql = ''' INSERT INTO evaluations(user_id, created_at, topic_hash, topic, overall_band, criteria_bands, report)
+              VALUES(?, ?, ?, ?, ?, ?, ?) '''
+    cur = get_connection().execute(sql, (user_id, time.time(), topic_hash, topic, overall_band, criteria_bands, report))
+    return cur.lastrowid
+
+def get_evaluation_history(user_id, before_id, limit):
+    """Return up to ``limit`` (id, created_at, topic, overall_band) of a user's evaluations, newest first.
+
+    Keyset pagination: pass the last id of the previous page as ``before_id``, or None
+    for the first page, so every page costs the same however far back it is.
+    """
+    if before_id is None:
+        cur = get_connection().execute(''' SELECT id, created_at, topic, overall_band FROM evaluations
+                                          WHERE user_id = ? ORDER BY id DESC LIMIT ? ''', (user_id, limit))
+    else:
+        cur = get_connection().execute(''' SELECT id, created_at, topic, overall_band FROM evaluations
+                                          WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ? ''',
+                                       (user_id, before_id, limit))
+    return cur.fetchall()
+
+def get_evaluation(user_id, evaluation_id):
+    """Return (created_at, topic, report) of one of the user's evaluations, or None."""
+    cur = get_connection().execute("SELECT created_at, topic, report FROM evaluations WHERE id = ? AND user_id = ?",
+                                   (evaluation_id, user_id))
+    return cur.fetchone()
+
+def get_latest_evaluation_for_topic(user_id, topic_hash):
+    """Return the id of the user's latest evaluation on a topic, or None."""
+    cur = get_connection().execute(''' SELECT id FROM evaluations WHERE user_id = ? AND topic_hash = ?
+                                      ORDER BY id DESC LIMIT 1 ''', (user_id, topic_hash))
+    result = cur.fetchone()
+    return result[0] if result else None
+
+def add_pending_feedback(messages):
+    """Hold (created_at, message) pairs for the next feedback digest."""
+    sql = ''' INSERT INTO pending_feedback(created_at, message) VALUES(?, ?) '''
+    with transaction() as conn:
+        conn.executemany(sql, messages)
+
+def claim_pending_feedback(claimed_before):
+    """Claim and return every held (id, message) no other process is sending, oldest first.
+
+    Claims made before ``claimed_before`` are by a process that died or froze mid-send
+    and are taken over. Delete what is sent with delete_pending_feedback().
+    """
+    now = time.time()
+    with transaction(immediate=True) as conn:
+        conn.execute("UPDATE pending_feedback SET claimed_at = ? WHERE claimed_at IS NULL OR claimed_at < ?",
+                     (now, claimed_before))
+        return conn.execute("SELECT id, message FROM pending_feedback WHERE claimed_at = ? ORDER BY id",
+                            (now,)).fetchall()
+
+def delete_pending_feedback(ids):
+    get_connection().executemany("DELETE FROM pending_feedback WHERE id = ?", [(i,) for i in ids])
+
+def release_pending_feedback(ids):
+    """Give up the claim on held feedback that could not be sent, for the next digest."""
+    get_connection().executemany("UPDATE pending_feedback SET claimed_at = NULL WHERE id = ?", [(i,) for i in ids])
+
+def get_oldest_pending_feedback():
+    """Return the created_at of the oldest held feedback, or None."""
+    return get_connection().execute("SELECT MIN(created_at) FROM pending_feedback").fetchone()[0]
+
+def get_user_ids_after(after_id, limit):
+    """Return up to ``limit`` user ids greater than ``after_id``, in order; a chunk of a walk over all users."""
+    cur = get_connection().execute("SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+    return [row[0] for row in cur]
+
+def create_broadcast(text):
+    """Start a broadcast. Returns its id, or None if another one is still running."""
+    with transaction(immediate=True) as conn:
+        if conn.execute("SELECT 1 FROM broadcasts WHERE status = 'running' LIMIT 1").fetchone():
+            return None
+        return conn.execute("INSERT INTO broadcasts(created_at, text) VALUES(?, ?)", (time.time(), text)).lastrowid
+
+def get_running_broadcast():
+    """Return (id, text, last_user_id, sent, failed, blocked) of the running broadcast, or None."""
+    cur = get_connection().execute(''' SELECT id, text, last_user_id, sent, failed, blocked FROM broadcasts
+                                      WHERE status = 'running' ORDER BY id LIMIT 1 ''')
+    return cur.fetchone()
+
+def get_latest_broadcast():
+    """Return (id, status, created_at, finished_at, sent, failed, blocked) of the latest broadcast, or None."""
+    cur = get_connection().execute(''' SELECT id, status, created_at, finished_at, sent, failed, blocked
+                                      FROM broadcasts ORDER BY id DESC LIMIT 1 ''')
+    return cur.fetchone()
+
+def checkpoint_broadcast(broadcast_id, last_user_id, sent, failed, blocked):
+    """Record that every user up to ``last_user_id`` has been handled. Returns False if the broadcast was cancelled."""
+    sql = ''' UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?
+              WHERE id = ? AND status = 'running' '''
+    return get_connection().execute(sql, (last_user_id, sent, failed, blocked, broadcast_id)).rowcount > 0
+
+def claim_broadcast_chunk(broadcast_id, after_id, last_user_id):
+    """Move the checkpoint from ``after_id`` to ``last_user_id`` before the chunk is sent.
+
+    Returns False if another process claimed the chunk first or the broadcast is no longer running.
+    """
+    sql = ''' UPDATE broadcasts SET last_user_id = ? WHERE id = ? AND status = 'running' AND last_user_id = ? '''
+    return get_connection().execute(sql, (last_user_id, broadcast_id, after_id)).rowcount > 0
+
+def add_broadcast_counts(broadcast_id, sent, failed, blocked):
+    sql = ''' UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, blocked = blocked + ? WHERE id = ? '''
+    get_connection().execute(sql, (sent, failed, blocked, broadcast_id))
+
+def finish_broadcast(broadcast_id, status='done'):
+    """End a running broadcast. Returns False if it had already ended, e.g. was cancelled."""
+    sql = ''' UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = 'running' '''
+    return get_connection().execute(sql, (status, time.time(), broadcast_id)).rowcount > 0
+
+def add_essay_signature(evaluation_id, user_id, topic_hash, report_version, signature, essay, band_keys):
+    with transaction() as conn:
+        conn.execute(''' INSERT OR REPLACE INTO essay_signatures(evaluation_id, user_id, topic_hash, report_version,
+                                                                signature, essay)
+                         VALUES(?, ?, ?, ?, ?, ?) ''', (evaluation_id, user_id, topic_hash, report_version, signature, essay))
+        conn.executemany("INSERT OR IGNORE INTO essay_lsh_bands(band_key, evaluation_id) VALUES(?, ?)",
+                         [(band_key, evaluation_id) for band_key in band_keys])
+
+def get_essay_signature_candidates(band_keys):
+    """Return (evaluation_id, user_id, topic_hash, report_version, signature) of every essay sharing an LSH band key."""
+    placeholders = ", ".join("?" * len(band_keys))
+    cur = get_connection().execute(f''' SELECT evaluation_id, user_id, topic_hash, report_version, signature
+                                       FROM essay_signatures
+                                       WHERE evaluation_id IN (SELECT evaluation_id FROM essay_lsh_bands
+                                                               WHERE band_key IN ({placeholders})) ''', band_keys)
+    return cur.fetchall()
+
+def get_evaluation_of_essay(evaluation_id):
+    """Return (created_at, report, essay) of an indexed evaluation, or None."""
+    cur = get_connection().execute(''' SELECT e.created_at, e.report, s.essay FROM evaluations e
+                                      JOIN essay_signatures s ON s.evaluation_id = e.id WHERE e.id = ? ''',
+                                   (evaluation_id,))
+    return cur.fetchone()
 
 # Initialize the database
-conn = create_connection()
-if conn is not None:
-    create_table(conn)
-    conn.close()
-else:
-    print("Error! Cannot create the database connection.")
\ No newline at end of file
+migrate_database()
@@ -0,0 +1,37 @@
+import datetime
+from telegram import Update
+from telegram.ext import ContextTypes
+import database
+from utils.broadcast import broadcaster, format_counts
+
+async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /broadcast <message> from the admin; /broadcast cancel stops the running broadcast, and
+    without a message, report on the latest broadcast."""
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await update.message.reply_text(await _broadcast_status())
+        return
+    if parts[1].strip().lower() == "cancel":
+        broadcast_id = await broadcaster.cancel()
+        if broadcast_id is None:
+            await update.message.reply_text("No broadcast is running.")
+        else:
+            await update.message.reply_text(f"Broadcast #{broadcast_id} cancelled.\n\n" + await _broadcast_status())
+        return
+
+    broadcast_id = await broadcaster.begin(context.bot, parts[1])
+    if broadcast_id is None:
+        await update.message.reply_text("A broadcast is still running.\n\n" + await _broadcast_status())
+    else:
+        await update.message.reply_text(f"Broadcast #{broadcast_id} started. Send /broadcast to see its progress; "
+                                        "you'll get a message when it's finished.")
+
+async def _broadcast_status() -> str:
+    latest = await database.run(database.get_latest_broadcast)
+    if latest is None:
+        return "No broadcasts yet. Send /broadcast followed by the message to send it to every user."
+    broadcast_id, status, created_at, finished_at, sent, failed, blocked = latest
+    started = datetime.datetime.fromtimestamp(created_at).strftime("%d %b %Y %H:%M")
+    hint = "\nSend /broadcast cancel to stop it." if status == 'running' else ""
+    return (f"Broadcast #{broadcast_id}, started {started}: {status}\n"
+            + format_counts({"sent": sent, "failed": failed, "blocked": blocked}) + hint)
@@ -1,7 +1,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils import essay_analysis
-from utils.usage_utils import check_and_decrement_uses, handle_insufficient_uses
+from utils import llm_resilience, pre_analysis, update_dedup
+from utils.evaluation_queue import evaluation_queue, EvaluationInProgress
+from utils.usage_utils import consume_use, refund_use, handle_insufficient_uses
 
 async def handle_evaluate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the Evaluate option."""
@@ -9,17 +10,40 @@ async def handle_evaluate(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     context.user_data['state'] = 'waiting_for_topic'
 
 async def handle_essay(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle the essay submission and analysis."""
+    """Handle the essay submission by queueing it for analysis."""
     user_id = update.effective_user.id
     topic = context.user_data.get('topic')
     essay = update.message.text
 
-    # Check and decrement uses before making the API call
-    if await check_and_decrement_uses(user_id):
-        analysis_result = await essay_analysis.analyze_essay(topic, essay)
-        await update.message.reply_text(f"*Analysis Result:*\n\n{analysis_result}", parse_mode='Markdown')
-    else:
+    # Screen out obvious non-essays locally, before spending a use or an API call
+    verdict, message = pre_analysis.screen(pre_analysis.analyze_text(essay))
+    if verdict == pre_analysis.REJECT:
+        # Keep the topic and state so the next message is taken as the essay
+        await update.message.reply_text(message)
+        return
+    if verdict == pre_analysis.WARN:
+        await update.message.reply_text(message)
+
+    # Take a use before queueing; the queue gives it back if the analysis fails
+    consumed = await consume_use(user_id)
+    if consumed is None:
         await handle_insufficient_uses(update, context)
+    else:
+        try:
+            position = await evaluation_queue.submit(user_id, update.effective_chat.id, topic, essay, consumed[0])
+        except EvaluationInProgress:
+            await refund_use(user_id, consumed[0])
+            update_dedup.duplicates.inc(kind="evaluation")
+            # Keep the topic and state so the essay can be sent again once the result is in
+            await update.message.reply_text("Your previous essay is still being evaluated. You'll get its result here first; then send this essay again. Your use has not been charged.")
+            return
+        if position is None:
+            await refund_use(user_id, consumed[0])
+            await update.message.reply_text("We're receiving a lot of essays right now. Please try again in a few minutes; your use has not been charged.")
+        elif llm_resilience.breaker.blocked_for:
+            await update.message.reply_text(f"Your essay is queued for evaluation (position {position}). Our evaluation service is busy right now, so it may take a little longer than usual; we'll send the result here as soon as it's ready.")
+        else:
+            await update.message.reply_text(f"Your essay is queued for evaluation (position {position}). We'll send the result here as soon as it's ready.")
 
     # Reset state
-    context.user_data.clear()
\ No newline at end of file
+    context.user_data.clear()
@@ -1,8 +1,9 @@
+import html
 from telegram import Update
 from telegram.ext import ContextTypes
-
-# Constants
-ADMIN_USER_ID = 872765833  
+from config import ADMIN_USER_ID, FEEDBACK_DIGEST_INTERVAL
+from utils.feedback_digest import feedback_digest
+from utils.outbound_scheduler import NOTICE, rate_limit_args
 
 async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the Feedback option."""
@@ -20,14 +21,19 @@ async def process_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         f"From: {user.mention_html()}\n"
         f"User ID: {user.id}\n"
         f"Username: {user.username or 'Not set'}\n"
-        f"First Name: {user.first_name}\n"
-        f"Last Name: {user.last_name or 'Not set'}\n\n"
-        f"Feedback: {feedback}"
+        f"First Name: {html.escape(user.first_name)}\n"
+        f"Last Name: {html.escape(user.last_name or 'Not set')}\n\n"
+        f"Feedback: {html.escape(feedback)}"
     )
     
-    # Send the feedback to the admin
+    # Send the feedback to the admin, or hold it for the next digest; either way it
+    # waits behind replies to users
     try:
-        await context.bot.send_message(chat_id=ADMIN_USER_ID, text=feedback_message, parse_mode='HTML')
+        if FEEDBACK_DIGEST_INTERVAL:
+            await feedback_digest.add(feedback_message)
+        else:
+            await context.bot.send_message(chat_id=ADMIN_USER_ID, text=feedback_message, parse_mode='HTML',
+                                           **rate_limit_args(context.bot, NOTICE))
         await update.message.reply_text("Thank you for your feedback! It has been sent to our team.")
     except Exception as e:
         print(f"Error sending feedback to admin: {e}")
@@ -0,0 +1,71 @@
+import datetime
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+import database
+from config import HISTORY_PAGE_SIZE
+from utils.streaming_reply import send_text
+
+NO_HISTORY_MESSAGE = "You have no evaluations yet. Once an essay is evaluated, its report is kept here."
+
+def _date(created_at: float) -> str:
+    return datetime.datetime.fromtimestamp(created_at).strftime("%d %b %Y")
+
+def _band(overall_band) -> str:
+    return f"Band {overall_band:.1f}" if overall_band is not None else "No band"
+
+def view_again_button(evaluation_id: int) -> InlineKeyboardButton:
+    """A button that shows a stored report again, without another evaluation."""
+    return InlineKeyboardButton("View report again", callback_data=f"view_{evaluation_id}")
+
+async def _history_page(user_id: int, before_id: int = None):
+    """Return the text and keyboard of one page of the user's history, newest first."""
+    # One row more than shown tells whether there is an older page
+    rows = await database.run(database.get_evaluation_history, user_id, before_id, HISTORY_PAGE_SIZE + 1)
+    if not rows:
+        return NO_HISTORY_MESSAGE, None
+    page = rows[:HISTORY_PAGE_SIZE]
+
+    lines = ["Your evaluations, newest first:"]
+    keyboard = []
+    for evaluation_id, created_at, topic, overall_band in page:
+        topic = " ".join((topic or "No topic").split())
+        lines.append(f"{_date(created_at)} · {_band(overall_band)}\n{topic[:80]}")
+        keyboard.append([InlineKeyboardButton(f"{_date(created_at)} · {_band(overall_band)} · {topic[:24]}",
+                                              callback_data=f"view_{evaluation_id}")])
+
+    navigation = []
+    if before_id is not None:
+        navigation.append(InlineKeyboardButton("« Newest", callback_data="history_"))
+    if len(rows) > HISTORY_PAGE_SIZE:
+        # The cursor is the last id shown; the next page starts below it
+        navigation.append(InlineKeyboardButton("Older »", callback_data=f"history_{page[-1][0]}"))
+    if navigation:
+        keyboard.append(navigation)
+    return "\n\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def handle_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the /history command."""
+    text, reply_markup = await _history_page(update.effective_user.id)
+    await update.effective_message.reply_text(text, reply_markup=reply_markup)
+
+async def handle_history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the history page and "view again" buttons."""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    action, _, argument = query.data.partition("_")
+
+    if action == "history":
+        await query.answer()
+        text, reply_markup = await _history_page(user_id, int(argument) if argument else None)
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
+
+    # Looked up by user as well, so a forged callback cannot read someone else's report
+    evaluation = await database.run(database.get_evaluation, user_id, int(argument))
+    if evaluation is None:
+        await query.answer("That evaluation is no longer available.", show_alert=True)
+        return
+    await query.answer()
+    created_at, topic, report = evaluation
+    await send_text(context.bot, update.effective_chat.id,
+                    f"*Analysis Result* ({_date(created_at)}):\n\n{report}", parse_mode='Markdown')
@@ -0,0 +1,74 @@
+"""The bot's handler table, shared by the long-running bot and the serverless function.
+
+Callbacks are referenced by module path and imported on first use, so an update that
+only needs the purchase menu does not pay for importing the evaluation stack. Every
+callback is timed into utils.metrics, and profiled when PROFILE_SLOW_UPDATES is set.
+"""
+import functools
+import importlib
+from telegram import Update
+from telegram.ext import (Application, ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, MessageHandler,
+                          TypeHandler, filters)
+from config import ADMIN_USER_ID, PROFILE_SLOW_UPDATES, PROFILE_SAMPLE_INTERVAL
+from utils import metrics, update_dedup
+
+profiler = metrics.SlowUpdateProfiler(PROFILE_SLOW_UPDATES, PROFILE_SAMPLE_INTERVAL) if PROFILE_SLOW_UPDATES else None
+
+def lazy_callback(module_name: str, attr: str):
+    """Return a handler callback that imports ``module_name`` the first time it runs."""
+    target = None
+
+    async def callback(update, context):
+        nonlocal target
+        if target is None:
+            target = getattr(importlib.import_module(module_name), attr)
+        started = profiler.begin() if profiler else None
+        try:
+            with metrics.handler_duration.time(handler=attr):
+                return await target(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            metrics.handler_errors.inc(handler=attr)
+            raise
+        finally:
+            if profiler:
+                profiler.end(started, attr)
+
+    callback.__name__ = callback.__qualname__ = attr
+    return callback
+
+def build_handlers() -> list:
+    start = functools.partial(lazy_callback, "handlers.start")
+    evaluate = functools.partial(lazy_callback, "handlers.evaluate")
+    feedback = functools.partial(lazy_callback, "handlers.feedback")
+    history = functools.partial(lazy_callback, "handlers.history")
+    broadcast = functools.partial(lazy_callback, "handlers.broadcast")
+    user_management = functools.partial(lazy_callback, "utils.user_management")
+
+    return [
+        CommandHandler("start", start("handle_start")),
+        CommandHandler("evaluate", evaluate("handle_evaluate")),
+        CommandHandler("feedback", feedback("handle_feedback")),
+        CommandHandler("check_uses", user_management("handle_check_remaining_uses")),
+        CommandHandler("purchase", user_management("show_purchase_options")),
+        CommandHandler("history", history("handle_history")),
+        CommandHandler("broadcast", broadcast("handle_broadcast"), filters=filters.User(ADMIN_USER_ID)),
+
+        MessageHandler(filters.Regex('^Evaluate$'), user_management("handle_message")),
+        MessageHandler(filters.Regex('^Feedback$'), user_management("handle_message")),
+        MessageHandler(filters.Regex('^Check Remaining Uses$'), user_management("handle_check_remaining_uses")),
+        MessageHandler(filters.Regex('^Purchase More Uses$'), user_management("handle_message")),
+        MessageHandler(filters.Regex('^History$'), history("handle_history")),
+        MessageHandler(filters.CONTACT, user_management("handle_contact")),
+        MessageHandler(filters.CONTACT, start("handle_contact_shared")),
+        MessageHandler(filters.TEXT & ~filters.COMMAND, user_management("handle_message")),
+        CallbackQueryHandler(user_management("handle_purchase_callback"), pattern="^purchase_"),
+        CallbackQueryHandler(history("handle_history_callback"), pattern="^(history|view)_"),
+    ]
+
+def register_handlers(application: Application) -> None:
+    """Add every handler to the application."""
+    # Group -1 runs first; a repeated delivery stops there
+    application.add_handler(TypeHandler(Update, update_dedup.drop_duplicate_updates), group=-1)
+    application.add_handlers(build_handlers())
@@ -1,13 +1,11 @@
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from utils import user_management
+from utils import user_cache, user_management
 
 async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /start command."""
     user = update.effective_user
-    user_management.add_user(user.id)
-    
-    if user_management.get_user(user.id).phone_number:
+    if (await user_cache.get_or_add_user(user.id)).phone_number:
         # User already has a phone number, show main menu
         await user_management.show_main_menu(update, context)
     else:
@@ -39,7 +37,7 @@ async def handle_contact_shared(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = update.effective_user.id
     
     if contact and contact.user_id == user_id:
-        user_management.update_phone_number(user_id, contact.phone_number)
+        await user_cache.update_phone_number(user_id, contact.phone_number)
         await update.message.reply_text(
             "Thank you for sharing your contact information! You're all set to use EssayBot."
         )
@@ -1,7 +1,10 @@
 class User:
+    # One cached record per active user, see utils/user_cache.py; slots keep each one small
+    __slots__ = ("id", "phone_number", "usage_count", "free_uses_left", "purchased_uses")
+
     def __init__(self, id, phone_number, usage_count, free_uses_left, purchased_uses):
         self.id = id
         self.phone_number = phone_number
         self.usage_count = usage_count
         self.free_uses_left = free_uses_left
-        self.purchased_uses = purchased_uses
\ No newline at end of file
+        self.purchased_uses = purchased_uses
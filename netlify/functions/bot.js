@@ -1,33 +1,65 @@
 const { spawn } = require('child_process');
 const path = require('path');
+const readline = require('readline');
+
+// One Python process per warm container: it imports the bot, builds the handler
+// table and opens the database once, then handles one update per line on stdin.
+let worker = null;
+
+function startWorker() {
+  const pythonProcess = spawn('python', [path.join(__dirname, 'bot.py'), '--serve'], {
+    env: process.env
+  });
+  const pending = [];
+
+  readline.createInterface({ input: pythonProcess.stdout }).on('line', (line) => {
+    const resolve = pending.shift();
+    if (resolve) {
+      resolve(line);
+    }
+  });
+
+  pythonProcess.stderr.on('data', (data) => {
+    console.error(`Python Error: ${data}`);
+  });
+
+  pythonProcess.on('close', (code) => {
+    console.error(`Python process exited with code ${code}`);
+    worker = null;
+    while (pending.length) {
+      pending.shift()('ERROR');
+    }
+  });
+
+  return {
+    send(body) {
+      return new Promise((resolve) => {
+        pending.push(resolve);
+        // Updates are single-line JSON, one per request
+        pythonProcess.stdin.write(JSON.stringify(JSON.parse(body)) + '\n');
+      });
+    }
+  };
+}
 
 exports.handler = async (event) => {
   if (event.httpMethod !== 'POST') {
     return { statusCode: 200, body: 'Send POST request to use the bot.' };
   }
 
-  return new Promise((resolve, reject) => {
-    const pythonProcess = spawn('python', [path.join(__dirname, 'bot.py')], {
-      env: { ...process.env, TELEGRAM_UPDATE: event.body }
-    });
-
-    let result = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      console.error(`Python Error: ${data}`);
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        console.error(`Python process exited with code ${code}`);
-        resolve({ statusCode: 500, body: 'Error processing update' });
-      } else {
-        resolve({ statusCode: 200, body: result || 'OK' });
-      }
-    });
-  });
-};
\ No newline at end of file
+  // Set as secret_token on setWebhook; Telegram sends it with every update
+  const secret = process.env.WEBHOOK_SECRET_TOKEN;
+  if (secret && event.headers['x-telegram-bot-api-secret-token'] !== secret) {
+    return { statusCode: 403, body: 'Forbidden' };
+  }
+
+  if (!worker) {
+    worker = startWorker();
+  }
+
+  const result = await worker.send(event.body);
+  if (result !== 'OK') {
+    return { statusCode: 500, body: 'Error processing update' };
+  }
+  return { statusCode: 200, body: result };
+};
@@ -1,46 +1,125 @@
+"""Serverless entry point for Telegram webhook updates.
+
+Built for fast starts: heavy modules are imported only when an update needs them,
+the Application and its handler table are built once per process, schema
+migrations are skipped when PRAGMA user_version is current, and every update runs
+on the same event loop. Run with ``--serve`` to keep one process alive across
+invocations of a warm container, reading one update per line on stdin.
+Conversation state is written to SQLite before each reply, so the next update
+may be handled by another container. Run with ``--broadcast`` to send a running
+broadcast for a while instead, as the scheduled broadcast function does.
+"""
+import asyncio
 import json
 import os
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from telegram.ext.filters import Regex
-from config import TELEGRAM_BOT_TOKEN
-from handlers import start, evaluate, feedback
-from utils import user_management
-from database import migrate_database
+import sys
+import time
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+# Built once per process and reused by every update it handles
+_application = None
+_loop = None
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+def get_application():
+    """Build and initialize the Application on first use."""
+    global _application
+    if _application is None:
+        from telegram.ext import Application
+        from config import TELEGRAM_BOT_TOKEN, TELEGRAM_API_BASE_URL
+        from database import migrate_database
+        from handlers.registry import register_handlers
+        from utils.outbound_scheduler import OutboundScheduler
+        from utils.sqlite_persistence import SQLitePersistence
+
+        # Run database migration (a single PRAGMA read when already up to date)
+        migrate_database()
+
+        builder = (Application.builder().token(TELEGRAM_BOT_TOKEN).persistence(SQLitePersistence())
+                   .rate_limiter(OutboundScheduler()))
+        if TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+        application = builder.build()
+        register_handlers(application)
+        get_loop().run_until_complete(application.initialize())
+        _application = application
+    return _application
+
+async def process(application, update_json):
+    """Process one update, then finish any evaluations it queued and a due feedback digest before replying."""
+    from telegram import Update
+    import database
+    from config import FEEDBACK_DIGEST_INTERVAL
+
+    update = Update.de_json(json.loads(update_json), application.bot)
+    await application.process_update(update)
+    # The container may be frozen once we reply, so write conversation state now
+    await application.update_persistence()
+    await application.persistence.flush()
+
+    pending, running, _ = await database.run(database.get_evaluation_queue_stats)
+    # Running jobs may be ones an earlier invocation was cut off in
+    if pending or running:
+        from utils.evaluation_queue import evaluation_queue
+        await evaluation_queue.drain(application.bot)
+
+    if FEEDBACK_DIGEST_INTERVAL:
+        from utils.feedback_digest import feedback_digest
+        await feedback_digest.flush_if_due(application.bot)
+
+async def send_broadcast(application):
+    """Send a running broadcast chunk by chunk until it is done or the invocation's budget is spent."""
+    from config import BROADCAST_INVOCATION_BUDGET, BROADCAST_INVOCATION_CHUNK_SIZE
+    from utils.broadcast import broadcaster
+
+    deadline = time.monotonic() + BROADCAST_INVOCATION_BUDGET
+    while time.monotonic() < deadline and await broadcaster.run_chunk(application.bot, BROADCAST_INVOCATION_CHUNK_SIZE):
+        pass
+
+def handle_update(update_json):
+    """Handle one Telegram webhook update given as a JSON string."""
+    get_loop().run_until_complete(process(get_application(), update_json))
+
+def serve():
+    """Handle one update per stdin line until stdin closes, answering each with a line."""
+    # stdout carries the answers, so anything else printed goes to stderr
+    answers, sys.stdout = sys.stdout, sys.stderr
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            handle_update(line)
+            answers.write("OK\n")
+        except Exception as e:
+            print(f"Error processing update: {e!r}", file=sys.stderr, flush=True)
+            answers.write("ERROR\n")
+        answers.flush()
 
 def main():
     """Handle Telegram webhook."""
-    # Run database migration
-    migrate_database()
-
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-
-    # Add handlers
-    application.add_handler(CommandHandler("start", start.handle_start))
-    application.add_handler(CommandHandler("evaluate", evaluate.handle_evaluate))
-    application.add_handler(CommandHandler("feedback", feedback.handle_feedback))
-    application.add_handler(CommandHandler("check_uses", user_management.handle_check_remaining_uses))
-    application.add_handler(CommandHandler("purchase", user_management.show_purchase_options))
-    application.add_handler(CommandHandler("verify_payment", user_management.verify_payment))
-
-    application.add_handler(MessageHandler(Regex('^Evaluate$'), user_management.handle_message))
-    application.add_handler(MessageHandler(Regex('^Feedback$'), user_management.handle_message))
-    application.add_handler(MessageHandler(Regex('^Check Remaining Uses$'), user_management.handle_check_remaining_uses))
-    application.add_handler(MessageHandler(Regex('^Purchase More Uses$'), user_management.handle_message))
-    application.add_handler(MessageHandler(Regex('^Verify Payment$'), user_management.verify_payment))
-    application.add_handler(MessageHandler(filters.CONTACT, user_management.handle_contact))
-    application.add_handler(MessageHandler(filters.CONTACT, start.handle_contact_shared))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, user_management.handle_message))
-    application.add_handler(CallbackQueryHandler(user_management.handle_purchase_callback))
+    if "--serve" in sys.argv:
+        serve()
+        return
+    if "--broadcast" in sys.argv:
+        get_loop().run_until_complete(send_broadcast(get_application()))
+        print("OK")
+        return
 
     # Process the update
     update_json = os.environ.get('TELEGRAM_UPDATE')
     if update_json:
-        update = Update.de_json(json.loads(update_json), application.bot)
-        application.process_update(update)
+        handle_update(update_json)
         print("OK")
     else:
         print("No update received")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,23 @@
+const { spawn } = require('child_process');
+const path = require('path');
+
+// Scheduled in netlify.toml: sends a running broadcast for a while, so user updates
+// never wait on bulk sends and a broadcast advances without traffic.
+exports.handler = async () => {
+  const code = await new Promise((resolve) => {
+    const pythonProcess = spawn('python', [path.join(__dirname, 'bot.py'), '--broadcast'], {
+      env: process.env
+    });
+
+    pythonProcess.stderr.on('data', (data) => {
+      console.error(`Python Error: ${data}`);
+    });
+
+    pythonProcess.on('close', resolve);
+  });
+
+  if (code !== 0) {
+    return { statusCode: 500, body: 'Error sending broadcast' };
+  }
+  return { statusCode: 200, body: 'OK' };
+};
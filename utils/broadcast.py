@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from telegram import Bot
+from telegram.error import Forbidden, TelegramError
+import database
+from config import ADMIN_USER_ID, BROADCAST_CHUNK_SIZE, BROADCAST_CONCURRENCY
+from utils import metrics
+from utils.outbound_scheduler import BULK, NOTICE, rate_limit_args
+
+logger = logging.getLogger(__name__)
+
+messages = metrics.Counter("essaybot_broadcast_messages_total", "Broadcast messages by outcome.", ("outcome",))
+
+class Broadcaster:
+    """Sends a message to every user, reading user ids from SQLite one chunk at a time.
+
+    Only one chunk of ids is in memory, and at most ``concurrency`` messages are in
+    flight; the outbound scheduler paces them behind replies to users. Progress is
+    checkpointed in the broadcasts table after every chunk, so a broadcast cut short
+    by a restart resumes after the last finished chunk, and at most that chunk's
+    users get the message twice.
+
+    One-shot processes never start(); the scheduled serverless function calls
+    run_chunk() instead.
+    """
+
+    def __init__(self, chunk_size: int = BROADCAST_CHUNK_SIZE, concurrency: int = BROADCAST_CONCURRENCY):
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.admin_chat_id = ADMIN_USER_ID
+        self._started = False
+        self._task = None
+
+    async def start(self, bot: Bot) -> None:
+        """Resume a broadcast left running by a previous process, and run later ones in this process."""
+        self._started = True
+        running = await database.run(database.get_running_broadcast)
+        if running is not None:
+            broadcast_id, text, last_user_id, sent, failed, blocked = running
+            logger.info("Resuming broadcast %s after user %s", broadcast_id, last_user_id)
+            counts = {"sent": sent, "failed": failed, "blocked": blocked}
+            self._task = asyncio.create_task(self._run(bot, broadcast_id, text, last_user_id, counts))
+
+    async def stop(self) -> None:
+        """Stop sending. A running broadcast resumes on the next start()."""
+        self._started = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def begin(self, bot: Bot, text: str):
+        """Start broadcasting ``text`` to every user. Returns the broadcast's id, or None if one is running."""
+        broadcast_id = await database.run(database.create_broadcast, text)
+        if broadcast_id is not None and self._started:
+            counts = {"sent": 0, "failed": 0, "blocked": 0}
+            self._task = asyncio.create_task(self._run(bot, broadcast_id, text, 0, counts))
+        return broadcast_id
+
+    async def _run(self, bot: Bot, broadcast_id: int, text: str, last_user_id: int, counts: dict) -> None:
+        started = time.monotonic()
+        slots = asyncio.Semaphore(self.concurrency)
+        try:
+            while True:
+                user_ids = await database.run(database.get_user_ids_after, last_user_id, self.chunk_size)
+                if not user_ids:
+                    break
+                await self._send_chunk(bot, slots, user_ids, text, counts)
+                last_user_id = user_ids[-1]
+                if not await database.run(database.checkpoint_broadcast, broadcast_id, last_user_id,
+                                          counts["sent"], counts["failed"], counts["blocked"]):
+                    logger.info("Broadcast %s was cancelled after user %s", broadcast_id, last_user_id)
+                    return
+            if not await database.run(database.finish_broadcast, broadcast_id):
+                return
+        except Exception:
+            logger.exception("Broadcast %s stopped after user %s", broadcast_id, last_user_id)
+            await database.run(database.finish_broadcast, broadcast_id, 'failed')
+            await self._notify(bot, f"Broadcast #{broadcast_id} stopped with an error after user {last_user_id}.", counts)
+            return
+        logger.info("Broadcast %s finished in %.0fs: %s", broadcast_id, time.monotonic() - started, counts)
+        await self._notify(bot, f"Broadcast #{broadcast_id} finished.", counts)
+
+    async def run_chunk(self, bot: Bot, chunk_size: int) -> bool:
+        """Send the next ``chunk_size`` users the running broadcast, for one-shot processes.
+
+        The chunk is claimed by moving the checkpoint before it is sent, so concurrent
+        invocations never send the same chunk twice; users of a chunk cut off when the
+        process is frozen do not get the message. Returns False once no broadcast is
+        left to send.
+        """
+        running = await database.run(database.get_running_broadcast)
+        if running is None:
+            return False
+        broadcast_id, text, last_user_id, _, _, _ = running
+        user_ids = await database.run(database.get_user_ids_after, last_user_id, chunk_size)
+        if not user_ids:
+            if await database.run(database.finish_broadcast, broadcast_id):
+                _, _, _, _, sent, failed, blocked = await database.run(database.get_latest_broadcast)
+                logger.info("Broadcast %s finished", broadcast_id)
+                await self._notify(bot, f"Broadcast #{broadcast_id} finished.",
+                                   {"sent": sent, "failed": failed, "blocked": blocked})
+            return False
+        # Another invocation took this chunk; the next one may be ours
+        if not await database.run(database.claim_broadcast_chunk, broadcast_id, last_user_id, user_ids[-1]):
+            return True
+        counts = {"sent": 0, "failed": 0, "blocked": 0}
+        await self._send_chunk(bot, asyncio.Semaphore(self.concurrency), user_ids, text, counts)
+        await database.run(database.add_broadcast_counts, broadcast_id, counts["sent"], counts["failed"], counts["blocked"])
+        return True
+
+    async def cancel(self):
+        """Cancel the running broadcast, in this process or another. Returns its id, or None if none is running."""
+        running = await database.run(database.get_running_broadcast)
+        if running is None:
+            return None
+        await database.run(database.finish_broadcast, running[0], 'cancelled')
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        return running[0]
+
+    async def _send_chunk(self, bot: Bot, slots: asyncio.Semaphore, user_ids: list, text: str, counts: dict) -> None:
+        for outcome in await asyncio.gather(*(self._send(bot, slots, user_id, text) for user_id in user_ids)):
+            counts[outcome] += 1
+
+    async def _send(self, bot: Bot, slots: asyncio.Semaphore, user_id: int, text: str) -> str:
+        async with slots:
+            try:
+                await bot.send_message(user_id, text, **rate_limit_args(bot, BULK))
+                outcome = "sent"
+            except Forbidden:
+                # The user blocked the bot or deleted their account
+                outcome = "blocked"
+            except TelegramError as e:
+                logger.debug("Broadcast to %s failed: %s", user_id, e)
+                outcome = "failed"
+        messages.inc(outcome=outcome)
+        return outcome
+
+    async def _notify(self, bot: Bot, text: str, counts: dict) -> None:
+        try:
+            await bot.send_message(self.admin_chat_id, f"{text}\n{format_counts(counts)}", **rate_limit_args(bot, NOTICE))
+        except TelegramError:
+            logger.exception("Could not report the broadcast to the admin")
+
+def format_counts(counts: dict) -> str:
+    return f"Sent: {counts['sent']}, failed: {counts['failed']}, blocked the bot: {counts['blocked']}"
+
+broadcaster = Broadcaster()
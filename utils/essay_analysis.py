@@ -1,23 +1,388 @@
-import anthropic
-from config import ANTHROPIC_API_KEY
+import asyncio
+import contextlib
+import logging
+import math
+import re
+import time
+import database
+from config import (
+    ANTHROPIC_API_KEY,
+    ANTHROPIC_BASE_URL,
+    ANTHROPIC_TIMEOUT,
+    ANTHROPIC_MAX_CONNECTIONS,
+    MAX_CONCURRENT_EVALUATIONS,
+    EVALUATION_MODE,
+    MAX_PARALLEL_REQUESTS_PER_USER,
+    LLM_MAX_ATTEMPTS,
+)
+from utils import llm_resilience, metrics, pre_analysis
 
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+logger = logging.getLogger(__name__)
 
-async def analyze_essay(topic: str, essay: str) -> str:
+MODEL = "claude-3-5-sonnet-20240620"
+MAX_TOKENS = 1024
+# Bump whenever SYSTEM_PROMPT or the message layout changes so cached evaluations are not reused
+PROMPT_VERSION = "3"
+
+# Identical for every request so the provider can cache it; anything per-essay goes in the user message
+SYSTEM_PROMPT = (
+    "You are an expert IELTS essay examiner. You give an essay detailed feedback on topics like "
+    "'Coherence and Cohesion', 'Lexical Recourse', 'Grammatical range and Accuracy', 'Task achievement'. "
+    "You give band score ranging from 1 to 9 in each area and overall. You tend to score essays 0.5 points "
+    "higher on average. At the end you give feedback on how to improve this essay also give some examples "
+    "where they could improve. You write only the above-mentioned and nothing more. If it doesn't seem to be "
+    "an essay, you say \"Sorry, there's something wrong with your essay\". If essay is less than 250 words, "
+    "you make comment about it and lower overall band score. You are given topic and essay about this topic, "
+    "and measurements of the essay you can rely on."
+)
+
+# Parallel mode: one request per criterion, merged into one report with a computed overall band
+CRITERIA = ("Task Achievement", "Coherence and Cohesion", "Lexical Resource", "Grammatical Range and Accuracy")
+CRITERION_MAX_TOKENS = 400
+# Bump whenever CRITERION_SYSTEM_PROMPT or the criterion message layout changes
+CRITERION_PROMPT_VERSION = "1"
+
+CRITERION_SYSTEM_PROMPT = (
+    "You are an expert IELTS essay examiner. You are given a topic, an essay about this topic, measurements "
+    "of the essay you can rely on, and one IELTS criterion. You assess the essay on that criterion only. "
+    "Your first line is the criterion's name, a colon and a band score from 1 to 9 in steps of 0.5; you tend "
+    "to score essays 0.5 points higher on average. Then you give detailed feedback on the criterion and how "
+    "to improve the essay on it, with examples from the essay. If essay is less than 250 words and the "
+    "criterion is Task Achievement, you make comment about it and lower the band score. You write only the "
+    "above-mentioned and nothing more."
+)
+
+ANALYSIS_FAILED_MESSAGE = "Failed to analyze the essay. Please try again later."
+
+_OVERALL_BAND = re.compile(r"overall[^0-9\n]{0,40}?(\d(?:\.\d)?)", re.IGNORECASE)
+
+# Shared across all evaluations so connections are pooled and reused
+_client = None
+
+# Caps the number of evaluations waiting on the API at the same time; a parallel
+# evaluation holds one slot for all its criterion requests
+_evaluation_slots = asyncio.Semaphore(MAX_CONCURRENT_EVALUATIONS)
+
+# user_id -> [semaphore, requests holding or waiting for it], for parallel mode
+_user_slots = {}
+
+def get_client() -> "anthropic.AsyncAnthropic":
+    """Return the shared async Anthropic client, creating it on first use."""
+    global _client
+    if _client is None:
+        # Imported here: the SDK takes most of a second to import, which every cold
+        # start of the serverless function would otherwise pay even without an essay
+        import anthropic
+        import httpx
+
+        http_client = anthropic.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=ANTHROPIC_MAX_CONNECTIONS,
+                max_keepalive_connections=ANTHROPIC_MAX_CONNECTIONS,
+            )
+        )
+        _client = anthropic.AsyncAnthropic(
+            api_key=ANTHROPIC_API_KEY,
+            base_url=ANTHROPIC_BASE_URL,
+            timeout=ANTHROPIC_TIMEOUT,
+            # Retries are ours, see utils/llm_resilience.py
+            max_retries=0,
+            http_client=http_client,
+        )
+    return _client
+
+async def close_client() -> None:
+    """Close the shared client and its connection pool."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+def extract_overall_band(report: str):
+    """Return the overall band score stated in a report, or None if there is none."""
+    match = _OVERALL_BAND.search(report or "")
+    return float(match.group(1)) if match else None
+
+def overall_band(bands) -> float:
+    """The IELTS overall band: the mean of the criteria, rounded to the nearest half band (.25 and .75 round up)."""
+    return math.floor(sum(bands) / len(bands) * 2 + 0.5) / 2
+
+def report_version() -> str:
+    """Identifies the prompts and layout behind a report, so cached evaluations of another mode are not reused."""
+    return f"criteria-{CRITERION_PROMPT_VERSION}" if EVALUATION_MODE == "parallel" else PROMPT_VERSION
+
+def _build_system(prompt: str = SYSTEM_PROMPT) -> list:
+    return [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+
+def _build_messages(topic: str, essay: str, criterion: str = None) -> list:
+    context = pre_analysis.to_prompt_context(pre_analysis.analyze_text(essay))
+    content = f"Topic: {topic}\n\nEssay:\n{essay}\n\nMeasurements:\n{context}"
+    if criterion is not None:
+        content += f"\n\nCriterion: {criterion}"
+    return [{"role": "user", "content": content}]
+
+def _estimate_tokens(messages: list, system: str = SYSTEM_PROMPT, max_tokens: int = MAX_TOKENS) -> int:
+    """Tokens to reserve for a request: roughly 4 characters per input token, plus the output limit."""
+    return (len(system) + len(messages[0]["content"])) // 4 + max_tokens
+
+async def _record_usage(mode: str, usage, started: float, prompt_version: str = PROMPT_VERSION,
+                        user_id: int = None, job_id: int = None) -> None:
+    """Store the token counts and latency of one request, with the user and queued job it was made for."""
+    cache_creation = getattr(usage, "cache_creation_input_tokens", None) or 0
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    metrics.llm_request_duration.observe(time.monotonic() - started, mode=mode)
+    metrics.llm_tokens.inc(usage.input_tokens, kind="input")
+    metrics.llm_tokens.inc(cache_creation, kind="cache_creation")
+    metrics.llm_tokens.inc(cache_read, kind="cache_read")
+    metrics.llm_tokens.inc(usage.output_tokens, kind="output")
+    try:
+        await database.run(
+            database.record_evaluation_usage,
+            MODEL,
+            prompt_version,
+            mode,
+            usage.input_tokens,
+            cache_creation,
+            cache_read,
+            usage.output_tokens,
+            (time.monotonic() - started) * 1000,
+            user_id,
+            job_id,
+        )
+    except Exception:
+        logger.exception("Could not record evaluation usage")
+
+async def analyze_essay(topic: str, essay: str, timeout: float = None, user_id: int = None, job_id: int = None) -> str:
     """Analyze the essay using the Anthropic API."""
-    prompt = f"\n\nHuman: You are an expert IELTS essay examiner. You give an essay detailed feedback on topics like 'Coherence and Cohesion', 'Lexical Recourse', 'Grammatical range and Accuracy', 'Task achievement'. You give band score ranging from 1 to 9 in each area and overall. You tend to score essays 0.5 points higher on average. At the end you give feedback on how to improve this essay also give some examples where they could improve. You write only the above-mentioned and nothing more. If it doesn't seem to be an essay, you say \"Sorry, there's something wrong with your essay\". If essay is less than 250 words, you make comment about it and lower overall band score. You are given topic and essay about this topic.\n\nTopic: {topic}\nEssay: {essay}\n\nAssistant:"
+    messages = _build_messages(topic, essay)
+    started = None
 
-    messages = [
-        {"role": "user", "content": prompt}
-    ]
+    async def request():
+        nonlocal started
+        async with _evaluation_slots:
+            started = time.monotonic()
+            try:
+                return await get_client().messages.create(
+                    model=MODEL,
+                    max_tokens=MAX_TOKENS,
+                    system=_build_system(),
+                    messages=messages,
+                    timeout=timeout or ANTHROPIC_TIMEOUT,
+                )
+            except Exception as e:
+                metrics.llm_errors.inc(mode="single", error=type(e).__name__)
+                raise
 
-    response = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=1024,
-        messages=messages,
-    )
+    response = await llm_resilience.call(request, _estimate_tokens(messages))
+    await _record_usage("single", response.usage, started, user_id=user_id, job_id=job_id)
 
     if response and response.content:
         return response.content[0].text
     else:
-        return "Failed to analyze the essay. Please try again later."
\ No newline at end of file
+        return ANALYSIS_FAILED_MESSAGE
+
+async def stream_essay_analysis(topic: str, essay: str, timeout: float = None, user_id: int = None,
+                                job_id: int = None):
+    """Analyze the essay like analyze_essay(), yielding the text as the model generates it.
+
+    Failed attempts are retried like analyze_essay() does, but only until the first
+    text has been yielded.
+    """
+    # Closed with this generator, so an abandoned stream is recorded straight away
+    async with contextlib.aclosing(_stream(_build_messages(topic, essay), SYSTEM_PROMPT, MAX_TOKENS, "stream",
+                                           PROMPT_VERSION, timeout, _evaluation_slots, user_id, job_id)) as stream:
+        async for text in stream:
+            yield text
+
+def _partial_usage(message):
+    """Usage of a stream that ended early; the output count only arrives at the end, so it is estimated."""
+    written = sum(len(getattr(block, "text", "")) for block in message.content) // 4
+    return message.usage.model_copy(update={"output_tokens": max(message.usage.output_tokens, written)})
+
+async def _stream(messages: list, system: str, max_tokens: int, mode: str, prompt_version: str,
+                  timeout: float, slot, user_id: int = None, job_id: int = None):
+    """Stream one request, holding ``slot`` while it runs.
+
+    A stream that fails or is abandoned after its first text is still billed, so
+    its usage so far is recorded under ``<mode>_partial``.
+    """
+    reserved = _estimate_tokens(messages, system, max_tokens)
+    attempt = 0
+    while True:
+        attempt += 1
+        await llm_resilience.acquire(reserved)
+        yielded = False
+        partial = message = None
+        try:
+            async with slot:
+                started = time.monotonic()
+                async with get_client().messages.stream(
+                    model=MODEL,
+                    max_tokens=max_tokens,
+                    system=_build_system(system),
+                    messages=messages,
+                    timeout=timeout or ANTHROPIC_TIMEOUT,
+                ) as stream:
+                    async for text in stream.text_stream:
+                        if not yielded:
+                            metrics.llm_first_token.observe(time.monotonic() - started)
+                            # Updated in place as the rest of the stream arrives
+                            partial = stream.current_message_snapshot
+                        yielded = True
+                        yield text
+                    message = await stream.get_final_message()
+        except Exception as e:
+            metrics.llm_errors.inc(mode=mode, error=type(e).__name__)
+            if not llm_resilience.record_failure(e, reserved) or yielded or attempt >= LLM_MAX_ATTEMPTS:
+                raise
+            delay = llm_resilience.backoff(attempt, e)
+            logger.warning("Streaming evaluation failed (%r), retrying in %.1fs", e, delay)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled, or the caller stopped reading (GeneratorExit): a trial call must not keep the circuit blocked
+            llm_resilience.record_cancelled(reserved, None if partial is None else _partial_usage(partial))
+            raise
+        finally:
+            if message is None and partial is not None:
+                await _record_usage(f"{mode}_partial", _partial_usage(partial), started, prompt_version,
+                                    user_id, job_id)
+        llm_resilience.record_success(reserved, message.usage)
+        break
+    await _record_usage(mode, message.usage, started, prompt_version, user_id, job_id)
+
+@contextlib.asynccontextmanager
+async def _user_slot(user_id):
+    """Hold one of the user's MAX_PARALLEL_REQUESTS_PER_USER request slots; no limit without a user."""
+    if user_id is None:
+        yield
+        return
+    entry = _user_slots.get(user_id)
+    if entry is None:
+        entry = _user_slots[user_id] = [asyncio.Semaphore(MAX_PARALLEL_REQUESTS_PER_USER), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _user_slots[user_id]
+
+async def analyze_criterion(topic: str, essay: str, criterion: str, timeout: float = None, user_id: int = None,
+                            job_id: int = None) -> str:
+    """Assess the essay on one IELTS criterion; the text starts with the criterion's band.
+
+    Takes no evaluation slot: the evaluation it is part of holds one.
+    """
+    messages = _build_messages(topic, essay, criterion)
+    started = None
+
+    async def request():
+        nonlocal started
+        started = time.monotonic()
+        try:
+            return await get_client().messages.create(
+                model=MODEL,
+                max_tokens=CRITERION_MAX_TOKENS,
+                system=_build_system(CRITERION_SYSTEM_PROMPT),
+                messages=messages,
+                timeout=timeout or ANTHROPIC_TIMEOUT,
+            )
+        except Exception as e:
+            metrics.llm_errors.inc(mode="criterion", error=type(e).__name__)
+            raise
+
+    async with _user_slot(user_id):
+        response = await llm_resilience.call(
+            request, _estimate_tokens(messages, CRITERION_SYSTEM_PROMPT, CRITERION_MAX_TOKENS))
+    await _record_usage("criterion", response.usage, started, CRITERION_PROMPT_VERSION, user_id, job_id)
+    return response.content[0].text.strip() if response.content else ""
+
+async def _stream_criterion(topic: str, essay: str, criterion: str, timeout: float = None, user_id: int = None,
+                            job_id: int = None):
+    """Like analyze_criterion(), yielding the text as the model generates it."""
+    async with _user_slot(user_id), contextlib.aclosing(
+            _stream(_build_messages(topic, essay, criterion), CRITERION_SYSTEM_PROMPT, CRITERION_MAX_TOKENS,
+                    "criterion_stream", CRITERION_PROMPT_VERSION, timeout, contextlib.nullcontext(),
+                    user_id, job_id)) as stream:
+        async for text in stream:
+            yield text
+
+def criterion_band(criterion: str, text: str):
+    """The band a criterion's assessment gives, or None if it states none."""
+    match = re.search(re.escape(criterion) + r"[^0-9\n]{0,20}?(\d(?:\.\d)?)", text, re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+def _overall_line(sections: list) -> str:
+    bands = [criterion_band(criterion, text) for criterion, text in zip(CRITERIA, sections)]
+    if None in bands:
+        logger.warning("A criterion assessment has no band score, cannot compute the overall band")
+        return None
+    return f"Overall: {overall_band(bands):.1f}"
+
+async def analyze_essay_parallel(topic: str, essay: str, timeout: float = None, user_id: int = None,
+                                 job_id: int = None) -> str:
+    """Analyze the essay with one concurrent request per criterion and merge them into one report.
+
+    Each request writes a fraction of the report, so the whole takes about as long
+    as the slowest criterion rather than all of them in sequence.
+    """
+    async with _evaluation_slots:
+        tasks = [asyncio.ensure_future(analyze_criterion(topic, essay, criterion, timeout, user_id, job_id))
+                 for criterion in CRITERIA]
+        try:
+            sections = await asyncio.gather(*tasks)
+        except BaseException:
+            # gather() leaves the other requests running; stop them before the slot is released
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    overall = _overall_line(sections)
+    if overall is None:
+        return ANALYSIS_FAILED_MESSAGE
+    return "\n\n".join([*sections, overall])
+
+async def stream_essay_analysis_parallel(topic: str, essay: str, timeout: float = None, user_id: int = None,
+                                         job_id: int = None):
+    """Like analyze_essay_parallel(), yielding the report in order as it becomes ready.
+
+    The first criterion is streamed as the model writes it while the others run
+    alongside, so the first text arrives as soon as in single mode.
+    """
+    async with _evaluation_slots:
+        rest = [asyncio.ensure_future(analyze_criterion(topic, essay, criterion, timeout, user_id, job_id))
+                for criterion in CRITERIA[1:]]
+        try:
+            first = ""
+            async with contextlib.aclosing(_stream_criterion(topic, essay, CRITERIA[0], timeout, user_id,
+                                                             job_id)) as stream:
+                async for text in stream:
+                    first += text
+                    yield text
+            sections = [first.strip()]
+            yield "\n\n"
+            for task in rest:
+                sections.append(await task)
+                yield sections[-1] + "\n\n"
+            overall = _overall_line(sections)
+            if overall is None:
+                raise ValueError("criterion assessment without a band score")
+            yield overall
+        finally:
+            for task in rest:
+                task.cancel()
+            await asyncio.gather(*rest, return_exceptions=True)
+
+def evaluate(topic: str, essay: str, user_id: int = None, job_id: int = None):
+    """Analyze the essay the way EVALUATION_MODE says; returns a coroutine."""
+    if EVALUATION_MODE == "parallel":
+        return analyze_essay_parallel(topic, essay, user_id=user_id, job_id=job_id)
+    return analyze_essay(topic, essay, user_id=user_id, job_id=job_id)
+
+def stream_evaluation(topic: str, essay: str, user_id: int = None, job_id: int = None):
+    """Stream the analysis the way EVALUATION_MODE says; returns an async generator."""
+    if EVALUATION_MODE == "parallel":
+        return stream_essay_analysis_parallel(topic, essay, user_id=user_id, job_id=job_id)
+    return stream_essay_analysis(topic, essay, user_id=user_id, job_id=job_id)
@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import time
+import unicodedata
+import database
+from config import EVALUATION_CACHE_TTL, EVALUATION_CACHE_MAX_ENTRIES
+from utils import essay_analysis, metrics, near_duplicate
+
+# Evaluations currently being computed, keyed like the cache
+_in_flight = {}
+
+_stats = {"hits": 0, "misses": 0, "shared": 0, "near_duplicates": 0}
+
+metrics.Counter("essaybot_evaluation_cache_lookups_total",
+                "Evaluation cache lookups by result; shared joined an identical call in flight, near_duplicates "
+                "reused the evaluation of a near copy.",
+                ("result",), function=lambda: dict(_stats))
+
+def _normalize(text: str) -> str:
+    """Normalize Unicode and whitespace so trivially different resends hash the same."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+def cache_key(topic: str, essay: str) -> str:
+    """Content address of an evaluation: normalized inputs plus prompt version and model."""
+    parts = (essay_analysis.report_version(), essay_analysis.MODEL, _normalize(topic), _normalize(essay))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+async def _analyze_and_store(key: str, topic: str, essay: str, analyze) -> str:
+    result = await analyze(topic, essay)
+    if result != essay_analysis.ANALYSIS_FAILED_MESSAGE:
+        await database.run(database.store_cached_evaluation, key, result,
+                           time.time() - EVALUATION_CACHE_TTL, EVALUATION_CACHE_MAX_ENTRIES)
+    return result
+
+async def get_or_analyze(topic: str, essay: str, analyze=None, user_id: int = None) -> str:
+    """Return a cached evaluation, the evaluation of a near copy, join an identical one in flight, or analyze the essay.
+
+    ``analyze`` replaces essay_analysis.evaluate for the call made on a miss,
+    e.g. to stream the result to the user while it is generated. Evaluations of near
+    copies are only reused for the ``user_id`` who submitted them.
+    """
+    key = cache_key(topic, essay)
+
+    cached = await database.run(database.get_cached_evaluation, key, time.time() - EVALUATION_CACHE_TTL)
+    if cached is not None:
+        _stats["hits"] += 1
+        return cached
+
+    reused = await near_duplicate.reuse(user_id, topic, essay) if user_id is not None else None
+    if reused is not None:
+        _stats["near_duplicates"] += 1
+        return reused
+
+    task = _in_flight.get(key)
+    if task is not None:
+        _stats["shared"] += 1
+    else:
+        _stats["misses"] += 1
+        task = asyncio.ensure_future(_analyze_and_store(key, topic, essay, analyze or essay_analysis.evaluate))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # Shielded so one caller going away does not cancel the call for everyone else
+    return await asyncio.shield(task)
+
+def stats() -> dict:
+    """Cache counters; ``shared`` counts submissions that joined an identical call in flight."""
+    saved = _stats["hits"] + _stats["shared"] + _stats["near_duplicates"]
+    lookups = saved + _stats["misses"]
+    return dict(_stats, in_flight=len(_in_flight), hit_rate=saved / lookups if lookups else 0.0)
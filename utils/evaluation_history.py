@@ -0,0 +1,32 @@
+"""Every delivered evaluation, kept so users can read a report again without another model call."""
+import hashlib
+import json
+import logging
+import database
+from utils import essay_analysis
+
+logger = logging.getLogger(__name__)
+
+def topic_hash(topic: str) -> str:
+    """Hash of a topic ignoring case and whitespace, so a retyped topic is recognized."""
+    return hashlib.sha256(" ".join((topic or "").casefold().split()).encode("utf-8")).hexdigest()
+
+def report_bands(report: str) -> tuple:
+    """Return (overall band, JSON of the criteria bands found) stated in a report."""
+    bands = {criterion: essay_analysis.criterion_band(criterion, report) for criterion in essay_analysis.CRITERIA}
+    found = {criterion: band for criterion, band in bands.items() if band is not None}
+    return essay_analysis.extract_overall_band(report), json.dumps(found) if found else None
+
+async def record(user_id: int, topic: str, report: str):
+    """Add a report to the user's history. Returns its id, or None if it could not be stored."""
+    overall, criteria = report_bands(report)
+    try:
+        return await database.run(database.record_evaluation, user_id, topic_hash(topic), topic, overall, criteria, report)
+    except Exception:
+        # The user still gets the result; only the history entry is missing
+        logger.exception("Could not store the evaluation of user %s in the history", user_id)
+        return None
+
+async def latest_for_topic(user_id: int, topic: str):
+    """The id of the user's latest evaluation on this topic, or None."""
+    return await database.run(database.get_latest_evaluation_for_topic, user_id, topic_hash(topic))
@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import functools
+import logging
+import time
+from telegram import Bot
+import database
+from config import (EVALUATION_WORKERS, EVALUATION_QUEUE_MAX_DEPTH, EVALUATION_QUEUE_POLL_INTERVAL, EVALUATION_JOB_LEASE,
+                    EVALUATION_DRAIN_BUDGET, STREAM_EVALUATIONS)
+from utils import essay_analysis, evaluation_cache, evaluation_history, llm_resilience, metrics, near_duplicate, user_cache
+from utils.streaming_reply import StreamingReply, send_text
+
+logger = logging.getLogger(__name__)
+
+DEFERRED_MESSAGE = ("Our evaluation service is busy right now. Your essay stays in the queue "
+                    "and you'll get the result here as soon as it's evaluated.")
+
+metrics_wait = metrics.Histogram("essaybot_evaluation_queue_wait_seconds", "Time a job waited in the queue.")
+metrics_first_output = metrics.Histogram("essaybot_evaluation_first_output_seconds",
+                                         "Time from submission to the first evaluation text the user sees.")
+
+class EvaluationInProgress(Exception):
+    """Raised by submit() when the user already has an evaluation pending or running."""
+
+class EvaluationQueue:
+    """Evaluation jobs persisted in SQLite and processed by a bounded pool of workers.
+
+    Handlers submit() a job after taking a use; workers claim jobs oldest first, run
+    the analysis and send the result to the chat. Jobs survive restarts: anything
+    still pending is picked up on start(), and a job left running by a process that
+    died is taken over once it has been running for EVALUATION_JOB_LEASE.
+    """
+
+    def __init__(self, workers: int = EVALUATION_WORKERS, max_depth: int = EVALUATION_QUEUE_MAX_DEPTH):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.bot = None
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._processed = 0
+        self._failed = 0
+        self._deferred = 0
+        self._wait_times = collections.deque(maxlen=1000)
+        # Submission to the first evaluation text the user can see
+        self._first_output_times = collections.deque(maxlen=1000)
+
+    async def start(self, bot: Bot) -> None:
+        """Recover interrupted jobs and start the workers."""
+        self.bot = bot
+        await self._requeue_expired()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._wakeup.set()
+
+    async def stop(self) -> None:
+        """Stop the workers. Jobs they were running go back in the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, user_id: int, chat_id: int, topic: str, essay: str, bucket: str):
+        """Queue an evaluation and return its position, or None if the queue is full.
+
+        Raises EvaluationInProgress if the user's previous essay is still queued or
+        being evaluated, so a repeated submission is not charged or evaluated twice.
+        """
+        status, _, position = await database.run(database.enqueue_evaluation_job, user_id, chat_id, topic, essay,
+                                                  bucket, self.max_depth)
+        if status == 'in_progress':
+            raise EvaluationInProgress(user_id)
+        if status == 'full':
+            return None
+        self._wakeup.set()
+        return position
+
+    async def drain(self, bot: Bot, budget: float = EVALUATION_DRAIN_BUDGET) -> None:
+        """Process jobs for up to ``budget`` seconds, for one-shot processes without workers.
+
+        A job still running when the budget runs out goes back in the queue for the
+        next drain, rather than staying 'running' until its lease expires.
+        """
+        self.bot = bot
+        await self._requeue_expired()
+        deadline = time.monotonic() + budget
+        # Jobs left while the provider is unavailable wait for the next drain
+        while (not llm_resilience.breaker.blocked_for and time.monotonic() < deadline
+               and await self._process_next(deadline)):
+            pass
+
+    async def _requeue_expired(self) -> None:
+        # Jobs started more recently may still be running in another process
+        recovered = await database.run(database.requeue_running_evaluation_jobs, time.time() - EVALUATION_JOB_LEASE)
+        if recovered:
+            logger.info("Requeued %s evaluation jobs running for longer than %.0fs", recovered, EVALUATION_JOB_LEASE)
+
+    async def stats(self) -> dict:
+        """Queue depth and wait times, for monitoring."""
+        pending, running, oldest = await database.run(database.get_evaluation_queue_stats)
+        waits = sorted(self._wait_times)
+        first_output = sorted(self._first_output_times)
+        return {
+            "pending": pending,
+            "running": running,
+            "oldest_pending_age": time.time() - oldest if oldest else 0.0,
+            "processed": self._processed,
+            "failed": self._failed,
+            "deferred": self._deferred,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+            "first_output_p50": first_output[len(first_output) // 2] if first_output else 0.0,
+            "first_output_max": first_output[-1] if first_output else 0.0,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            # Leave jobs queued instead of failing them while the provider is unavailable
+            blocked_for = llm_resilience.breaker.blocked_for
+            if blocked_for:
+                await asyncio.sleep(blocked_for)
+                continue
+            if not await self._process_next():
+                self._wakeup.clear()
+                # Polling as well picks up jobs submitted by other processes
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), EVALUATION_QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    await self._requeue_expired()
+
+    async def _process_next(self, deadline: float = None) -> bool:
+        job = await database.run(database.claim_evaluation_job)
+        if job is None:
+            return False
+        job_id, user_id, chat_id, topic, essay, bucket, created_at = job
+        wait = time.time() - created_at
+        self._wait_times.append(wait)
+        metrics_wait.observe(wait)
+        logger.info("Evaluation job %s started after waiting %.1fs", job_id, wait)
+
+        reply = StreamingReply(self.bot, chat_id) if STREAM_EVALUATIONS else None
+        analyze = reply.stream_analysis if reply else essay_analysis.evaluate
+        try:
+            analysis_result = await asyncio.wait_for(
+                evaluation_cache.get_or_analyze(topic, essay, user_id=user_id,
+                                                analyze=functools.partial(analyze, user_id=user_id, job_id=job_id)),
+                None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except asyncio.CancelledError:
+            # stop(): let the next worker run it
+            await database.run(database.release_evaluation_job, job_id)
+            raise
+        except (llm_resilience.CircuitOpenError, asyncio.TimeoutError) as e:
+            # The use stays taken; the job runs again once the provider recovers, or in the next drain
+            self._deferred += 1
+            logger.info("Evaluation job %s deferred %s", job_id, "while the provider is unavailable"
+                        if isinstance(e, llm_resilience.CircuitOpenError) else "at the end of the drain budget")
+            await database.run(database.release_evaluation_job, job_id)
+            if reply is not None and reply.message is not None:
+                try:
+                    await reply.finish(DEFERRED_MESSAGE)
+                except Exception:
+                    logger.exception("Could not update the message of deferred evaluation job %s", job_id)
+            return True
+        except Exception as e:
+            logger.exception("Evaluation job %s failed", job_id)
+            analysis_result = essay_analysis.ANALYSIS_FAILED_MESSAGE
+            error = repr(e)
+        else:
+            error = "empty response"
+
+        try:
+            if analysis_result == essay_analysis.ANALYSIS_FAILED_MESSAGE:
+                self._failed += 1
+                await user_cache.refund_use(user_id, bucket)
+                await database.run(database.fail_evaluation_job, job_id, error)
+                await self._deliver(chat_id, f"{analysis_result} Your use has not been charged.", reply)
+            else:
+                self._processed += 1
+                evaluation_id = await evaluation_history.record(user_id, topic, analysis_result)
+                if evaluation_id is not None:
+                    await near_duplicate.add(evaluation_id, user_id, topic, essay)
+                await database.run(database.complete_evaluation_job, job_id)
+                await self._deliver(chat_id, f"*Analysis Result:*\n\n{analysis_result}", reply, parse_mode='Markdown')
+        except Exception:
+            logger.exception("Could not deliver the result of evaluation job %s", job_id)
+
+        first_output_at = reply.first_output_at if reply and reply.first_output_at else time.time()
+        self._first_output_times.append(first_output_at - created_at)
+        metrics_first_output.observe(first_output_at - created_at)
+        return True
+
+    async def _deliver(self, chat_id: int, text: str, reply: StreamingReply = None, parse_mode: str = None) -> None:
+        # Cache hits and shared calls never streamed, so there is no message to edit
+        if reply is not None and reply.message is not None:
+            await reply.finish(text, parse_mode)
+        else:
+            await send_text(self.bot, chat_id, text, parse_mode)
+
+evaluation_queue = EvaluationQueue()
+
+def _queue_depth() -> dict:
+    # Rendered on a metrics server thread, one per scrape
+    pending, running, _ = database.run_sync(database.get_evaluation_queue_stats)
+    return {"pending": pending, "running": running}
+
+metrics.Gauge("essaybot_evaluation_queue_jobs", "Evaluation jobs by status.", ("status",), function=_queue_depth)
+metrics.Counter("essaybot_evaluation_jobs_total", "Evaluation jobs finished by this process, by outcome.", ("outcome",),
+                function=lambda: {"processed": evaluation_queue._processed, "failed": evaluation_queue._failed,
+                                  "deferred": evaluation_queue._deferred})
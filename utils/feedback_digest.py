@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+from telegram import Bot
+from telegram.error import BadRequest
+import database
+from config import ADMIN_USER_ID, FEEDBACK_DIGEST_INTERVAL
+from utils.outbound_scheduler import NOTICE, rate_limit_args
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+SEPARATOR = "\n\n— — —\n\n"
+# A process that claimed feedback this long ago and has not sent it died or was frozen mid-send
+CLAIM_TIMEOUT = 300  # seconds
+
+class FeedbackDigest:
+    """User feedback held in SQLite and sent to the admin together, every ``interval`` seconds.
+
+    Held feedback survives restarts: it is deleted only once the digest carrying it
+    has been sent, so a crash mid-send sends some of it twice rather than losing it.
+    A long-running bot sends digests from the task
+    start() creates; the serverless function calls flush_if_due() after each update.
+    """
+
+    def __init__(self, interval: float = FEEDBACK_DIGEST_INTERVAL, chat_id: int = ADMIN_USER_ID):
+        self.interval = interval
+        self.chat_id = chat_id
+        self._task = None
+
+    async def add(self, message: str) -> None:
+        """Hold an HTML feedback message for the next digest."""
+        await database.run(database.add_pending_feedback, [(time.time(), message)])
+
+    async def start(self, bot: Bot) -> None:
+        if self.interval:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        """Stop sending digests. Feedback still held goes out with the next one."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def flush_if_due(self, bot: Bot) -> None:
+        """Send a digest if the oldest held feedback has waited ``interval`` seconds."""
+        oldest = await database.run(database.get_oldest_pending_feedback)
+        if oldest is not None and time.time() - oldest >= self.interval:
+            await self.flush(bot)
+
+    async def flush(self, bot: Bot) -> int:
+        """Send all held feedback to the admin. Returns how many pieces were sent."""
+        rows = await database.run(database.claim_pending_feedback, time.time() - CLAIM_TIMEOUT)
+        sent = 0
+        try:
+            for count, text in self._chunks([message for _, message in rows]):
+                try:
+                    await bot.send_message(self.chat_id, text, parse_mode='HTML', **rate_limit_args(bot, NOTICE))
+                except BadRequest:
+                    # A piece cut to fit may have lost the end of its markup
+                    await bot.send_message(self.chat_id, text, **rate_limit_args(bot, NOTICE))
+                await database.run(database.delete_pending_feedback, [row[0] for row in rows[sent:sent + count]])
+                sent += count
+        except Exception:
+            # Hold what was not sent for the next digest
+            await database.run(database.release_pending_feedback, [row[0] for row in rows[sent:]])
+            raise
+        return sent
+
+    @staticmethod
+    def _chunks(messages: list) -> list:
+        """Pack messages into as few Telegram messages as fit, as (pieces, text) pairs."""
+        header = f"<b>Feedback digest</b>: {len(messages)} new\n\n"
+        limit = MAX_MESSAGE_LENGTH - len(header)
+        chunks = [[]]
+        length = 0
+        for message in messages:
+            message = message[:limit]
+            if chunks[-1] and length + len(SEPARATOR) + len(message) > limit:
+                chunks.append([])
+                length = 0
+            length += (len(SEPARATOR) if chunks[-1] else 0) + len(message)
+            chunks[-1].append(message)
+        return [(len(chunk), header + SEPARATOR.join(chunk)) for chunk in chunks if chunk]
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush(bot)
+            except Exception:
+                logger.exception("Could not send the feedback digest")
+
+feedback_digest = FeedbackDigest()
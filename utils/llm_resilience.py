@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import random
+import time
+from config import (
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_MAX_ATTEMPTS,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+)
+from utils import metrics
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# 429 is a rate limit, 529 means the provider is overloaded
+THROTTLE_STATUSES = (429, 529)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while it is considered unhealthy."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM provider unavailable, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Stops calling the provider after ``failure_threshold`` failures in a row.
+
+    While open every call fails fast with CircuitOpenError. After ``reset_timeout``
+    seconds a single trial call is let through: success closes the circuit, failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial_started = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.retry_after == 0 else "open"
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until calls are let through again, 0 if they are now."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    @property
+    def blocked_for(self) -> float:
+        """Like retry_after, but also covers the time a half-open circuit waits for its trial call."""
+        if self.retry_after > 0:
+            return self.retry_after
+        if self._trial_started is not None and time.monotonic() - self._trial_started < self.reset_timeout:
+            # Everyone else waits for the trial call; one that never reported back expires
+            return 1.0
+        return 0.0
+
+    def check(self) -> None:
+        """Raise CircuitOpenError if a call would not be let through."""
+        if self.opened_at is None:
+            return
+        blocked_for = self.blocked_for
+        if blocked_for:
+            raise CircuitOpenError(blocked_for)
+
+    def before_call(self) -> None:
+        """Like check(), and claims the trial call when the circuit is half open."""
+        self.check()
+        if self.opened_at is not None:
+            self._trial_started = time.monotonic()
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("LLM provider recovered, closing the circuit")
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    def abandon_trial(self) -> None:
+        """Let another call be the trial, when this one ended without telling anything about the provider."""
+        self._trial_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_started is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+            logger.warning("LLM provider failing (%s failures in a row), opening the circuit for %.0fs",
+                           self.failures, self.reset_timeout)
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+        self._trial_started = None
+
+class AdaptiveRateLimiter:
+    """Paces calls to the provider's requests-per-minute and tokens-per-minute budgets.
+
+    The request rate is halved whenever the provider throttles us and creeps back to
+    the configured budget with every successful call, so a shared or lowered quota
+    is found without configuration.
+    """
+
+    def __init__(self, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = LLM_TOKENS_PER_MINUTE, min_fraction: float = 0.1):
+        self.max_rate = requests_per_minute / 60
+        self.min_rate = self.max_rate * min_fraction
+        # Allow bursts of up to a tenth of the per-minute budget
+        self.requests = TokenBucket(self.max_rate, capacity=max(1.0, requests_per_minute / 10))
+        self.tokens = TokenBucket(tokens_per_minute / 60, capacity=max(1.0, tokens_per_minute / 10))
+
+    @property
+    def rate(self) -> float:
+        """Current request rate in requests per minute."""
+        return self.requests.rate * 60
+
+    async def acquire(self, tokens: int) -> None:
+        await self.requests.acquire()
+        await self.tokens.acquire(tokens)
+
+    def release(self, tokens: int) -> None:
+        """Give back a request and ``tokens`` taken by acquire() for a call that was not made."""
+        self.requests.release(1)
+        self.tokens.release(tokens)
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Correct the token budget once the real usage of a call is known."""
+        self.tokens.release(reserved - used)
+
+    def record_success(self) -> None:
+        self.requests.rate = min(self.max_rate, self.requests.rate + self.max_rate * 0.05)
+
+    def record_throttled(self, retry_after: float = None) -> None:
+        self.requests.rate = max(self.min_rate, self.requests.rate / 2)
+        if retry_after:
+            self.requests.pause(retry_after)
+            self.tokens.pause(retry_after)
+
+def status_code(error: Exception):
+    return getattr(error, "status_code", None)
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an error from the SDK is a transient provider problem worth retrying."""
+    # Imported here to keep the SDK off the cold-start path
+    import anthropic
+
+    if isinstance(error, anthropic.APIConnectionError):
+        # Includes timeouts
+        return True
+    status = status_code(error)
+    return status is not None and (status in (408, 409) or status in THROTTLE_STATUSES or status >= 500)
+
+def retry_after(error: Exception):
+    """The delay the provider asked for in a Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+def backoff(attempt: int, error: Exception = None) -> float:
+    """Exponential backoff with full jitter, but never shorter than the provider asked for."""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** (attempt - 1)))
+    return max(delay, (retry_after(error) if error is not None else None) or 0.0)
+
+def used_tokens(usage) -> int:
+    return (usage.input_tokens + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            + usage.output_tokens)
+
+breaker = CircuitBreaker()
+limiter = AdaptiveRateLimiter()
+
+_stats = {"calls": 0, "retries": 0, "failures": 0, "throttled": 0, "rejected": 0}
+
+_CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+metrics.Counter("essaybot_llm_resilience_events_total",
+                "Model calls let through, retried, failed, throttled, or rejected by the open circuit.",
+                ("event",), function=lambda: dict(_stats))
+metrics.Gauge("essaybot_llm_circuit_state", "Circuit breaker state: 0 closed, 1 half open, 2 open.",
+              function=lambda: _CIRCUIT_STATES[breaker.state])
+metrics.Gauge("essaybot_llm_requests_per_minute", "Request rate the adaptive limiter currently allows.",
+              function=lambda: limiter.rate)
+
+async def acquire(tokens: int) -> None:
+    """Wait for room in the rate limits, failing fast while the circuit is open."""
+    try:
+        breaker.check()
+        await limiter.acquire(tokens)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            # The circuit opened while we waited for the limiter; the call is not made
+            limiter.release(tokens)
+            raise
+    except CircuitOpenError:
+        _stats["rejected"] += 1
+        raise
+    _stats["calls"] += 1
+
+def record_success(reserved: int, usage=None) -> None:
+    breaker.record_success()
+    limiter.record_success()
+    if usage is not None:
+        limiter.settle(reserved, used_tokens(usage))
+
+def record_failure(error: Exception, reserved: int) -> bool:
+    """Account for a failed call. Returns whether it is worth retrying."""
+    # Failed calls are not billed, so the reservation goes back
+    limiter.settle(reserved, 0)
+    if not is_retryable(error):
+        if status_code(error) is not None:
+            # The provider answered; the request itself was bad
+            breaker.record_success()
+        else:
+            # A local error, e.g. in building the request: nothing learned about the provider
+            breaker.abandon_trial()
+        return False
+    _stats["failures"] += 1
+    breaker.record_failure()
+    if status_code(error) in THROTTLE_STATUSES:
+        _stats["throttled"] += 1
+        limiter.record_throttled(retry_after(error))
+    return True
+
+def record_cancelled(reserved: int, usage=None) -> None:
+    """Account for a call cancelled before it finished, with the ``usage`` known so far if any.
+
+    Nothing was learned about the provider, so a half-open circuit's trial passes to the next call.
+    """
+    breaker.abandon_trial()
+    limiter.settle(reserved, used_tokens(usage) if usage is not None else 0)
+
+async def call(request, tokens: int, max_attempts: int = None):
+    """Run ``request()``, a coroutine function calling the provider, with rate limiting and retries.
+
+    ``tokens`` is the expected token usage of the call. Raises CircuitOpenError while
+    the provider is unhealthy, or the last error once the attempts are used up.
+    """
+    max_attempts = max_attempts or LLM_MAX_ATTEMPTS
+    for attempt in range(1, max_attempts + 1):
+        await acquire(tokens)
+        try:
+            response = await request()
+        except asyncio.CancelledError:
+            record_cancelled(tokens)
+            raise
+        except Exception as e:
+            if not record_failure(e, tokens) or attempt == max_attempts:
+                raise
+            delay = backoff(attempt, e)
+            logger.warning("LLM call failed (%r), retrying in %.1fs (attempt %s of %s)", e, delay, attempt, max_attempts)
+            _stats["retries"] += 1
+            await asyncio.sleep(delay)
+        else:
+            record_success(tokens, getattr(response, "usage", None))
+            return response
+
+def stats() -> dict:
+    """Call counters plus the current circuit state and request rate."""
+    return dict(_stats, circuit=breaker.state, times_opened=breaker.times_opened, requests_per_minute=limiter.rate)
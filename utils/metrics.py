@@ -0,0 +1,234 @@
+"""In-process counters and latency histograms, rendered in the Prometheus text format.
+
+Recording a value is a dict lookup and an addition under an uncontended lock, cheap
+enough for every handler call, query and API request. Values that already live
+elsewhere (queue depth, cache counters) are read through a function when the
+metrics are rendered instead of being kept twice.
+"""
+import asyncio
+import bisect
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans SQLite point queries up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+def _label_key(labelnames: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Called at render time; returns a value, or a dict of label tuples to values
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self):
+        if self.function is None:
+            with self._lock:
+                return list(self._values.items())
+        value = self.function()
+        if isinstance(value, dict):
+            return [(key if isinstance(key, tuple) else (key,), v) for key, v in value.items()]
+        return [((), value)]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """Context manager observing the time spent inside it."""
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, state in self.samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {state[-1]!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            logger.exception("Could not collect metric %s", metric.name)
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class SlowUpdateProfiler:
+    """Samples where in-progress updates are and logs where slow ones spent their time.
+
+    Off unless a threshold is configured. While at least one update is being handled,
+    a background thread records every ``interval`` seconds the chain of coroutines
+    each update's task is running or awaiting; an update that takes longer than
+    ``threshold`` seconds logs its most frequent chains. Awaiting shows up as the
+    awaited call (a Bot API request, a database call), so I/O waits are attributed
+    as well as CPU time.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.005, top: int = 5):
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        # token -> task of every update in progress
+        self._active = {}
+        self._samples = collections.defaultdict(collections.Counter)
+        # Guards _active and _samples, shared with the sampler thread
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler = None
+
+    def begin(self):
+        """Start sampling the calling task; pass the result to end()."""
+        token = object()
+        with self._lock:
+            self._active[token] = asyncio.current_task()
+            self._wakeup.set()
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample, name="slow-update-profiler", daemon=True)
+            self._sampler.start()
+        return token, time.monotonic()
+
+    def end(self, begun, name: str) -> None:
+        token, started = begun
+        with self._lock:
+            self._active.pop(token, None)
+            if not self._active:
+                self._wakeup.clear()
+            stacks = self._samples.pop(token, collections.Counter())
+        elapsed = time.monotonic() - started
+        if elapsed < self.threshold:
+            return
+        total = sum(stacks.values())
+        report = [f"Slow update in {name}: {elapsed:.2f}s, {total} samples"]
+        for stack, count in stacks.most_common(self.top):
+            report.append(f"--- {count / total:.0%} of samples\n{stack}")
+        logger.warning("\n".join(report))
+
+    @staticmethod
+    def _await_chain(coro) -> str:
+        lines = []
+        while coro is not None and len(lines) < 60:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                lines.append(f"  awaiting {type(coro).__name__}")
+                break
+            lines.append(f'  File "{frame.f_code.co_filename}", line {frame.f_lineno}, in {frame.f_code.co_name}')
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+        return "\n".join(lines)
+
+    def _sample(self) -> None:
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                active = list(self._active.items())
+            for token, task in active:
+                if task is None:
+                    continue
+                try:
+                    stack = self._await_chain(task.get_coro())
+                except Exception:
+                    # The task moved on while it was being read
+                    continue
+                with self._lock:
+                    # end() may have collected this update's samples meanwhile
+                    if token in self._active:
+                        self._samples[token][stack] += 1
+            time.sleep(self.interval)
+
+handler_duration = Histogram("essaybot_handler_duration_seconds", "Time spent in an update handler.", ("handler",))
+handler_errors = Counter("essaybot_handler_errors_total", "Update handlers that raised.", ("handler",))
+db_query_duration = Histogram("essaybot_db_query_duration_seconds", "Time a database function ran on the executor.", ("query",))
+db_wait_duration = Histogram("essaybot_db_wait_seconds", "Time a database call waited for a free executor thread.")
+db_errors = Counter("essaybot_db_errors_total", "Database functions that raised.", ("query",))
+llm_request_duration = Histogram("essaybot_llm_request_duration_seconds", "Duration of one model API call.", ("mode",))
+llm_first_token = Histogram("essaybot_llm_first_token_seconds", "Time from a streaming model call to its first text.")
+llm_errors = Counter("essaybot_llm_errors_total", "Failed model API calls.", ("mode", "error"))
+llm_tokens = Counter("essaybot_llm_tokens_total", "Tokens used by model API calls.", ("kind",))
+telegram_request_duration = Histogram("essaybot_telegram_request_duration_seconds", "Duration of one Bot API call.", ("method",))
+telegram_errors = Counter("essaybot_telegram_errors_total", "Bot API calls that failed.", ("method",))
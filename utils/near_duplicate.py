@@ -0,0 +1,160 @@
+"""Find essays that are lightly edited copies of ones evaluated before.
+
+Each essay is reduced to its set of word shingles (every SHINGLE_SIZE consecutive
+words) and a one-permutation MinHash signature of that set: every shingle is hashed
+once with blake2b, the hash picks one of SIGNATURE_SIZE bins, and each bin keeps
+its smallest hash. Two signatures agree in about the Jaccard similarity of the two
+shingle sets. Signatures are split into BANDS bands; essays sharing any band are
+candidates (locality-sensitive hashing), looked up in SQLite through the
+essay_lsh_bands key, and only candidates are compared.
+"""
+import array
+import collections
+import datetime
+import difflib
+import hashlib
+import logging
+import re
+import database
+from config import NEAR_DUPLICATE_ACTION, NEAR_DUPLICATE_THRESHOLD
+from utils import essay_analysis, metrics
+from utils.evaluation_history import topic_hash
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 3
+SIGNATURE_SIZE = 64
+# 16 bands of 4: essays 0.8 similar share a band with near certainty, 0.3 similar one time in eight
+BANDS = 16
+ROWS = SIGNATURE_SIZE // BANDS
+# Bins a short essay leaves empty borrow from the next filled bin, shifted by this per step
+_EMPTY = 2 ** 64 - 1
+_SHIFT = 0x9E3779B97F4A7C15
+
+_WORD = re.compile(r"\w+")
+
+Match = collections.namedtuple("Match", "evaluation_id similarity user_id topic_hash report_version")
+
+near_duplicates = metrics.Counter("essaybot_near_duplicates_total",
+                                  "Essays found to be near copies of evaluated ones, by what was done.", ("action",))
+
+def shingles(essay: str) -> set:
+    words = _WORD.findall(essay.casefold())
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(0, len(words) - SHINGLE_SIZE + 1))}
+
+def signature(essay: str):
+    """The MinHash signature of an essay as SIGNATURE_SIZE unsigned 64-bit values, or None if it is too short."""
+    bins = [_EMPTY] * SIGNATURE_SIZE
+    for shingle in shingles(essay):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little")
+        index = value % SIGNATURE_SIZE
+        if value < bins[index]:
+            bins[index] = value
+    if all(value == _EMPTY for value in bins):
+        return None
+    # Densify: an empty bin takes the next filled bin's value, shifted by the distance
+    for index in range(SIGNATURE_SIZE):
+        step = 0
+        while bins[(index + step) % SIGNATURE_SIZE] == _EMPTY:
+            step += 1
+        if step:
+            bins[index] = (bins[(index + step) % SIGNATURE_SIZE] + step * _SHIFT) % _EMPTY
+    return array.array("Q", bins)
+
+def similarity(a, b) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_SIZE
+
+def band_keys(sig) -> list:
+    """One signed 64-bit key per band, as SQLite stores integers."""
+    return [int.from_bytes(hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8,
+                                           person=band.to_bytes(2, "little")).digest(), "little", signed=True)
+            for band in range(BANDS)]
+
+def index_essay(evaluation_id: int, user_id: int, topic: str, essay: str) -> None:
+    """Add an evaluated essay to the index, unless the user's evaluation of a near copy would be reused for it.
+
+    Evaluations reused for near copies are recorded like any other, and indexing
+    them would stack a second diff note on the next copy's reused evaluation.
+    """
+    sig = signature(essay)
+    if sig is None:
+        return
+    matches = _matches(sig, NEAR_DUPLICATE_THRESHOLD)
+    if _reusable(matches, user_id, topic) is None:
+        database.add_essay_signature(evaluation_id, user_id, topic_hash(topic), essay_analysis.report_version(),
+                                     sig.tobytes(), essay, band_keys(sig))
+
+def find_near_duplicates(essay: str, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> list:
+    """Matches of the indexed essays at least ``threshold`` similar, most similar first."""
+    sig = signature(essay)
+    return [] if sig is None else _matches(sig, threshold)
+
+def find_near_duplicate(essay: str, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+    """Return the Match of the most similar indexed essay at least ``threshold`` similar, or None."""
+    matches = find_near_duplicates(essay, threshold)
+    return matches[0] if matches else None
+
+def _matches(sig, threshold: float) -> list:
+    matches = []
+    for evaluation_id, user_id, candidate_topic, version, blob in database.get_essay_signature_candidates(band_keys(sig)):
+        score = similarity(sig, array.array("Q", blob))
+        if score >= threshold:
+            matches.append(Match(evaluation_id, score, user_id, candidate_topic, version))
+    return sorted(matches, key=lambda match: match.similarity, reverse=True)
+
+def _reusable(matches: list, user_id: int, topic: str):
+    # Only the user's own evaluation on the same topic and in the current report layout:
+    # another user's report and the note's quotes would show them someone else's essay
+    topic_key, version = topic_hash(topic), essay_analysis.report_version()
+    return next((match for match in matches if match.user_id == user_id and match.topic_hash == topic_key
+                 and match.report_version == version), None)
+
+def diff_note(old: str, new: str, score: float, created_at: float) -> str:
+    """Explain that an earlier evaluation is reused, and what changed since that essay."""
+    old_words, new_words = old.split(), new.split()
+    changes = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_words, new_words, autojunk=False).get_opcodes():
+        if tag != "equal":
+            changes.append((" ".join(old_words[i1:i2]), " ".join(new_words[j1:j2])))
+    note = (f"_This essay is {score:.0%} the same as one evaluated on "
+            f"{datetime.datetime.fromtimestamp(created_at).strftime('%d %b %Y')}, so that evaluation is shown._")
+    if changes:
+        shown = [f"• \"{before[:60]}\" → \"{after[:60]}\"" if before and after
+                 else f"• removed \"{before[:60]}\"" if before else f"• added \"{after[:60]}\""
+                 for before, after in changes[:3]]
+        more = f"\n…and {len(changes) - 3} more changes" if len(changes) > 3 else ""
+        note += "\nChanges since then:\n" + "\n".join(shown) + more
+    return note
+
+async def add(evaluation_id: int, user_id: int, topic: str, essay: str) -> None:
+    """Index an evaluated essay; an indexing failure is logged and otherwise ignored."""
+    if NEAR_DUPLICATE_ACTION == "off":
+        return
+    try:
+        await database.run(index_essay, evaluation_id, user_id, topic, essay)
+    except Exception:
+        logger.exception("Could not index the essay of evaluation %s", evaluation_id)
+
+async def reuse(user_id: int, topic: str, essay: str):
+    """The user's earlier evaluation of a near copy of this essay on the same topic, with a note; None to evaluate it.
+
+    Near copies of other users' essays, or on another topic, are only counted and logged.
+    """
+    if NEAR_DUPLICATE_ACTION == "off":
+        return None
+    matches = await database.run(find_near_duplicates, essay)
+    if not matches:
+        return None
+    match = _reusable(matches, user_id, topic) if NEAR_DUPLICATE_ACTION == "reuse" else None
+    if match is None:
+        match = matches[0]
+        near_duplicates.inc(action="flagged")
+        logger.info("Essay is %.0f%% the same as the one of evaluation %s", match.similarity * 100, match.evaluation_id)
+        return None
+    earlier = await database.run(database.get_evaluation_of_essay, match.evaluation_id)
+    if earlier is None:
+        return None
+    created_at, report, earlier_essay = earlier
+    near_duplicates.inc(action="reused")
+    return f"{diff_note(earlier_essay, essay, match.similarity, created_at)}\n\n{report}"
@@ -0,0 +1,127 @@
+"""Paces the Bot API calls that send to a chat, so bursts wait here instead of failing with 429.
+
+The scheduler is the Application's rate limiter: PTB passes every Bot API call
+through process_request(). A call to a chat takes a token from that chat's bucket
+and then from the global one. Waiters are served by priority: replies to users
+first, then notices to the admin, then broadcasts. When Telegram still answers
+429, the chat is paused for the retry_after it gives and the call is made again.
+"""
+import collections
+import datetime
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import (
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_GLOBAL_BURST,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_GROUP_RATE,
+    OUTBOUND_MAX_RETRIES,
+)
+from utils import metrics
+from utils.rate_limit import PriorityTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+INTERACTIVE = 0
+NOTICE = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NOTICE: "notice", BULK: "bulk"}
+
+# Chat buckets kept before idle ones are dropped
+MIN_CHAT_BUCKETS = 1024
+
+_waiting = collections.Counter()
+
+wait_duration = metrics.Histogram("essaybot_outbound_wait_seconds",
+                                  "Time a Bot API call waited for the outbound rate limits.", ("priority",))
+retries = metrics.Counter("essaybot_outbound_retry_after_total", "Bot API calls Telegram answered with 429.",
+                          ("priority",))
+metrics.Gauge("essaybot_outbound_waiting", "Bot API calls waiting for the outbound rate limits.", ("priority",),
+              function=lambda: dict(_waiting))
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """The wait a RetryAfter asks for, in seconds."""
+    if isinstance(error.retry_after, datetime.timedelta):
+        return error.retry_after.total_seconds()
+    return float(error.retry_after)
+
+def rate_limit_args(bot, priority: int) -> dict:
+    """Keyword arguments that give a Bot API call ``priority``; none for a bot without the scheduler."""
+    if isinstance(getattr(bot, "rate_limiter", None), OutboundScheduler):
+        return {"rate_limit_args": {"priority": priority}}
+    return {}
+
+class OutboundScheduler(BaseRateLimiter):
+    """Global and per-chat token buckets with priority classes, for Application.builder().rate_limiter().
+
+    ``rate_limit_args`` of a call may set its ``priority`` (INTERACTIVE by default)
+    and ``max_retries`` after a 429. Calls without a chat, such as answering a
+    callback query, are not held back. The limits are per process.
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, global_burst: float = OUTBOUND_GLOBAL_BURST,
+                 chat_rate: float = OUTBOUND_CHAT_RATE, chat_burst: float = OUTBOUND_CHAT_BURST,
+                 group_rate: float = OUTBOUND_GROUP_RATE, max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.global_bucket = PriorityTokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats = {}
+        self._prune_at = MIN_CHAT_BUCKETS
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def chat_bucket(self, chat_id) -> PriorityTokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._prune_at:
+                # A full bucket is the same as a new one
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle}
+                self._prune_at = max(MIN_CHAT_BUCKETS, 2 * len(self._chats))
+            # Groups and channels have negative ids, or a @username
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = PriorityTokenBucket(self.chat_rate if private else self.group_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        options = rate_limit_args or {}
+        priority = options.get("priority", INTERACTIVE)
+        max_retries = options.get("max_retries", self.max_retries)
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        chat = self.chat_bucket(chat_id)
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            _waiting[label] += 1
+            try:
+                await chat.acquire(priority=priority)
+                await self.global_bucket.acquire(priority=priority)
+            finally:
+                _waiting[label] -= 1
+            wait_duration.observe(time.monotonic() - started, priority=label)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retries.inc(priority=label)
+                delay = retry_after_seconds(e)
+                # Telegram does not say which limit was hit; with the global rate paced
+                # here, it is most likely the chat's
+                chat.pause(delay)
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                logger.info("%s to chat %s was rate limited, retrying in %.1fs", endpoint, chat_id, delay)
@@ -0,0 +1,115 @@
+import functools
+import re
+from dataclasses import dataclass
+from config import MIN_ESSAY_WORDS, RECOMMENDED_ESSAY_WORDS
+
+ACCEPT = 'accept'
+WARN = 'warn'
+REJECT = 'reject'
+
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+_SENTENCE_END = re.compile(r"[.!?]+(?:\s|$)")
+_LINE_BREAKS = re.compile(r"\n+")
+_URL = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+
+# Linking words and phrases examiners look for under Coherence and Cohesion, indexed by
+# their first word so they can be matched in one pass over the word list
+_COHESIVE_DEVICES = {}
+for _phrase in [
+    "however", "moreover", "furthermore", "therefore", "thus", "hence", "consequently",
+    "nevertheless", "nonetheless", "meanwhile", "similarly", "likewise", "additionally",
+    "besides", "instead", "otherwise", "overall", "firstly", "secondly", "thirdly", "finally",
+    "lastly", "although", "whereas", "while", "because", "since", "unless",
+    "in addition", "on the other hand", "on the contrary", "in contrast", "as a result",
+    "for example", "for instance", "such as", "in conclusion", "to conclude", "to sum up",
+    "in summary", "in other words", "due to", "as well as", "not only", "even though",
+    "in fact", "as a consequence", "first of all", "to begin with",
+]:
+    _words = tuple(_phrase.split())
+    _COHESIVE_DEVICES.setdefault(_words[0], []).append(_words)
+del _phrase, _words
+
+# Very common English function words; ordinary English prose is roughly 40% these
+_FUNCTION_WORDS = frozenset("""
+a an the and or but if of to in on at by for with from as is are was were be been being it its this that
+these those there their they them he she we you i his her our your not no do does did have has had will
+would can could should may might must so than then which who whom what when where why how all some more
+most many much such very also only into about over after before because while
+""".split())
+
+@dataclass(frozen=True)
+class EssayMetrics:
+    word_count: int
+    sentence_count: int
+    paragraph_count: int
+    average_sentence_length: float
+    lexical_diversity: float
+    cohesive_devices: int
+    distinct_cohesive_devices: int
+    function_word_ratio: float
+    latin_letter_ratio: float
+    url_count: int
+
+# The handler screens an essay and the worker then builds its prompt from the same metrics,
+# in the same process; parallel mode builds one prompt per criterion
+@functools.lru_cache(maxsize=128)
+def analyze_text(essay: str) -> EssayMetrics:
+    """Compute structural and lexical metrics of an essay without calling the model."""
+    text = essay or ""
+    words = _WORD.findall(text.lower())
+    word_count = len(words)
+    sentence_count = len(_SENTENCE_END.findall(text)) or (1 if word_count else 0)
+    paragraph_count = sum(1 for part in _LINE_BREAKS.split(text) if part.strip())
+    devices = []
+    for i, word in enumerate(words):
+        for phrase in _COHESIVE_DEVICES.get(word, ()):
+            if len(phrase) == 1 or tuple(words[i:i + len(phrase)]) == phrase:
+                devices.append(phrase)
+    letters = sum(len(word) for word in words)
+    latin_letters = sum(len(word) for word in words if word.isascii())
+
+    return EssayMetrics(
+        word_count=word_count,
+        sentence_count=sentence_count,
+        paragraph_count=paragraph_count,
+        average_sentence_length=word_count / sentence_count if sentence_count else 0.0,
+        lexical_diversity=len(set(words)) / word_count if word_count else 0.0,
+        cohesive_devices=len(devices),
+        distinct_cohesive_devices=len(set(devices)),
+        function_word_ratio=sum(1 for word in words if word in _FUNCTION_WORDS) / word_count if word_count else 0.0,
+        latin_letter_ratio=latin_letters / letters if letters else 0.0,
+        url_count=len(_URL.findall(text)) if "://" in text or "www." in text.lower() else 0,
+    )
+
+def screen(metrics: EssayMetrics):
+    """Decide whether an essay is worth a paid evaluation.
+
+    Returns (verdict, message): REJECT with the reason to show the user, WARN with a
+    note to show before evaluating anyway, or ACCEPT with None.
+    """
+    if metrics.url_count and metrics.word_count < MIN_ESSAY_WORDS * 2:
+        return REJECT, "That looks like a link rather than an essay. Please paste the text of your essay."
+    if metrics.word_count < MIN_ESSAY_WORDS:
+        return REJECT, (f"Your essay is only {metrics.word_count} words long. Please send a complete essay; "
+                        f"IELTS Task 2 essays should be at least {RECOMMENDED_ESSAY_WORDS} words.")
+    if metrics.latin_letter_ratio < 0.8 or metrics.function_word_ratio < 0.15:
+        return REJECT, "This doesn't look like an essay written in English. Please send your essay in English."
+    notes = []
+    if metrics.sentence_count < 3:
+        notes.append(f"Note: we found only {metrics.sentence_count} sentence"
+                     f"{'' if metrics.sentence_count == 1 else 's'} in your essay. Sentences without "
+                     "full stops lose marks for Grammatical Range and Accuracy, but we'll evaluate it anyway.")
+    if metrics.word_count < RECOMMENDED_ESSAY_WORDS:
+        notes.append(f"Note: your essay has {metrics.word_count} words. Essays under {RECOMMENDED_ESSAY_WORDS} "
+                     "words lose marks for Task Achievement, but we'll evaluate it anyway.")
+    return (WARN, "\n\n".join(notes)) if notes else (ACCEPT, None)
+
+def to_prompt_context(metrics: EssayMetrics) -> str:
+    """Render the metrics as a compact block the examiner model can rely on."""
+    return (
+        f"Word count: {metrics.word_count}\n"
+        f"Sentences: {metrics.sentence_count} (average {metrics.average_sentence_length:.1f} words)\n"
+        f"Paragraphs: {metrics.paragraph_count}\n"
+        f"Lexical diversity (type-token ratio): {metrics.lexical_diversity:.2f}\n"
+        f"Cohesive devices: {metrics.cohesive_devices} ({metrics.distinct_cohesive_devices} distinct)"
+    )
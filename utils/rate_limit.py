@@ -0,0 +1,114 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+class TokenBucket:
+    """Async token bucket refilled at ``rate`` tokens per second, holding at most ``capacity``.
+
+    Waiters are served in arrival order. A request larger than the capacity is let
+    through once the bucket is full and leaves it in debt, so oversized requests
+    are slowed down rather than blocked forever.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Wait until ``tokens`` can be taken from the bucket, then take them."""
+        async with self._lock:
+            await self._take(tokens)
+
+    async def _take(self, tokens: float) -> None:
+        while True:
+            now = self._refill()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            needed = min(tokens, self.capacity)
+            if self._tokens >= needed:
+                self._tokens -= tokens
+                return
+            await asyncio.sleep((needed - self._tokens) / self.rate)
+
+    def release(self, tokens: float) -> None:
+        """Give back tokens taken by acquire() but not used; a negative amount takes more."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every waiter for ``seconds``, e.g. when the server sent Retry-After."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+class PriorityLock:
+    """An asyncio lock handed to the waiter with the lowest ``priority``, then the earliest."""
+
+    def __init__(self):
+        self._locked = False
+        self._waiters = []
+        self._order = itertools.count()
+
+    def locked(self) -> bool:
+        return self._locked
+
+    async def acquire(self, priority: int = 0) -> None:
+        if not self._locked and not self._waiters:
+            self._locked = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Handed the lock just as we were cancelled: pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """Hand the lock to the next waiter, or unlock it if there is none."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._locked = False
+
+class PriorityTokenBucket(TokenBucket):
+    """TokenBucket whose waiters are served lowest ``priority`` first, then in arrival order.
+
+    A waiter already waiting for a token is not overtaken, so a more urgent one
+    waits at most one refill interval for it.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        super().__init__(rate, capacity)
+        self._lock = PriorityLock()
+
+    async def acquire(self, tokens: float = 1, priority: int = 0) -> None:
+        await self._lock.acquire(priority)
+        try:
+            await self._take(tokens)
+        finally:
+            self._lock.release()
+
+    @property
+    def idle(self) -> bool:
+        """Full, unpaused and with nobody waiting, so it can be dropped and recreated later."""
+        return not self._lock.locked() and time.monotonic() >= self._paused_until and self.available >= self.capacity
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+import database
+from config import PERSISTENCE_UPDATE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class SQLitePersistence(BasePersistence):
+    """Keeps each user's conversation state (context.user_data) in the user_state table.
+
+    State is loaded lazily, one user at a time, when an update from that user arrives,
+    so any process sharing the database picks up where another one left off. Writes
+    are coalesced: the Application hands over the users touched since its last run
+    every ``update_interval`` seconds, unchanged state is skipped, and everything
+    else is written in a single transaction. The bot keeps no chat or bot data and
+    no ConversationHandler, so only user data is stored.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        # user_id -> JSON last read from or written to the database
+        self._stored = {}
+        # user_id -> JSON waiting for the writer
+        self._pending = {}
+        # Users in the batch the writer is saving right now
+        self._writing = set()
+        self._writer = None
+
+    async def get_user_data(self) -> dict:
+        # Nothing is loaded up front, see refresh_user_data()
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        """Load a user's state before a handler sees it, unless this process has newer state."""
+        if user_id in self._stored and not self._in_sync(user_id, user_data):
+            # Changed by an earlier handler and not written yet
+            return
+        stored = await database.run(database.get_user_state, user_id)
+        self._stored[user_id] = stored
+        user_data.clear()
+        if stored:
+            user_data.update(json.loads(stored))
+
+    def _in_sync(self, user_id: int, user_data: dict) -> bool:
+        # Decided here rather than when a write finishes: updates from one user are
+        # handled one at a time, so no handler can be changing this user's state now
+        return (user_id not in self._pending and user_id not in self._writing
+                and json.dumps(user_data, sort_keys=True) == self._stored[user_id])
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        """Stage a user's state for the next batched write."""
+        serialized = json.dumps(data, sort_keys=True)
+        if (user_id not in self._pending and user_id not in self._writing
+                and serialized == self._stored.get(user_id)):
+            return
+        self._pending[user_id] = serialized
+        if self._writer is None or self._writer.done():
+            # Every update_user_data() call of this persistence run lands in the same batch
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stored.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        await database.run(database.delete_user_state, user_id)
+
+    async def flush(self) -> None:
+        """Write everything still pending, e.g. on shutdown or before a serverless reply."""
+        if self._writer is not None:
+            await self._writer
+        if self._pending:
+            await self._write_pending()
+
+    async def _write_pending(self) -> None:
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            self._writing = set(batch)
+            try:
+                await database.run(database.save_user_states, list(batch.items()))
+            except Exception:
+                logger.exception("Failed to persist conversation state of %s users", len(batch))
+                # Keep the batch for the next run, unless newer state arrived meanwhile
+                self._pending = {**batch, **self._pending}
+                return
+            else:
+                self._stored.update(batch)
+            finally:
+                self._writing = set()
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
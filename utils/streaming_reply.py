@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from config import STREAM_EDIT_INTERVAL
+from utils import essay_analysis, llm_resilience
+from utils.outbound_scheduler import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+PLACEHOLDER = "Evaluating your essay... ✍️"
+
+def _split(text: str) -> list:
+    return [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)] or [""]
+
+async def send_text(bot: Bot, chat_id: int, text: str, parse_mode: str = None) -> None:
+    """Send text that may exceed Telegram's message size, falling back to plain text if the markup is invalid."""
+    for chunk in _split(text):
+        try:
+            await bot.send_message(chat_id, chunk, parse_mode=parse_mode)
+        except BadRequest:
+            if parse_mode is None:
+                raise
+            # The model's output is not always valid Telegram Markdown
+            await bot.send_message(chat_id, chunk)
+
+class StreamingReply:
+    """A single Telegram message that shows an evaluation while the model is writing it.
+
+    Edits are throttled to one every ``interval`` seconds to stay within Telegram's
+    edit rate limits; finish() replaces the preview with the formatted result.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, interval: float = STREAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.message = None
+        # Wall-clock time the first model output became visible to the user
+        self.first_output_at = None
+        self._shown = ""
+        self._next_edit = 0.0
+
+    async def stream_analysis(self, topic: str, essay: str, user_id: int = None, job_id: int = None) -> str:
+        """Stream the analysis into the message, falling back to a one-shot call if streaming fails."""
+        self.message = await self.bot.send_message(self.chat_id, PLACEHOLDER)
+        text = ""
+        try:
+            async for delta in essay_analysis.stream_evaluation(topic, essay, user_id, job_id):
+                text += delta
+                await self._maybe_edit(text)
+        except Exception as e:
+            # Failures before any output were already retried; the provider is unhealthy
+            if isinstance(e, llm_resilience.CircuitOpenError) or (not text and llm_resilience.is_retryable(e)):
+                raise
+            logger.warning("Streaming evaluation failed, falling back to a one-shot call", exc_info=True)
+            return await essay_analysis.evaluate(topic, essay, user_id=user_id, job_id=job_id)
+        return text or essay_analysis.ANALYSIS_FAILED_MESSAGE
+
+    async def finish(self, text: str, parse_mode: str = None) -> None:
+        """Replace the preview with the final text, sending any overflow as extra messages."""
+        chunks = _split(text)
+        try:
+            await self._edit(chunks[0], parse_mode)
+        except RetryAfter as e:
+            # The final edit must not be dropped; wait it out once
+            await asyncio.sleep(retry_after_seconds(e))
+            await self._edit(chunks[0], parse_mode)
+        for chunk in chunks[1:]:
+            await send_text(self.bot, self.chat_id, chunk, parse_mode)
+        if self.first_output_at is None:
+            self.first_output_at = time.time()
+
+    async def _maybe_edit(self, text: str) -> None:
+        now = time.monotonic()
+        preview = text[:MAX_MESSAGE_LENGTH].strip()
+        if now < self._next_edit or not preview or preview == self._shown:
+            return
+        self._next_edit = now + self.interval
+        try:
+            await self.bot.edit_message_text(preview, chat_id=self.chat_id, message_id=self.message.message_id)
+        except RetryAfter as e:
+            self._next_edit = now + retry_after_seconds(e)
+            return
+        except TelegramError as e:
+            logger.debug("Skipping streaming edit: %s", e)
+            return
+        self._shown = preview
+        if self.first_output_at is None:
+            self.first_output_at = time.time()
+
+    async def _edit(self, text: str, parse_mode: str = None) -> None:
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message.message_id,
+                                             parse_mode=parse_mode)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            if parse_mode is None:
+                raise
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message.message_id)
@@ -0,0 +1,70 @@
+"""Drop updates Telegram delivers more than once.
+
+Telegram redelivers a webhook update whenever our answer is slow or lost, and a
+redelivered essay would take another use and another model call. Every update's
+update_id is checked against the ids seen recently, in memory and, with
+DEDUP_SHARED_INDEX, in the processed_updates table shared by every worker on the
+database. The check runs in handler group -1, before any other handler.
+"""
+import collections
+import logging
+import time
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+import database
+from config import DEDUP_MAX_UPDATES, DEDUP_SHARED_INDEX, DEDUP_RETENTION
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Prune processed_updates once every this many claims
+PRUNE_EVERY = 1000
+
+duplicates = metrics.Counter("essaybot_duplicates_dropped_total",
+                             "Redelivered updates and repeated essay submissions that were dropped.", ("kind",))
+
+class RecentUpdates:
+    """The last ``capacity`` update ids seen, with O(1) lookups."""
+
+    def __init__(self, capacity: int = DEDUP_MAX_UPDATES):
+        self.capacity = capacity
+        self._ids = set()
+        self._order = collections.deque()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, update_id: int) -> bool:
+        """Remember an update id. Returns False if it was already remembered."""
+        if update_id in self._ids:
+            return False
+        self._ids.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.capacity:
+            self._ids.discard(self._order.popleft())
+        return True
+
+recent = RecentUpdates()
+_claims = 0
+
+metrics.Gauge("essaybot_dedup_recent_updates", "Update ids held in the in-memory dedup index.", function=lambda: len(recent))
+
+async def is_duplicate(update_id: int) -> bool:
+    """Record an update as processed; True if it already was."""
+    global _claims
+    if not recent.add(update_id):
+        return True
+    if not DEDUP_SHARED_INDEX:
+        return False
+    now = time.time()
+    _claims += 1
+    if _claims % PRUNE_EVERY == 0:
+        await database.run(database.prune_processed_updates, now - DEDUP_RETENTION)
+    return not await database.run(database.claim_update, update_id, now)
+
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop handling an update whose update_id was seen before."""
+    if await is_duplicate(update.update_id):
+        duplicates.inc(kind="update")
+        logger.info("Dropped a repeated delivery of update %s", update.update_id)
+        raise ApplicationHandlerStop
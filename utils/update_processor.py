@@ -0,0 +1,51 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+def _user_key(update: object):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handles up to ``max_concurrent_updates`` updates at once, but each user's one at a time.
+
+    Handlers keep the conversation state in context.user_data and SQLitePersistence
+    reloads it between updates, so two updates of the same user must not overlap.
+    They run in arrival order. A user's waiting updates hold a slot each, so someone
+    sending a burst of messages delays others by at most that many slots.
+    """
+
+    __slots__ = ("_locks",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # user or chat id -> [lock, updates holding or waiting for it]
+        self._locks = {}
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = _user_key(update)
+        if key is None:
+            await coroutine
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
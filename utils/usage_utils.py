@@ -1,19 +1,22 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-import database
+from utils import user_cache
+
+async def consume_use(user_id: int):
+    """Atomically take one use, free uses first.
+
+    Returns (bucket, free_uses_left, purchased_uses) after the decrement, or None if
+    the user has no uses left. Pass the bucket to refund_use() if the evaluation fails.
+    """
+    return await user_cache.consume_use(user_id)
+
+async def refund_use(user_id: int, bucket: str) -> None:
+    """Give back a use taken by consume_use()."""
+    await user_cache.refund_use(user_id, bucket)
 
 async def check_and_decrement_uses(user_id: int) -> bool:
     """Check if the user has any uses left and decrement if true."""
-    free_uses_left = database.get_free_uses_left(user_id)
-    purchased_uses = database.get_purchased_uses(user_id)
-    
-    if free_uses_left > 0:
-        database.decrement_free_uses(user_id)
-        return True
-    elif purchased_uses > 0:
-        database.decrement_purchased_uses(user_id)
-        return True
-    return False
+    return await consume_use(user_id) is not None
 
 async def handle_insufficient_uses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text("You've used all your free and purchased attempts. To continue using the service, please purchase more uses.")
\ No newline at end of file
+    await update.message.reply_text("You've used all your free and purchased attempts. To continue using the service, please purchase more uses.")
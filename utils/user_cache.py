@@ -0,0 +1,113 @@
+"""In-process cache of user records in front of the users table.
+
+Entries expire USER_CACHE_TTL seconds after they were read, and beyond
+USER_CACHE_MAX_ENTRIES the least recently used one is dropped. Writes to a user
+go through this module, which updates or drops the cached record once the
+database write has committed, so this process never serves its own stale data.
+A write by another process shows after at most the TTL. Quota checks do not rely
+on the cache: consume_use() always decides in the database.
+"""
+import collections
+import time
+import database
+from config import USER_CACHE_TTL, USER_CACHE_MAX_ENTRIES
+from models.user import User
+from utils import metrics
+
+# user_id -> (expires_at, User), least recently used first
+_entries = collections.OrderedDict()
+
+# Bumped by every write, so a read that overlapped a write is not cached
+_writes = 0
+
+_stats = {"hits": 0, "misses": 0, "expired": 0}
+
+metrics.Counter("essaybot_user_cache_lookups_total",
+                "User cache lookups by result; expired found an entry older than the TTL.",
+                ("result",), function=lambda: dict(_stats))
+metrics.Gauge("essaybot_user_cache_entries", "Users in the in-process user cache.", function=lambda: len(_entries))
+
+def _lookup(user_id: int):
+    entry = _entries.get(user_id)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+    if entry[0] <= time.monotonic():
+        del _entries[user_id]
+        _stats["expired"] += 1
+        return None
+    _entries.move_to_end(user_id)
+    _stats["hits"] += 1
+    return entry[1]
+
+def _store(row, writes: int):
+    if row is None:
+        return None
+    user = User(*row)
+    if writes == _writes:
+        _entries[user.id] = (time.monotonic() + USER_CACHE_TTL, user)
+        _entries.move_to_end(user.id)
+        while len(_entries) > USER_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return user
+
+async def get_user(user_id: int) -> User:
+    """The user's record, or None if there is no such user."""
+    user = _lookup(user_id)
+    if user is None:
+        writes = _writes
+        user = _store(await database.run(database.get_user, user_id), writes)
+    return user
+
+async def get_or_add_user(user_id: int) -> User:
+    """The user's record, adding the user first if they are new."""
+    user = _lookup(user_id)
+    if user is None:
+        writes = _writes
+        user = _store(await database.run(database.get_or_add_user, user_id), writes)
+    return user
+
+def invalidate(user_id: int) -> None:
+    """Drop the user's record, e.g. after a write whose result was not read back."""
+    global _writes
+    _writes += 1
+    _entries.pop(user_id, None)
+
+def _write_through(user_id: int, **fields) -> None:
+    global _writes
+    _writes += 1
+    entry = _entries.get(user_id)
+    if entry is not None:
+        for name, value in fields.items():
+            setattr(entry[1], name, value)
+
+async def update_phone_number(user_id: int, phone_number: str) -> None:
+    await database.run(database.update_phone_number, user_id, phone_number)
+    _write_through(user_id, phone_number=phone_number)
+
+async def add_purchased_uses(user_id: int, amount: int) -> None:
+    await database.run(database.add_purchased_uses, user_id, amount)
+    invalidate(user_id)
+
+async def consume_use(user_id: int):
+    """database.consume_use(), keeping the cached use counts in step."""
+    result = await database.run(database.consume_use, user_id)
+    if result is None:
+        invalidate(user_id)
+    else:
+        _write_through(user_id, free_uses_left=result[1], purchased_uses=result[2])
+    return result
+
+async def refund_use(user_id: int, bucket: str) -> None:
+    await database.run(database.refund_use, user_id, bucket)
+    invalidate(user_id)
+
+def clear() -> None:
+    global _writes
+    _writes += 1
+    _entries.clear()
+
+def stats() -> dict:
+    """Cache counters; expired lookups count as misses in ``hit_rate``."""
+    lookups = _stats["hits"] + _stats["misses"] + _stats["expired"]
+    return dict(_stats, entries=len(_entries), hit_rate=_stats["hits"] / lookups if lookups else 0.0)
@@ -1,28 +1,10 @@
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler
-from models.user import User
-import database
 from handlers.evaluate import handle_evaluate, handle_essay  # Import both functions
 from handlers.feedback import handle_feedback, process_feedback
-
-def get_user(user_id: int) -> User:
-    """Get a user from the database."""
-    user_data = database.get_user(user_id)
-    if user_data:
-        return User(id=user_data[0], 
-                    phone_number=user_data[1], 
-                    usage_count=user_data[2], 
-                    free_uses_left=user_data[3], 
-                    purchased_uses=user_data[4])
-    return None
-
-def add_user(user_id: int) -> None:
-    """Add a new user to the database."""
-    database.add_user(user_id)
-
-def update_phone_number(user_id: int, phone_number: str) -> None:
-    """Update a user's phone number in the database."""
-    database.update_phone_number(user_id, phone_number)
+from handlers.history import handle_history, view_again_button
+from utils import evaluation_history, user_cache
+from utils.usage_utils import consume_use
 
 async def request_phone_number(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Request the user's phone number."""
@@ -35,21 +17,14 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Handle the shared contact information."""
     user_id = update.effective_user.id
     phone_number = update.message.contact.phone_number
-    update_phone_number(user_id, phone_number)
+    await user_cache.update_phone_number(user_id, phone_number)
     await show_main_menu(update, context)
     context.user_data['state'] = None
 
 async def check_uses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Check if the user has any uses left (free or purchased)."""
     user_id = update.effective_user.id
-    free_uses_left = database.get_free_uses_left(user_id)
-    purchased_uses = database.get_purchased_uses(user_id)
-    
-    if free_uses_left > 0:
-        database.decrement_free_uses(user_id)
-        return True
-    elif purchased_uses > 0:
-        database.decrement_purchased_uses(user_id)
+    if await consume_use(user_id) is not None:
         return True
     else:
         await update.message.reply_text("You've used all your free and purchased attempts. To continue using the service, please purchase more uses.")
@@ -97,17 +72,19 @@ async def handle_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE, am
             await update.message.reply_text("Please enter a valid positive number.")
             return
         
-    database.add_purchased_uses(user_id, amount)
+    await user_cache.add_purchased_uses(user_id, amount)
+    context.user_data.pop('state', None)
     
-    await update.message.reply_text(f"Purchase successful! You've added {amount} more uses to your account.")
+    # Also reached from an inline button, where there is no incoming message to reply to
+    await update.effective_message.reply_text(f"Purchase successful! You've added {amount} more uses to your account.")
     await show_main_menu(update, context)
 
 async def handle_check_remaining_uses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the request to check remaining uses."""
     user_id = update.effective_user.id
-    free_uses_left = database.get_free_uses_left(user_id)
-    purchased_uses = database.get_purchased_uses(user_id)
-    
+    user = await user_cache.get_user(user_id)
+    free_uses_left, purchased_uses = (user.free_uses_left, user.purchased_uses) if user else (0, 0)
+
     message = f"You have {free_uses_left} free uses left.\n"
     if purchased_uses > 0:
         message += f"You also have {purchased_uses} purchased uses available."
@@ -119,47 +96,49 @@ async def handle_check_remaining_uses(update: Update, context: ContextTypes.DEFA
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show the main menu."""
-    keyboard = [["Evaluate", "Feedback"], ["Check Remaining Uses"], ["Purchase More Uses"]]
+    keyboard = [["Evaluate", "Feedback"], ["Check Remaining Uses", "History"], ["Purchase More Uses"]]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text('Please choose an option:', reply_markup=reply_markup)
+    await update.effective_message.reply_text('Please choose an option:', reply_markup=reply_markup)
+
+async def handle_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Store the essay topic and ask for the essay."""
+    context.user_data['topic'] = update.message.text
+    previous = await evaluation_history.latest_for_topic(update.effective_user.id, update.message.text)
+    if previous is not None:
+        # Offer the stored report, so an essay is not graded again just to see it
+        await update.message.reply_text("You've had an essay on this topic evaluated before. To read that report, "
+                                        "view it again; to evaluate a new essay, send it now.",
+                                        reply_markup=InlineKeyboardMarkup([[view_again_button(previous)]]))
+    else:
+        await update.message.reply_text('Now, please send me the essay.')
+    context.user_data['state'] = 'waiting_for_essay'
+
+# Menu buttons work in any state
+MENU_ROUTES = {
+    "Evaluate": handle_evaluate,
+    "Feedback": handle_feedback,
+    "Check Remaining Uses": handle_check_remaining_uses,
+    "Purchase More Uses": show_purchase_options,
+    "History": handle_history,
+    # Typed text must not credit uses; purchases go through the inline buttons
+    "Purchase 5 uses": show_purchase_options,
+    "Purchase 10 uses": show_purchase_options,
+    "Back to Main Menu": show_main_menu,
+}
+
+# Any other text is handled according to the state the user is in
+STATE_ROUTES = {
+    'waiting_for_custom_amount': handle_purchase,
+    'waiting_for_topic': handle_topic,
+    'waiting_for_essay': handle_essay,
+    'waiting_for_feedback': process_feedback,
+}
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle user messages based on the current state."""
-    if update.message.text == "Evaluate":
-        await handle_evaluate(update, context)
-    elif update.message.text == "Feedback":
-        await handle_feedback(update, context)
-    elif update.message.text == "Check Remaining Uses":
-        await handle_check_remaining_uses(update, context)
-    elif update.message.text == "Purchase More Uses":
-        await show_purchase_options(update, context)
-    elif update.message.text in ["Purchase 5 uses", "Purchase 10 uses"]:
-        await handle_purchase(update, context)
-    elif update.message.text == "Back to Main Menu":
-        await show_main_menu(update, context)
-    elif context.user_data.get('state') == 'waiting_for_custom_amount':
-        await handle_purchase(update, context)
-    elif context.user_data.get('state') == 'waiting_for_topic':
-        context.user_data['topic'] = update.message.text
-        await update.message.reply_text('Now, please send me the essay.')
-        context.user_data['state'] = 'waiting_for_essay'
-    elif context.user_data.get('state') == 'waiting_for_essay':
-        await handle_essay(update, context)
-    elif context.user_data.get('state') == 'waiting_for_feedback':
-        await process_feedback(update, context)
+    route = MENU_ROUTES.get(update.message.text) or STATE_ROUTES.get(context.user_data.get('state'))
+    if route is not None:
+        await route(update, context)
     else:
         await update.message.reply_text("I'm sorry, I didn't understand that command. Please use the menu options.")
         await show_main_menu(update, context)
-
-async def check_and_decrement_uses(user_id: int) -> bool:
-    """Check if the user has any uses left and decrement if true."""
-    free_uses_left = database.get_free_uses_left(user_id)
-    purchased_uses = database.get_purchased_uses(user_id)
-    
-    if free_uses_left > 0:
-        database.decrement_free_uses(user_id)
-        return True
-    elif purchased_uses > 0:
-        database.decrement_purchased_uses(user_id)
-        return True
-    return False
\ No newline at end of file